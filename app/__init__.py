@@ -5,10 +5,11 @@ import sys
 import flask
 import safrs
 from flask import Flask
-from safrs import SAFRSAPI
 from flask_migrate import Migrate
 from app.models import db, Thing, SubThing, Person, Book, Review, Publisher,ThingWOCommit, ThingWCommit, ThingWType, AuthUser, PKItem, UserWithJsonapiAttr, UserWithPerms
 from app.models_stateless import Test
+from app import compact, compression, encoding, fragments, invalidation, negotiation, response_cache, statement_cache, table_versions
+from app.jsonapi import JsonApi
 #from app.models import db, Thing, SubThing
 
 migrate = Migrate()
@@ -19,7 +20,15 @@ def create_api(app, swagger_host=None, swagger_port=5000):
             "info": {"title": "New Title"},
             "securityDefinitions": {"ApiKeyAuth": {"type": "apiKey" , "in" : "header", "name": "My-ApiKey"}}
         }  # Customized swagger will be merged
-    api = SAFRSAPI(app, app_db=db, host=swagger_host, port=swagger_port, custom_swagger=custom_swagger, decorators=[safrs.test_decorator])
+    api = JsonApi(app, app_db=db, host=swagger_host, port=swagger_port, custom_swagger=custom_swagger, decorators=[safrs.test_decorator])
+    statement_cache.install(db.engine)
+    response_cache.install()
+    fragments.install()
+    invalidation.install(db.engine)
+    table_versions.install(db.engine)
+    encoding.install(app)
+    negotiation.install(app)
+    compact.install(app)
     api.expose_object(Thing)
     api.expose_object(ThingWType)
     api.expose_object(SubThing)
@@ -57,6 +66,9 @@ def create_api(app, swagger_host=None, swagger_port=5000):
         # Create an API endpoint
         api.expose_object(model)
 
+    # after the models are exposed: the swagger document is compressed once
+    compression.install(app)
+
 
 def create_app():
     """This app factory omits starting SAFRSAPI to enable running the shell etc in a simpler way"""
@@ -1,14 +1,128 @@
 import safrs
 from flask_sqlalchemy import SQLAlchemy
 from safrs import SAFRSBase, SAFRSAPI
+from safrs.config import get_config, get_request_param
+from safrs.jsonapi_context import maybe_jsonapi_context
 from safrs.util import classproperty
+from sqlalchemy.orm.base import NO_VALUE
+from sqlalchemy.orm.interfaces import MANYTOONE
+
+from app import compact
+from app.compound import Included
+from app.expressions import filter_expressions
+from app.instances import resolved
+from app.jsonapi import RestAPI, RestRelationshipAPI
+from app.linkage import related_linkage, relationship_object, to_one_linkage
+from app.loading import prefetched
+from app.serializers import serializer
 
 safrs.DB = db = SQLAlchemy()
 
 #db = safrs.DB
 
 
-class BaseModel(safrs.SAFRSBase, db.Model):
+class ApiMixin:
+    """
+        Select the endpoint classes of app.jsonapi for the exposed models,
+        models that don't derive from BaseModel should inherit this mixin
+    """
+
+    _rest_api = RestAPI
+    _relationship_api = RestRelationshipAPI
+    # collection count strategy: exact, estimated, window or none (cfr. app.counting)
+    _s_count_strategy = "exact"
+    # to-many relationship name -> number of ids to link when it's not included (cfr. app.linkage)
+    _s_relationship_counts = {}
+    # cache the GET responses when a cache backend is configured (cfr. app.response_cache)
+    _s_cache_responses = False
+
+    @classmethod
+    def get_instance(cls, item=None, failsafe=False):
+        """
+            Use the instances resolved for the relationship payload (cfr. app.instances)
+        """
+        instance = resolved(cls, item)
+        if instance is not None:
+            return instance
+        return super().get_instance(item, failsafe)
+
+    @classmethod
+    def jsonapi_filter(cls):
+        """
+            Apply the filter[...] parameters of the jsonapi_attrs that declare
+            a SQL expression as well, safrs ignores those (cfr. app.expressions)
+        """
+        return filter_expressions(super().jsonapi_filter(), cls, get_request_param("filters", {}))
+
+    def _s_jsonapi_encode(self):
+        """
+            Encode with the serializer compiled when the model was exposed (cfr. app.serializers),
+            the resources of models that aren't compiled are made compact afterwards (cfr. app.compact)
+        """
+        compiled = serializer(type(self))
+        if compiled is not None:
+            return compiled.encode(self)
+        resource = super()._s_jsonapi_encode()
+        if compact.requested():
+            return compact.compact_resource(resource, self._s_get_include_settings()[1])
+        return resource
+
+    def to_dict(self, *args, **kwargs):
+        """
+            Encode the attributes with the compiled serializer (cfr. app.serializers)
+        """
+        compiled = serializer(type(self))
+        if compiled is None:
+            return super().to_dict(*args, **kwargs)
+        return compiled.attributes_dict(self)
+
+    def _s_get_related(self):
+        """
+            Link the to-one relationships that aren't included from the foreign keys
+            and add the prefetched count and linkage of the counted to-many relationships
+            (cfr. app.linkage)
+        """
+        compiled = serializer(type(self))
+        relationships = compiled.related(self) if compiled is not None else super()._s_get_related()
+        for rel_name, rel_data in relationships.items():
+            relationship = self.__mapper__.relationships.get(rel_name)
+            if relationship is None or relationship.direction != MANYTOONE or rel_data.get("data") is not None:
+                continue
+            data = to_one_linkage(self, relationship)
+            if data is not NO_VALUE:
+                rel_data["data"] = data
+        linkage = related_linkage(self)
+        if not linkage:
+            return relationships
+        ctx = maybe_jsonapi_context()
+        for rel_name, (count, ids) in linkage.items():
+            if rel_name not in relationships:
+                continue
+            Target = self.__mapper__.relationships[rel_name].mapper.class_
+            limit = ctx.get_relationship_page_limit(rel_name) if ctx is not None else int(get_config("DEFAULT_PAGE_LIMIT"))
+            relationships[rel_name] = relationship_object(relationships[rel_name], Target, count, ids, limit)
+        return relationships
+
+    def _s_related_collection_data(self, rel_name, next_included_list):
+        """
+            Use the relationship items that were prefetched for the included
+            dynamic relationships (cfr. app.loading) instead of querying them
+        """
+        items = prefetched(self, rel_name)
+        if items is None or not get_config("ENABLE_RELATIONSHIPS"):
+            return super()._s_related_collection_data(rel_name, next_included_list)
+
+        ctx = maybe_jsonapi_context()
+        limit = ctx.get_relationship_page_limit(rel_name) if ctx is not None else int(get_config("DEFAULT_PAGE_LIMIT"))
+        meta = {"count": len(items), "total": len(items), "limit": limit}
+        if len(items[:limit]) >= get_config("BIG_QUERY_THRESHOLD"):
+            meta["warning"] = f'Truncated result for relationship "{rel_name}",consider paginating this request'
+            safrs.log.warning(meta["warning"])
+        data = [Included(item, next_included_list) for item in items[:limit]]
+        return data, meta
+
+
+class BaseModel(ApiMixin, safrs.SAFRSBase, db.Model):
     __abstract__ = True
     # Enables us to handle db session ourselves
     db_commit = False
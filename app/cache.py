@@ -0,0 +1,519 @@
+"""
+Cache backends
+
+The caches of the API (cfr. app.response_cache and app.fragments) store
+pre-encoded bytes in a backend with this interface:
+
+    get(key)                          -> bytes or None
+    set(key, value, tags=(), ttl=None)
+    invalidate(tags)                  drop the entries that were set with any of the tags
+    clear()
+
+Keys and tags are strings, the tags are the tables or rows an entry depends
+on. Backends never raise: a backend that fails logs a warning and
+behaves like an empty cache, so a cache outage only costs performance.
+
+- `MemoryCache`: in-process LRU cache with a byte budget
+- `SharedMemoryCache`: a memory-mapped file with a byte budget, shared by
+  the processes (e.g. gunicorn workers) of a host
+- `RedisCache`: a Redis server (or anything that speaks its protocol, RESP),
+  shared by all processes. The client is built in so redis-py isn't needed.
+  Every tag is a Redis set with the keys of its entries.
+
+`create_backend(url)` creates the backend of a configuration value:
+
+    memory                    MemoryCache
+    shm:///dev/shm/safrs-api  SharedMemoryCache in that file
+    redis://[:password@]host[:port][/db]
+"""
+import hashlib
+import mmap
+import os
+import socket
+import struct
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from urllib.parse import unquote, urlparse
+
+import safrs
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover
+    fcntl = None
+
+# byte budget of the MemoryCache when it isn't configured
+MAX_BYTES = 64 * 1024 * 1024
+REDIS_PORT = 6379
+REDIS_TIMEOUT = 1.0
+
+
+class MemoryCache:
+    """
+    In-process LRU cache, the least recently used entries are evicted when the
+    keys and values take more than `max_bytes`, expired entries are removed
+    when they're read
+    """
+
+    def __init__(self, max_bytes=MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.size = 0
+        # key -> (value, tags, expiry time or None)
+        self._entries = OrderedDict()
+        # tag -> set of keys
+        self._tags = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[2] is not None and entry[2] < time.monotonic():
+                self._remove(key)
+                return None
+            self._entries.move_to_end(key)
+            return entry[0]
+
+    def set(self, key, value, tags=(), ttl=None):
+        size = len(key) + len(value)
+        if size > self.max_bytes:
+            return
+        expires = time.monotonic() + ttl if ttl else None
+        with self._lock:
+            self._remove(key)
+            self._entries[key] = (value, tuple(tags), expires)
+            self.size += size
+            for tag in tags:
+                self._tags.setdefault(tag, set()).add(key)
+            while self.size > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+
+    def invalidate(self, tags):
+        with self._lock:
+            for tag in tags:
+                for key in self._tags.pop(tag, ()):
+                    self._remove(key)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._tags.clear()
+            self.size = 0
+
+    def _remove(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        value, tags, _ = entry
+        self.size -= len(key) + len(value)
+        for tag in tags:
+            keys = self._tags.get(tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._tags[tag]
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class SharedMemoryCache:
+    """
+    Cache in a memory-mapped file (e.g. in /dev/shm) that's shared by the
+    processes of a host, every worker that opens the same `path` sees the
+    same entries
+
+    The file holds a header, a hash index with open addressing and a data
+    area. The entries are appended to the data area, when it's full (or the
+    index is too crowded) the most recently used entries that fit in half of
+    the data area are compacted and the others are evicted. Removed entries
+    leave a tombstone in the index until the next compaction. Every slot of
+    the index has a bloom filter of the tags of its entry, so `invalidate`
+    only reads the tags of the entries that may have them.
+
+    All operations hold an exclusive flock on the file (and a thread lock).
+    The size of the file is fixed by the process that creates it.
+    """
+
+    MAGIC = b"SAFRSC01"
+    # magic, slot count, data size, data used, access clock, live entries, tombstones
+    HEADER = struct.Struct("<8sQQQQQQ")
+    # key hash, tags bloom, offset, length, state, last access, expiry time
+    SLOT = struct.Struct("<QQQIIQd")
+    # key, tags and value lengths
+    RECORD = struct.Struct("<III")
+    EMPTY, USED, TOMBSTONE = 0, 1, 2
+    # bytes of data per slot of the index
+    BYTES_PER_SLOT = 512
+    MAX_LOAD = 0.7
+
+    def __init__(self, path, max_bytes=MAX_BYTES):
+        if fcntl is None:  # pragma: no cover
+            raise RuntimeError("SharedMemoryCache requires fcntl")
+        self.path = path
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._pid = None
+        self._open()
+
+    def _open(self):
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        try:
+            size = os.fstat(fd).st_size
+            if size < self.HEADER.size or os.pread(fd, len(self.MAGIC), 0) != self.MAGIC:
+                slot_count = max(64, self.max_bytes // self.BYTES_PER_SLOT)
+                size = max(self.max_bytes, self.HEADER.size + slot_count * self.SLOT.size + 4096)
+                os.ftruncate(fd, 0)
+                os.ftruncate(fd, size)
+                data_size = size - self.HEADER.size - slot_count * self.SLOT.size
+                os.pwrite(fd, self.HEADER.pack(self.MAGIC, slot_count, data_size, 0, 0, 0, 0), 0)
+            self._map = mmap.mmap(fd, size)
+        finally:
+            fcntl.flock(fd, fcntl.LOCK_UN)
+        self._fd = fd
+        self._pid = os.getpid()
+        _, self.slot_count, self.data_size, *_ = self.HEADER.unpack_from(self._map, 0)
+        self._index = self.HEADER.size
+        self._data = self._index + self.slot_count * self.SLOT.size
+
+    def close(self):
+        self._map.close()
+        os.close(self._fd)
+
+    @contextmanager
+    def _locked(self):
+        with self._lock:
+            if self._pid != os.getpid():
+                # the flock of a forked process would be shared with its parent
+                self.close()
+                self._open()
+            fcntl.flock(self._fd, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+    # header fields
+    def _header(self):
+        return list(self.HEADER.unpack_from(self._map, 0))
+
+    def _set_header(self, header):
+        self.HEADER.pack_into(self._map, 0, *header)
+
+    # index slots
+    def _slot(self, i):
+        return self.SLOT.unpack_from(self._map, self._index + i * self.SLOT.size)
+
+    def _set_slot(self, i, *slot):
+        self.SLOT.pack_into(self._map, self._index + i * self.SLOT.size, *slot)
+
+    @staticmethod
+    def _hash(key):
+        return int.from_bytes(hashlib.blake2b(key, digest_size=8).digest(), "little")
+
+    @staticmethod
+    def _bloom(tag):
+        # two bits of 64 per tag
+        digest = hashlib.blake2b(tag.encode("utf-8"), digest_size=2).digest()
+        return (1 << (digest[0] & 63)) | (1 << (digest[1] & 63))
+
+    def _record(self, offset):
+        key_length, tags_length, value_length = self.RECORD.unpack_from(self._map, self._data + offset)
+        start = self._data + offset + self.RECORD.size
+        key = self._map[start : start + key_length]
+        tags = self._map[start + key_length : start + key_length + tags_length]
+        value_start = start + key_length + tags_length
+        return key, tags, value_start, value_length
+
+    def _find(self, key, key_hash):
+        """
+        :return: (index of the slot of `key` or None, index of the slot where `key` can be inserted)
+        """
+        free = None
+        i = key_hash % self.slot_count
+        for _ in range(self.slot_count):
+            slot_hash, _, offset, _, state, _, _ = self._slot(i)
+            if state == self.EMPTY:
+                return None, free if free is not None else i
+            if state == self.TOMBSTONE:
+                if free is None:
+                    free = i
+            elif slot_hash == key_hash and self._record(offset)[0] == key:
+                return i, i
+            i = (i + 1) % self.slot_count
+        return None, free
+
+    def _remove_slot(self, i, header):
+        slot = list(self._slot(i))
+        slot[4] = self.TOMBSTONE
+        self._set_slot(i, *slot)
+        header[5] -= 1
+        header[6] += 1
+
+    def get(self, key):
+        key = key.encode("utf-8")
+        with self._locked():
+            header = self._header()
+            i, _ = self._find(key, self._hash(key))
+            if i is None:
+                return None
+            slot_hash, bloom, offset, length, state, _, expires = self._slot(i)
+            if expires and expires < time.time():
+                self._remove_slot(i, header)
+                self._set_header(header)
+                return None
+            header[4] += 1
+            self._set_slot(i, slot_hash, bloom, offset, length, state, header[4], expires)
+            self._set_header(header)
+            _, _, value_start, value_length = self._record(offset)
+            return self._map[value_start : value_start + value_length]
+
+    def set(self, key, value, tags=(), ttl=None):
+        key = key.encode("utf-8")
+        encoded_tags = "\0".join(tags).encode("utf-8")
+        length = self.RECORD.size + len(key) + len(encoded_tags) + len(value)
+        if length > self.data_size // 2:
+            return
+        bloom = 0
+        for tag in tags:
+            bloom |= self._bloom(tag)
+        key_hash = self._hash(key)
+        with self._locked():
+            header = self._header()
+            i, _ = self._find(key, key_hash)
+            if i is not None:
+                self._remove_slot(i, header)
+            if header[3] + length > self.data_size or header[5] + header[6] + 1 > self.slot_count * self.MAX_LOAD:
+                self._set_header(header)
+                self._compact(length)
+                header = self._header()
+            _, free = self._find(key, key_hash)
+            if free is None:
+                return
+            if self._slot(free)[4] == self.TOMBSTONE:
+                header[6] -= 1
+            offset = header[3]
+            start = self._data + offset
+            self.RECORD.pack_into(self._map, start, len(key), len(encoded_tags), len(value))
+            start += self.RECORD.size
+            self._map[start : start + len(key) + len(encoded_tags) + len(value)] = key + encoded_tags + value
+            header[3] += length
+            header[4] += 1
+            header[5] += 1
+            self._set_slot(free, key_hash, bloom, offset, length, self.USED, header[4], time.time() + ttl if ttl else 0.0)
+            self._set_header(header)
+
+    def _compact(self, needed):
+        """
+        Keep the most recently used entries that fit in half of the data area (minus `needed`)
+        """
+        now = time.time()
+        live = []
+        for i in range(self.slot_count):
+            slot = self._slot(i)
+            if slot[4] == self.USED and not (slot[6] and slot[6] < now):
+                live.append(slot)
+        live.sort(key=lambda slot: slot[5], reverse=True)
+        budget = (self.data_size - needed) // 2
+        kept = []
+        for slot in live:
+            if slot[3] > budget or len(kept) + 1 > self.slot_count * self.MAX_LOAD / 2:
+                break
+            budget -= slot[3]
+            kept.append((slot, self._map[self._data + slot[2] : self._data + slot[2] + slot[3]]))
+        self._map[self._index : self._data] = bytes(self._data - self._index)
+        header = self._header()
+        offset = 0
+        for (key_hash, bloom, _, length, state, access, expires), record in kept:
+            self._map[self._data + offset : self._data + offset + length] = record
+            i = key_hash % self.slot_count
+            while self._slot(i)[4] != self.EMPTY:
+                i = (i + 1) % self.slot_count
+            self._set_slot(i, key_hash, bloom, offset, length, state, access, expires)
+            offset += length
+        header[3], header[5], header[6] = offset, len(kept), 0
+        self._set_header(header)
+
+    def invalidate(self, tags):
+        tags = set(tags)
+        blooms = [self._bloom(tag) for tag in tags]
+        with self._locked():
+            header = self._header()
+            for i in range(self.slot_count):
+                slot = self._slot(i)
+                if slot[4] != self.USED or not any(slot[1] & bloom == bloom for bloom in blooms):
+                    continue
+                entry_tags = self._record(slot[2])[1].decode("utf-8").split("\0")
+                if tags.intersection(entry_tags):
+                    self._remove_slot(i, header)
+            self._set_header(header)
+
+    def clear(self):
+        with self._locked():
+            header = self._header()
+            self._map[self._index : self._data] = bytes(self._data - self._index)
+            header[3], header[5], header[6] = 0, 0, 0
+            self._set_header(header)
+
+    def __len__(self):
+        with self._locked():
+            return self._header()[5]
+
+
+class RedisError(Exception):
+    """
+    Error reply of the Redis server
+    """
+
+
+class RedisConnection:
+    """
+    Minimal RESP2 client, the commands are sent one at a time
+    """
+
+    def __init__(self, host="localhost", port=REDIS_PORT, db=0, password=None, timeout=REDIS_TIMEOUT):
+        self.host = host
+        self.port = port
+        self.db = db
+        self.password = password
+        self.timeout = timeout
+        self._socket = None
+        self._reader = None
+
+    def _connect(self):
+        self._socket = socket.create_connection((self.host, self.port), timeout=self.timeout)
+        self._reader = self._socket.makefile("rb")
+        if self.password:
+            self._command("AUTH", self.password)
+        if self.db:
+            self._command("SELECT", self.db)
+
+    def close(self):
+        if self._socket is not None:
+            self._reader.close()
+            self._socket.close()
+        self._socket = self._reader = None
+
+    @staticmethod
+    def _encode(args):
+        parts = [b"*%d\r\n" % len(args)]
+        for arg in args:
+            if not isinstance(arg, bytes):
+                arg = str(arg).encode("utf-8")
+            parts.append(b"$%d\r\n%s\r\n" % (len(arg), arg))
+        return b"".join(parts)
+
+    def _read(self):
+        line = self._reader.readline()
+        if not line.endswith(b"\r\n"):
+            raise ConnectionError("Connection closed by the Redis server")
+        kind, payload = line[:1], line[1:-2]
+        if kind == b"+":
+            return payload.decode("utf-8")
+        if kind == b"-":
+            raise RedisError(payload.decode("utf-8"))
+        if kind == b":":
+            return int(payload)
+        if kind == b"$":
+            length = int(payload)
+            if length < 0:
+                return None
+            data = self._reader.read(length + 2)
+            return data[:-2]
+        if kind == b"*":
+            length = int(payload)
+            return None if length < 0 else [self._read() for _ in range(length)]
+        raise ConnectionError(f"Invalid Redis reply {line!r}")
+
+    def _command(self, *args):
+        self._socket.sendall(self._encode(args))
+        return self._read()
+
+    def command(self, *args):
+        """
+        :return: the reply of the command, the connection is reopened once when it was closed
+        """
+        if self._socket is None:
+            self._connect()
+            return self._command(*args)
+        try:
+            return self._command(*args)
+        except (ConnectionError, OSError):
+            self.close()
+            self._connect()
+            return self._command(*args)
+
+
+class RedisCache:
+    """
+    Cache in a Redis server, the keys are prefixed with `prefix`
+    """
+
+    def __init__(self, connection, prefix="safrs:"):
+        self.connection = connection
+        self.prefix = prefix
+        self._lock = threading.Lock()
+
+    def _command(self, *args):
+        with self._lock:
+            try:
+                return self.connection.command(*args)
+            except (RedisError, ConnectionError, OSError) as exc:
+                self.connection.close()
+                safrs.log.warning(f"Redis cache command {args[0]} failed: {exc}")
+                return None
+
+    def _tag(self, tag):
+        return f"{self.prefix}tag:{tag}"
+
+    def get(self, key):
+        return self._command("GET", self.prefix + key)
+
+    def set(self, key, value, tags=(), ttl=None):
+        if ttl:
+            self._command("SET", self.prefix + key, value, "PX", int(ttl * 1000))
+        else:
+            self._command("SET", self.prefix + key, value)
+        for tag in tags:
+            self._command("SADD", self._tag(tag), self.prefix + key)
+            if ttl:
+                # the tag outlives its entries
+                self._command("PEXPIRE", self._tag(tag), int(ttl * 1000))
+
+    def invalidate(self, tags):
+        for tag in tags:
+            keys = self._command("SMEMBERS", self._tag(tag)) or []
+            self._command("DEL", self._tag(tag), *keys)
+
+    def clear(self):
+        keys = self._command("KEYS", self.prefix + "*") or []
+        if keys:
+            self._command("DEL", *keys)
+
+
+def create_backend(url, max_bytes=None):
+    """
+    :param url: "memory", a shm:// or a redis:// URL
+    :param max_bytes: byte budget of the memory and shared memory caches
+    :return: the cache backend, None if `url` is empty
+    """
+    if not url:
+        return None
+    if url == "memory":
+        return MemoryCache(int(max_bytes) if max_bytes else MAX_BYTES)
+    parsed = urlparse(url)
+    if parsed.scheme == "shm" and parsed.path:
+        return SharedMemoryCache(parsed.path, int(max_bytes) if max_bytes else MAX_BYTES)
+    if parsed.scheme != "redis":
+        raise ValueError(f"Invalid cache URL {url}")
+    connection = RedisConnection(
+        host=parsed.hostname or "localhost",
+        port=parsed.port or REDIS_PORT,
+        db=int(parsed.path.lstrip("/") or 0),
+        password=unquote(parsed.password) if parsed.password else None,
+    )
+    return RedisCache(connection)
@@ -0,0 +1,197 @@
+"""
+Arrow IPC stream and Parquet exports, cfr. app.export
+
+When pyarrow is installed the export routes also support
+
+    GET /Reviews/_export?format=arrow|parquet&filter[...]=...&sort=...&fields[Review]=...
+
+The selected attributes are queried as columns (`with_entities`) instead of
+ORM instances and every batch of BATCH_SIZE rows is transposed into typed
+arrow arrays, so there's no per-row dict or instance. The arrow types are
+derived from the SQLAlchemy column types (cfr. _arrow_type), JSON values are
+exported as JSON encoded strings and values of other types as strings.
+Only columns and jsonapi_attrs with a SQL expression (cfr. app.expressions)
+can be exported, other jsonapi_attrs are left out.
+
+The Parquet export writes a row group per batch, its footer is written when
+all rows have been fetched.
+"""
+import io
+import json
+
+from sqlalchemy import Column
+from sqlalchemy.sql import sqltypes
+
+from app import counting
+from app.expressions import attr_expression
+from app.instances import jsonapi_id
+from app.streaming import StreamedPage
+
+try:
+    import pyarrow
+    import pyarrow.ipc
+    import pyarrow.parquet
+except ImportError:  # pragma: no cover
+    pyarrow = None
+
+ARROW = "arrow"
+PARQUET = "parquet"
+MEDIA_TYPES = {ARROW: "application/vnd.apache.arrow.stream", PARQUET: "application/vnd.apache.parquet"}
+BATCH_SIZE = 10000
+
+
+def available():
+    """
+    :return: True if pyarrow is installed
+    """
+    return pyarrow is not None
+
+
+def _string(value):
+    return value if value is None or type(value) is str else str(value)
+
+
+def _json(value):
+    return None if value is None else json.dumps(value, default=str)
+
+
+def _arrow_type(sql_type):
+    """
+    :return: the arrow type of the values of `sql_type` and the converter of the values
+    """
+    if isinstance(sql_type, sqltypes.Boolean):
+        return pyarrow.bool_(), None
+    if isinstance(sql_type, sqltypes.SmallInteger):
+        return pyarrow.int16(), None
+    if isinstance(sql_type, sqltypes.Integer):
+        return pyarrow.int64(), None
+    if isinstance(sql_type, sqltypes.Float):
+        return pyarrow.float64(), None
+    if isinstance(sql_type, sqltypes.Numeric) and sql_type.precision is not None:
+        return pyarrow.decimal128(sql_type.precision, sql_type.scale or 0), None
+    if isinstance(sql_type, sqltypes.DateTime):
+        return pyarrow.timestamp("us", tz="UTC" if sql_type.timezone else None), None
+    if isinstance(sql_type, sqltypes.Date):
+        return pyarrow.date32(), None
+    if isinstance(sql_type, sqltypes.Time):
+        return pyarrow.time64("us"), None
+    if isinstance(sql_type, sqltypes.JSON):
+        return pyarrow.string(), _json
+    if isinstance(sql_type, sqltypes.LargeBinary):
+        return pyarrow.binary(), None
+    return pyarrow.string(), _string
+
+
+class _Sink(io.RawIOBase):
+    """
+    File the arrow writers write to, the written bytes are collected until they're drained
+    """
+
+    def __init__(self):
+        super().__init__()
+        self._parts = []
+        self._position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        data = bytes(data)
+        self._parts.append(data)
+        self._position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._position
+
+    def drain(self):
+        data = b"".join(self._parts)
+        self._parts = []
+        return data
+
+
+class BatchWriter:
+    """
+    Writes the batches of a columnar export
+    """
+
+    def __init__(self, Model, columns, export_format):
+        """
+        :param columns: names of the attributes to export, cfr. export.export_columns
+        """
+        self.Model = Model
+        self.pk_columns = list(Model.__mapper__.primary_key)
+        self.pk_keys = [Model.__mapper__.get_property_by_column(column).key for column in self.pk_columns]
+        # (name, attribute key, expression, converter) of the exported attributes
+        self.selected = []
+        fields = [("id", pyarrow.string())]
+        for name in columns:
+            attr = Model._s_jsonapi_attrs[name]
+            if isinstance(attr, Column):
+                key = Model.__mapper__.get_property_by_column(attr).key
+                expression = getattr(Model, key)
+            else:
+                key, expression = name, attr_expression(Model, name)
+                if expression is None:
+                    continue
+            arrow_type, converter = _arrow_type(expression.type)
+            self.selected.append((name, key, expression, converter))
+            fields.append((name, arrow_type))
+        self.schema = pyarrow.schema(fields)
+        self._sink = _Sink()
+        if export_format == PARQUET:
+            self._writer = pyarrow.parquet.ParquetWriter(self._sink, self.schema)
+        else:
+            self._writer = pyarrow.ipc.new_stream(self._sink, self.schema)
+
+    def chunks(self, query):
+        """
+        :param query: filtered and sorted query (or a list of instances)
+        :return: generator of lists of row tuples: the primary key values, then the exported values
+        """
+        if not hasattr(query, "with_entities"):
+            keys = self.pk_keys + [key for _, key, _, _ in self.selected]
+            rows = [tuple(getattr(instance, key) for key in keys) for instance in query]
+            for start in range(0, len(rows), BATCH_SIZE):
+                yield rows[start : start + BATCH_SIZE]
+            return
+        expressions = [getattr(self.Model, key) for key in self.pk_keys] + [expression for _, _, expression, _ in self.selected]
+        page = StreamedPage(query.with_entities(*expressions), self.Model, counting.NONE, 0, None, chunk_size=BATCH_SIZE)
+        yield from page.chunks()
+
+    def header(self):
+        """
+        :return: the bytes written before the first batch
+        """
+        return self._sink.drain()
+
+    def write(self, rows):
+        """
+        :return: the encoded batch of `rows`
+        """
+        values = list(zip(*rows))
+        pk_count = len(self.pk_columns)
+        if pk_count == 1:
+            ids = [str(value) for value in values[0]]
+        else:
+            ids = [jsonapi_id(self.Model, self.pk_columns, row[:pk_count]) for row in rows]
+        arrays = [pyarrow.array(ids, type=pyarrow.string())]
+        for (name, _, _, converter), column in zip(self.selected, values[pk_count:]):
+            if converter is not None:
+                column = [converter(value) for value in column]
+            arrays.append(pyarrow.array(column, type=self.schema.field(name).type))
+        self._writer.write_batch(pyarrow.record_batch(arrays, schema=self.schema))
+        return self._sink.drain()
+
+    def close(self):
+        """
+        :return: the bytes written after the last batch
+        """
+        self._writer.close()
+        return self._sink.drain()
+
+    def error(self):
+        """
+        :return: nothing, the stream or file of a failed export isn't closed
+        """
+        return b""
@@ -0,0 +1,136 @@
+"""
+Compact documents
+
+Every resource carries a self link and every relationship a links object and
+a data block, for narrow clients these are often more bytes than the
+attributes. Clients that don't follow the links can request the compact
+profile, either with the JSON:API profile media type parameter
+
+    Accept: application/vnd.api+json; profile="urn:safrs-example:profile:compact"
+
+or with the query flag `compact-document=1` (e.g. for browsers). The resources
+of compact documents only contain their type, id, attributes and the data of
+the relationships that were requested with include=:
+
+    {"type": "Book", "id": "1", "attributes": {...}, "relationships": {"reader": {"data": {...}}}}
+
+The self links and relationship links aren't generated at all, relationships
+that aren't included aren't resolved (nor counted, cfr. app.linkage). The
+document level links (pagination) are relative, like in the full documents.
+The responses to compact requests have the profile in their Content-Type.
+Other requests get the full safrs documents.
+
+Flask: `install` adds the response hook. FastAPI: app.fastapi_app.ProfileMiddleware.
+"""
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+import safrs
+from flask import has_request_context, request
+from safrs.jsonapi_context import maybe_jsonapi_context
+from werkzeug.http import parse_list_header, parse_options_header
+
+PROFILE = "urn:safrs-example:profile:compact"
+QUERY_PARAM = "compact-document"
+JSONAPI_MEDIA_TYPE = "application/vnd.api+json"
+MEDIA_TYPE = f'{JSONAPI_MEDIA_TYPE}; profile="{PROFILE}"'
+TRUE_VALUES = ("", "1", "true", "yes")
+
+# the Accept header of the current FastAPI request
+_accept = ContextVar("compact_accept", default=None)
+
+
+def accepts_profile(accept):
+    """
+    :param accept: value of the Accept header
+    :return: True if the client requests the compact profile
+    """
+    if not accept:
+        return False
+    for media_range in parse_list_header(accept):
+        mimetype, options = parse_options_header(media_range)
+        if mimetype == JSONAPI_MEDIA_TYPE and PROFILE in options.get("profile", "").split():
+            return True
+    return False
+
+
+@contextmanager
+def profile_scope(accept):
+    """
+    Scope of a request that isn't a flask request, cfr. app.fastapi_app.ProfileMiddleware
+
+    :param accept: value of the Accept header
+    """
+    token = _accept.set(accept or "")
+    try:
+        yield
+    finally:
+        _accept.reset(token)
+
+
+def profile_requested(flag, accept):
+    """
+    :param flag: value of the query flag, None when it isn't in the query string
+    :param accept: value of the Accept header
+    :return: True if the compact documents are requested
+    """
+    if flag is not None:
+        return flag.lower() in TRUE_VALUES
+    return accepts_profile(accept)
+
+
+def _requested(ctx):
+    if ctx is not None:
+        flag = ctx.query_params.get(QUERY_PARAM)
+    else:
+        flag = request.args.get(QUERY_PARAM) if has_request_context() else None
+    accept = _accept.get()
+    if accept is None and has_request_context():
+        accept = request.headers.get("Accept")
+    return profile_requested(flag, accept)
+
+
+def requested(ctx=None):
+    """
+    :param ctx: safrs JsonApiContext, the context of the current request when it's None
+    :return: True if the documents of the current request should be compact
+    """
+    ctx = ctx if ctx is not None else maybe_jsonapi_context()
+    if ctx is None:
+        return _requested(None)
+    compact = getattr(ctx, "_compact_document", None)
+    if compact is None:
+        compact = ctx._compact_document = _requested(ctx)
+    return compact
+
+
+def compact_resource(resource, rel_names):
+    """
+    :param resource: resource object encoded by safrs
+    :param rel_names: the names of the included relationships
+    :return: the compact form of `resource`
+    """
+    result = {"type": resource["type"], "id": resource["id"], "attributes": resource.get("attributes", {})}
+    include_all = safrs.SAFRS.INCLUDE_ALL in rel_names
+    relationships = {
+        rel_name: {"data": rel_data.get("data")}
+        for rel_name, rel_data in resource.get("relationships", {}).items()
+        if include_all or rel_name in rel_names
+    }
+    if relationships:
+        result["relationships"] = relationships
+    return result
+
+
+def _set_profile(response):
+    if response.mimetype == JSONAPI_MEDIA_TYPE and not getattr(response, "msgpack", False) and requested():
+        response.headers["Content-Type"] = MEDIA_TYPE
+        response.vary.add("Accept")
+    return response
+
+
+def install(app):
+    """
+    Label the compact responses of the flask `app` with the profile
+    """
+    app.after_request(_set_profile)
@@ -0,0 +1,293 @@
+"""
+Compound documents: the included[] resources of a response
+
+safrs keeps the included instances in request scoped sets
+(`ctx.ja_included`, `ctx.ja_data`, aliased as `g.ja_included`, `g.ja_data`):
+
+- `Included(instance, paths)` overwrites `instance.included_list`, so when a
+  resource is reached through several include paths (e.g. include=
+  books.reader,reviews.reader.books_read) only the paths of the last edge
+  are followed, and an instance that's also primary data is encoded with the
+  nested paths of the edge instead of the include= of the request
+- the included resources are popped from a set, so their order changes
+  between identical requests (and with it the body and its ETag)
+
+`CompoundDocument` replaces both sets for the current request:
+
+- resources are keyed by (type, id) and encoded at most once, later edges to
+  a resource are a dict lookup
+- the include paths of all edges to a resource are merged before it's
+  encoded; when an edge adds paths after it was encoded, the related
+  resources of these paths are included and the linkage of the relationships
+  is merged into the included resource (primary data has already been
+  rendered by then, only the related resources are added)
+- included[] is ordered by the first edge to every resource
+
+The builder is created on first use by `document()`, it installs itself
+as `ctx.ja_included` and `ctx.ja_data`, so SAFRSBase._s_jsonapi_encode and
+the `Included.encode()` of safrs (which renders included[]) use it as well.
+app.serializers and ApiMixin use the `Included` of this module.
+"""
+from collections import deque
+
+import safrs
+from flask import g, has_request_context
+from safrs.base import Included as SAFRSIncluded
+from safrs.jsonapi_context import maybe_jsonapi_context
+
+PENDING = "pending"
+ENCODING = "encoding"
+INCLUDED = "included"
+DATA = "data"
+
+
+def _key(instance):
+    return instance._s_type, str(instance.jsonapi_id)
+
+
+def _covered(paths, path):
+    """
+    :return: True if following `paths` includes everything `path` includes
+    """
+    if safrs.SAFRS.INCLUDE_ALL in paths and "." not in path:
+        return True
+    prefix = path + "."
+    return any(included == path or included.startswith(prefix) for included in paths)
+
+
+def _merge(paths, new_paths):
+    """
+    :return: the paths of `new_paths` that aren't covered by `paths`, which are appended to `paths`
+    """
+    missing = []
+    for path in new_paths:
+        if not _covered(paths, path) and not _covered(missing, path):
+            missing.append(path)
+    paths.extend(missing)
+    return missing
+
+
+class _Resource:
+    __slots__ = ("instance", "paths", "state", "resource")
+
+    def __init__(self, instance, paths, state):
+        self.instance = instance
+        self.paths = paths
+        self.state = state
+        self.resource = None
+
+
+class _IncludedView:
+    """
+    `ctx.ja_included`: the resources that still have to be encoded
+    """
+
+    def __init__(self, builder):
+        self._builder = builder
+
+    def add(self, instance):
+        # safrs.base.Included stores the paths on the instance
+        paths = instance.__dict__.pop("included_list", None) or []
+        self._builder.include(instance, list(paths))
+
+    def pop(self):
+        instance = self._builder.pop()
+        if instance is None:
+            raise KeyError("pop from an empty set")
+        return instance
+
+    def __bool__(self):
+        return self._builder.pending()
+
+    def __len__(self):
+        return int(self._builder.pending())
+
+
+class _EncodedView:
+    """
+    `ctx.ja_data`: the resources that have been encoded, as primary data or included
+    """
+
+    def __init__(self, builder):
+        self._builder = builder
+
+    def add(self, instance):
+        self._builder.encoded(instance, None)
+
+    def __contains__(self, instance):
+        return self._builder.is_encoded(instance)
+
+
+class CompoundDocument:
+    """
+    Request scoped builder of the included[] resources
+    """
+
+    def __init__(self):
+        # (type, id) -> _Resource, in the order of the first edge to the resource
+        self._resources = {}
+        self._pending = deque()
+        # resources that keep their instance and resource object until `release()`
+        self._retained = []
+        self.included_view = _IncludedView(self)
+        self.encoded_view = _EncodedView(self)
+
+    def include(self, instance, paths):
+        """
+        Include `instance` and the relationships of `paths` (e.g. ["reader.reviews"])
+        """
+        key = _key(instance)
+        entry = self._resources.get(key)
+        if entry is None:
+            self._resources[key] = _Resource(instance, list(paths), PENDING)
+            self._pending.append(key)
+            return
+        missing = _merge(entry.paths, paths)
+        # pending resources are encoded with the merged paths, `encoded()` handles the ones being encoded
+        if missing and entry.state in (INCLUDED, DATA):
+            self._extend(entry, missing)
+
+    def pending(self):
+        """
+        :return: True if there are included resources that haven't been encoded
+        """
+        pending = self._pending
+        while pending and self._resources[pending[0]].state != PENDING:
+            pending.popleft()
+        return bool(pending)
+
+    def pop(self):
+        """
+        :return: the next included instance to encode, None if there's none
+        """
+        if not self.pending():
+            return None
+        entry = self._resources[self._pending.popleft()]
+        entry.state = ENCODING
+        entry.instance.included_list = list(entry.paths)
+        return entry.instance
+
+    def encoded(self, instance, resource):
+        """
+        Record that `instance` was encoded as `resource`
+
+        :param resource: the jsonapi resource object, None if it can't be updated anymore
+        """
+        key = _key(instance)
+        entry = self._resources.get(key)
+        if entry is None:
+            # primary data that isn't included elsewhere
+            entry = self._resources[key] = _Resource(instance, None, PENDING)
+        elif entry.state in (INCLUDED, DATA):
+            return
+        requested = entry.paths or []
+        # included resources are encoded with their `included_list`, primary data with the include= of the request
+        entry.paths = list(instance._s_get_include_settings()[0])
+        if entry.state == ENCODING:
+            entry.state = INCLUDED
+            entry.resource = resource
+        else:
+            entry.state = DATA
+        self._retained.append(entry)
+        missing = _merge(entry.paths, requested)
+        if missing:
+            self._extend(entry, missing)
+
+    def is_encoded(self, instance):
+        """
+        :return: True if `instance` was encoded as primary data or included
+        """
+        entry = self._resources.get(_key(instance))
+        return entry is not None and entry.state in (INCLUDED, DATA)
+
+    def _extend(self, entry, paths):
+        """
+        Include the relationships of `paths` of an encoded resource
+        """
+        instance = entry.instance
+        if instance is None:
+            return
+        instance.included_list = paths
+        try:
+            related = instance._s_get_related()
+        finally:
+            instance.included_list = entry.paths
+        if entry.resource is None:
+            return
+        rel_names = {path.split(".")[0] for path in paths}
+        relationships = entry.resource.setdefault("relationships", {})
+        for rel_name, rel_data in related.items():
+            if rel_name in rel_names or safrs.SAFRS.INCLUDE_ALL in rel_names:
+                relationships[rel_name] = rel_data
+
+    def snapshot(self):
+        """
+        :return: the state of the builder, cfr. `restore`
+        """
+        resources = [
+            (key, entry, entry.instance, list(entry.paths) if entry.paths is not None else None, entry.state, entry.resource)
+            for key, entry in self._resources.items()
+        ]
+        return resources, list(self._pending), list(self._retained)
+
+    def restore(self, snapshot):
+        """
+        Reset the builder to a `snapshot`, e.g. to encode a document again after an encoder failed halfway
+        """
+        resources, pending, retained = snapshot
+        self._resources = {}
+        for key, entry, instance, paths, state, resource in resources:
+            entry.instance, entry.paths, entry.state, entry.resource = instance, paths, state, resource
+            self._resources[key] = entry
+        self._pending = deque(pending)
+        self._retained = retained
+
+    def release(self):
+        """
+        Drop the instances and resource objects of the encoded resources, e.g. after
+        they've been streamed. Their keys are kept, later edges to these resources
+        only include the related resources that weren't included yet.
+        """
+        for entry in self._retained:
+            entry.instance = entry.resource = None
+        self._retained = []
+
+
+def document(ctx=None):
+    """
+    :param ctx: safrs JsonApiContext, the context of the current request when it's None
+    :return: the CompoundDocument of the request, None outside of a jsonapi request
+    """
+    ctx = ctx if ctx is not None else maybe_jsonapi_context()
+    if ctx is None:
+        return None
+    builder = getattr(ctx, "_compound_document", None)
+    if builder is not None:
+        return builder
+    builder = ctx._compound_document = CompoundDocument()
+    encoded, included = ctx.ja_data, ctx.ja_included
+    ctx.ja_data, ctx.ja_included = builder.encoded_view, builder.included_view
+    if has_request_context() and getattr(g, "ja_included", None) is included:
+        g.ja_data, g.ja_included = ctx.ja_data, ctx.ja_included
+    for instance in encoded:
+        builder.encoded(instance, None)
+    for instance in included:
+        builder.included_view.add(instance)
+    return builder
+
+
+class Included(SAFRSIncluded):
+    """
+    Relationship item that's included in the compound document of the request
+    """
+
+    def __init__(self, instance, included_list):
+        """
+        :param included_list: the paths to include for `instance`, as lists of relationship names
+        """
+        builder = document()
+        if builder is None:
+            super().__init__(instance, included_list)
+            return
+        self.instance = instance
+        builder.include(instance, [".".join(path) for path in included_list])
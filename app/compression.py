@@ -0,0 +1,276 @@
+"""
+Response compression
+
+Responses with a compressible media type (JSON, msgpack, NDJSON, CSV, text,
+the arrow stream) of at least COMPRESSION_MIN_SIZE bytes (cfr. config) are
+compressed with the content coding the client prefers in Accept-Encoding:
+
+    zstd   when zstandard is installed
+    br     when brotli is installed
+    gzip
+
+(in this order of preference when the client accepts them equally).
+
+- Streamed responses (cfr. app.streaming and app.export) are compressed
+  chunk by chunk regardless of their size, every chunk is flushed so the
+  client can decode it as soon as it's received.
+- The bytes of a compressed response differ from the identity response, so
+  its strong ETag (cfr. app.conditional) is sent as a weak ETag, like nginx
+  does. If-None-Match uses the weak comparison so both forms are matched,
+  304 responses echo the form the client sent.
+- Static-per-deploy artifacts (the swagger/OpenAPI document) are rendered once
+  at startup and compressed in every coding with the highest levels, cfr.
+  `Artifacts`, they're served from memory afterwards.
+
+Flask: `install` adds the request hooks. FastAPI: app.fastapi_app.CompressionMiddleware.
+"""
+import gzip
+import zlib
+
+from flask import request
+from safrs.config import get_config
+from werkzeug.datastructures import Accept
+from werkzeug.http import parse_accept_header, parse_etags, quote_etag, unquote_etag
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:  # pragma: no cover
+    zstandard = None
+
+ZSTD = "zstd"
+BR = "br"
+GZIP = "gzip"
+# levels of the responses that are compressed per request and of the artifacts
+LEVELS = {ZSTD: 3, BR: 4, GZIP: 6}
+ARTIFACT_LEVELS = {ZSTD: 19, BR: 11, GZIP: 9}
+
+COMPRESSION_MIN_SIZE = 1024
+COMPRESSIBLE = {
+    "application/json",
+    "application/vnd.api+json",
+    "application/vnd.api+msgpack",
+    "application/x-ndjson",
+    "application/vnd.apache.arrow.stream",
+    "application/javascript",
+    "application/xml",
+    "image/svg+xml",
+}
+ARTIFACT_PATHS = ("/swagger.json",)
+
+
+def codings():
+    """
+    :return: the available content codings, in order of preference
+    """
+    return [coding for coding, module in ((ZSTD, zstandard), (BR, brotli), (GZIP, gzip)) if module is not None]
+
+
+def negotiate(accept_encoding):
+    """
+    :param accept_encoding: value of the Accept-Encoding header
+    :return: the content coding to use, None for the identity coding
+    """
+    if not accept_encoding:
+        return None
+    return parse_accept_header(accept_encoding, Accept).best_match(codings())
+
+
+def compressible(content_type):
+    """
+    :return: True if responses with `content_type` should be compressed
+    """
+    if not content_type:
+        return False
+    mimetype = content_type.split(";")[0].strip().lower()
+    return mimetype.startswith("text/") or mimetype in COMPRESSIBLE
+
+
+def min_size():
+    """
+    :return: the size of the smallest response that's compressed
+    """
+    configured = get_config("COMPRESSION_MIN_SIZE")
+    return int(configured) if configured is not None else COMPRESSION_MIN_SIZE
+
+
+def compress(data, coding, level=None):
+    """
+    :return: `data` compressed with `coding`
+    """
+    level = LEVELS[coding] if level is None else level
+    if coding == ZSTD:
+        return zstandard.ZstdCompressor(level=level).compress(data)
+    if coding == BR:
+        return brotli.compress(data, quality=level)
+    return gzip.compress(data, compresslevel=level, mtime=0)
+
+
+class _GzipStream:
+    def __init__(self, level):
+        self._compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+    def compress(self, data):
+        return self._compressor.compress(data) + self._compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self):
+        return self._compressor.flush()
+
+
+class _BrotliStream:
+    def __init__(self, level):
+        self._compressor = brotli.Compressor(quality=level)
+
+    def compress(self, data):
+        return self._compressor.process(data) + self._compressor.flush()
+
+    def finish(self):
+        return self._compressor.finish()
+
+
+class _ZstdStream:
+    def __init__(self, level):
+        self._compressor = zstandard.ZstdCompressor(level=level).compressobj()
+
+    def compress(self, data):
+        return self._compressor.compress(data) + self._compressor.flush(zstandard.COMPRESSOBJ_FLUSH_BLOCK)
+
+    def finish(self):
+        return self._compressor.flush()
+
+
+_STREAMS = {ZSTD: _ZstdStream, BR: _BrotliStream, GZIP: _GzipStream}
+
+
+def stream_compressor(coding):
+    """
+    :return: compressor with `compress(chunk)`, which returns the flushed compressed chunk, and `finish()`
+    """
+    return _STREAMS[coding](LEVELS[coding])
+
+
+def compress_chunks(chunks, coding):
+    """
+    :param chunks: iterable of bytes
+    :return: generator of the compressed chunks
+    """
+    compressor = stream_compressor(coding)
+    try:
+        for chunk in chunks:
+            if chunk:
+                yield compressor.compress(chunk)
+        yield compressor.finish()
+    finally:
+        close = getattr(chunks, "close", None)
+        if close is not None:
+            close()
+
+
+def weak_etag(etag):
+    """
+    :param etag: value of an ETag header
+    :return: the weak form of the ETag
+    """
+    return etag if etag.startswith("W/") else f"W/{etag}"
+
+
+def not_modified_etag(etag, if_none_match):
+    """
+    :param etag: value of the ETag header of a 304 response
+    :return: the ETag in the form the client sent it in If-None-Match
+    """
+    tag, weak = unquote_etag(etag)
+    if tag is None or weak or not parse_etags(if_none_match).is_weak(tag):
+        return etag
+    return quote_etag(tag, weak=True)
+
+
+class Artifacts:
+    """
+    Rendered static-per-deploy documents and their compressed forms
+    """
+
+    def __init__(self):
+        self._artifacts = {}
+
+    def add(self, path, body, content_type):
+        """
+        Compress the `body` of `path` in every available coding
+        """
+        encoded = {coding: compress(body, coding, ARTIFACT_LEVELS[coding]) for coding in codings()}
+        encoded[None] = body
+        self._artifacts[path] = (content_type, encoded)
+
+    def get(self, path, coding):
+        """
+        :return: the content type and body of the artifact for `coding`, None if `path` isn't cached
+        """
+        artifact = self._artifacts.get(path)
+        if artifact is None:
+            return None
+        content_type, encoded = artifact
+        return content_type, encoded[coding]
+
+    def __contains__(self, path):
+        return path in self._artifacts
+
+
+def _serve_artifact(app, artifacts):
+    if request.method != "GET" or request.query_string or request.path not in artifacts:
+        return None
+    coding = negotiate(request.headers.get("Accept-Encoding"))
+    content_type, body = artifacts.get(request.path, coding)
+    response = app.response_class(body, content_type=content_type)
+    if coding is not None:
+        response.headers["Content-Encoding"] = coding
+    response.vary.add("Accept-Encoding")
+    return response
+
+
+def _compress_response(response):
+    if request.method == "HEAD" or "Content-Encoding" in response.headers or response.direct_passthrough:
+        return response
+    coding = negotiate(request.headers.get("Accept-Encoding"))
+    if response.status_code == 304:
+        if coding is not None and "ETag" in response.headers:
+            response.headers["ETag"] = not_modified_etag(response.headers["ETag"], request.headers.get("If-None-Match"))
+        return response
+    if not compressible(response.content_type):
+        return response
+    response.vary.add("Accept-Encoding")
+    if coding is None or response.status_code < 200 or response.status_code in (204, 206):
+        return response
+    if response.is_streamed:
+        # streamed bodies are compressed regardless of their size
+        response.response = compress_chunks(response.response, coding)
+        response.headers.pop("Content-Length", None)
+    else:
+        data = response.get_data()
+        if len(data) < min_size():
+            return response
+        response.set_data(compress(data, coding))
+    response.headers["Content-Encoding"] = coding
+    if "ETag" in response.headers:
+        response.headers["ETag"] = weak_etag(response.headers["ETag"])
+    return response
+
+
+def install(app, artifact_paths=ARTIFACT_PATHS):
+    """
+    Compress the responses of the flask `app`, the `artifact_paths` are
+    rendered and compressed now so the routes have to be added already
+    """
+    artifacts = Artifacts()
+    app.before_request(lambda: _serve_artifact(app, artifacts))
+    app.after_request(_compress_response)
+    with app.test_client() as client:
+        for path in artifact_paths:
+            # requested without Accept-Encoding, so it's rendered uncompressed
+            response = client.get(path)
+            if response.status_code == 200:
+                artifacts.add(path, response.get_data(), response.content_type)
+    return artifacts
@@ -0,0 +1,196 @@
+"""
+ETags and conditional GETs (If-None-Match -> 304 Not Modified)
+
+Instance and collection GETs return a strong ETag, polling clients send it
+back in If-None-Match and get a 304 without a body while the document didn't
+change.
+
+When the document only depends on the rows of its resources the ETag is
+computed from the row versions, before anything is loaded or serialized:
+
+- the row version is the column named by the model's `_s_version_column`
+  (e.g. an updated-at column or a version counter), or the postgres `xmin`
+  system column when the model doesn't have one
+- instances: `SELECT "Books".xmin::text FROM "Books" WHERE id = ...`,
+  a single indexed lookup
+- collections: the primary keys and versions of the rows of the requested
+  page (filtered, sorted and paginated like the page itself) and the count,
+  only queried ahead of the page when the request has an If-None-Match
+  header: otherwise the versions are loaded with the page and the ETag is
+  computed after the page was fetched
+
+together with the request URL (so the include, fields, filter, sort and page
+parameters), the attributes that can be read, the negotiated media type
+(cfr. app.negotiation) and profile (cfr. app.compact).
+
+When the table versions are maintained by triggers (cfr. app.table_versions)
+the collections and the instance documents that also depend on other tables
+(include=, relationship counts cfr. app.linkage) get an ETag computed from the
+versions of the tables they depend on instead, one primary key lookup that
+doesn't depend on the size of the page.
+
+Documents with attributes that aren't columns, keyset pages and databases
+without versions get the hash of the rendered document as ETag instead,
+these are only answered with a 304 after they've been rendered. Streamed
+collections (cfr. app.streaming) only get an ETag from the versions.
+"""
+import hashlib
+
+from flask import current_app, request
+from sqlalchemy import Column, literal_column
+from werkzeug.http import generate_etag, parse_etags
+
+from app import compact, counting, encoding, negotiation, table_versions
+from app.export import export_columns
+from app.linkage import counted_relationships
+from app.loading import include_paths
+
+
+def version_expression(Model, session):
+    """
+    :return: the SQL expression of the row version of `Model`, None if there's none
+    """
+    version_column = getattr(Model, "_s_version_column", None)
+    if version_column:
+        return getattr(Model, version_column)
+    dialect = session.get_bind().dialect
+    if dialect.name != "postgresql":
+        return None
+    return literal_column(f"{dialect.identifier_preparer.format_table(Model.__table__)}.xmin::text")
+
+
+def _columns_only(Model, ctx):
+    return all(isinstance(Model._s_jsonapi_attrs[name], Column) for name in export_columns(Model, ctx))
+
+
+def row_versioned(Model, ctx):
+    """
+    :param ctx: safrs JsonApiContext of the current request
+    :return: True if the documents of `Model` only depend on the rows of their resources
+    """
+    if include_paths(ctx) or counted_relationships(Model, ctx):
+        return False
+    return _columns_only(Model, ctx)
+
+
+def table_versioned(Model, ctx):
+    """
+    :return: True if the documents of `Model` only depend on the tables of app.table_versions.dependencies
+    """
+    return table_versions.complete() and _columns_only(Model, ctx)
+
+
+def _table_etag(Model, ctx, url, session):
+    versions = table_versions.versions(table_versions.dependencies(Model, ctx), session, ctx)
+    return _etag(Model, ctx, url, sorted(versions.items())) if versions is not None else None
+
+
+def _etag(Model, ctx, url, *versions):
+    shape = [url, export_columns(Model, ctx), negotiation.msgpack_requested(), compact.requested(ctx)]
+    return hashlib.blake2b(encoding.compact([shape, versions]), digest_size=16).hexdigest()
+
+
+def instance_etag(Model, object_id, ctx, url):
+    """
+    :param url: the request URL
+    :return: the ETag of the instance document computed from its row version or from the table
+             versions, None if the document isn't versioned or the instance doesn't exist
+    """
+    query = Model._s_query
+    if not row_versioned(Model, ctx):
+        return _table_etag(Model, ctx, url, query.session) if table_versioned(Model, ctx) else None
+    version = version_expression(Model, query.session)
+    if version is None:
+        return None
+    try:
+        primary_keys = Model.id_type.get_pks(object_id)
+    except Exception:
+        # the GET itself reports the invalid id
+        return None
+    row = query.filter_by(**primary_keys).with_entities(version).first()
+    if row is None:
+        return None
+    return _etag(Model, ctx, url, object_id, row[0])
+
+
+def collection_etag(query, Model, ctx, strategy, offset, limit, url, row_versions=True):
+    """
+    :param query: filtered and sorted query, without loader options
+    :param limit: page size, None for the complete collection
+    :param row_versions: query the row versions of the page, else only the table versions are used
+                         and the row versions are loaded with the page, cfr. `with_versions`
+    :return: the ETag of the collection page computed from the table versions or the row versions,
+             None if the document isn't versioned
+    """
+    if not hasattr(query, "with_entities"):
+        return None
+    etag = _table_etag(Model, ctx, url, query.session) if table_versioned(Model, ctx) else None
+    if etag is not None:
+        return etag
+    if not row_versions or not row_versioned(Model, ctx):
+        return None
+    version = version_expression(Model, query.session)
+    if version is None:
+        return None
+    versions = query.with_entities(*Model.__mapper__.primary_key, version)
+    # the window count equals the exact count, the window query would only return the first column
+    rows, count, has_more = counting.fetch_page(versions, Model, counting.EXACT if strategy == counting.WINDOW else strategy, offset, limit)
+    return _etag(Model, ctx, url, [list(row) for row in rows], count, has_more)
+
+
+def with_versions(query, Model, ctx):
+    """
+    :param query: the page query
+    :return: the query of the (instance, row version) rows of `query`, `query` itself if the page isn't row versioned
+    """
+    if not hasattr(query, "add_columns") or not row_versioned(Model, ctx):
+        return query
+    version = version_expression(Model, query.session)
+    return query if version is None else query.add_columns(version)
+
+
+def page_etag(Model, ctx, url, rows, count, has_more):
+    """
+    :param rows: the (instance, row version) rows of the page, cfr. `with_versions`
+    :return: the instances of the page and its ETag, the `collection_etag` of the page
+    """
+    versions = [[*Model.__mapper__.primary_key_from_instance(instance), version] for instance, version in rows]
+    return [instance for instance, _ in rows], _etag(Model, ctx, url, versions, count, has_more)
+
+
+def document_etag(body):
+    """
+    :return: the ETag of a rendered document
+    """
+    return generate_etag(body)
+
+
+def matches(if_none_match, etag):
+    """
+    :param if_none_match: value of the If-None-Match header
+    :return: True if the client already has the document with `etag`
+    """
+    return parse_etags(if_none_match).contains_weak(etag)
+
+
+def not_modified(etag):
+    """
+    :return: the flask 304 response of `etag`
+    """
+    response = current_app.response_class(status=304)
+    response.set_etag(etag)
+    return response
+
+
+def conditional_response(response, etag=None):
+    """
+    Set the ETag of a flask `response`, it's turned into a 304 when it matches If-None-Match
+
+    :param etag: ETag computed from the row versions, the rendered document is hashed when it's None
+    """
+    if etag is not None:
+        response.set_etag(etag)
+    elif response.status_code == 200 and not response.is_streamed:
+        response.set_etag(document_etag(response.get_data()))
+    return response.make_conditional(request)
+
@@ -0,0 +1,151 @@
+"""
+Count strategies for collection GETs
+
+safrs performs a `SELECT count(*)` over the filtered query for every collection
+GET (SAFRSBase._s_count), on big tables this often costs more than the page
+itself. The strategy is configured per model with `_s_count_strategy` and can
+be overridden per request with the page[count] url parameter:
+
+- exact: `SELECT count(*)` over the filtered query (safrs' behavior)
+- estimated: the planner estimate: pg_class.reltuples for unfiltered queries,
+  the row estimate of `EXPLAIN` for filtered queries
+- window: `count(*) OVER ()` is added to the page query, saving a round trip
+- none: no count at all, meta.count is null and the `last` link is omitted
+
+The strategy that was used is reported in meta.count_strategy.
+"""
+import json
+
+import safrs
+import sqlalchemy.orm.collections
+from safrs.errors import ValidationError
+from sqlalchemy import func, text
+
+EXACT = "exact"
+ESTIMATED = "estimated"
+WINDOW = "window"
+NONE = "none"
+COUNT_STRATEGIES = (EXACT, ESTIMATED, WINDOW, NONE)
+PAGE_COUNT = "page[count]"
+
+
+def count_strategy(Model, ctx):
+    """
+    :param Model: exposed SAFRSBase subclass
+    :param ctx: safrs JsonApiContext of the current request
+    :return: the count strategy requested with page[count], or the model default
+    """
+    strategy = dict(ctx.query_multi_items()).get(PAGE_COUNT) or getattr(Model, "_s_count_strategy", EXACT)
+    if strategy not in COUNT_STRATEGIES:
+        raise ValidationError(f"Invalid {PAGE_COUNT} value '{strategy}', expected one of {', '.join(COUNT_STRATEGIES)}")
+    return strategy
+
+
+def _is_list(query):
+    return isinstance(query, (list, tuple, sqlalchemy.orm.collections.InstrumentedList))
+
+
+def _as_list(query):
+    """
+    jsonapi_filter returns an instance instead of a query for filter[id]=<id>
+    """
+    if _is_list(query):
+        return list(query)
+    return [] if query is None else [query]
+
+
+def estimated_count(query, Model):
+    """
+    :return: the planner's estimate of the number of rows returned by `query`,
+             falls back to an exact count if the database isn't postgres
+    """
+    session = query.session
+    dialect = session.get_bind().dialect
+    if dialect.name != "postgresql":
+        safrs.log.debug(f"Count estimates not implemented for {dialect.name}")
+        return query.count()
+
+    if query.whereclause is None:
+        table = dialect.identifier_preparer.format_table(Model.__table__)
+        estimate = session.execute(
+            text("SELECT reltuples::bigint FROM pg_class WHERE oid = to_regclass(:table)"), {"table": table}
+        ).scalar()
+        # reltuples is -1 (or 0 on older versions) for tables that haven't been analyzed yet
+        if estimate is not None and estimate > 0:
+            return int(estimate)
+
+    compiled = query.statement.compile(dialect=dialect, compile_kwargs={"render_postcompile": True})
+    plan = session.connection().exec_driver_sql(f"EXPLAIN (FORMAT JSON) {compiled}", compiled.params).scalar()
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return int(plan[0]["Plan"]["Plan Rows"])
+
+
+def count(query, Model, strategy):
+    """
+    Count `query` without fetching a page (used by the window strategy fallback and keyset pagination)
+
+    :return: the count, or None for the "none" strategy
+    """
+    if not hasattr(query, "offset"):
+        return len(_as_list(query))
+    if strategy == NONE:
+        return None
+    if strategy == ESTIMATED:
+        return estimated_count(query, Model)
+    return query.count()
+
+
+def fetch_page(query, Model, strategy, offset, limit):
+    """
+    Fetch a page of `query` and count the full result according to `strategy`
+
+    :param query: filtered and sorted query (or a list of instances)
+    :param limit: page size, None to fetch all rows after `offset`
+    :return: instances, count, has_more
+    """
+    if not hasattr(query, "offset"):
+        items = _as_list(query)
+        instances = items[offset : offset + limit if limit is not None else None]
+        return instances, len(items), offset + len(instances) < len(items)
+
+    def _page(page_query, page_limit):
+        page_query = page_query.offset(offset)
+        return page_query.limit(page_limit) if page_limit is not None else page_query
+
+    if strategy == WINDOW:
+        rows = _page(query.add_columns(func.count().over()), limit).all()
+        # the rows without the window count, e.g. (instance, version) rows cfr. conditional.with_versions
+        entities = len(query.column_descriptions)
+        instances = [row[0] if entities == 1 else tuple(row[:entities]) for row in rows]
+        if rows:
+            total = rows[0][-1]
+        else:
+            # past the last page: there's no row to read the window count from
+            total = query.order_by(None).count() if offset else 0
+        return instances, total, offset + len(instances) < total
+
+    if strategy == NONE:
+        instances = _page(query, limit + 1 if limit is not None else None).all()
+        has_more = limit is not None and len(instances) > limit
+        return instances[:limit], None, has_more
+
+    total = count(query.order_by(None), Model, strategy)
+    instances = _page(query, limit).all()
+    return instances, total, offset + len(instances) < total
+
+
+def links_count(offset, limit, total, has_more):
+    """
+    :return: the count used to generate the pagination links, if the count is unknown
+             we only know whether there's a next page (the `last` link is dropped)
+    """
+    if total is not None:
+        return total
+    return offset + 2 * limit if has_more else offset
+
+
+def drop_unknown_links(links, total):
+    if total is None:
+        links.pop("last", None)
+    return links
@@ -0,0 +1,118 @@
+"""
+orjson backed JSON encoding for the Flask and FastAPI responses
+
+safrs encodes the responses with the stdlib json module and the `default()`
+of SAFRSJSONEncoder, which is by far the largest CPU cost of large pages.
+When orjson is installed it's used for both backends:
+
+- Flask: `JSONProvider` replaces the SAFRSJSONProvider set by SAFRSAPI
+- FastAPI: app.fastapi_app.JSONAPIResponse renders the JsonApiFastAPI responses
+
+str, int, float, bool, None, list, dict and UUID are encoded natively, all
+other types (datetime, date, time, Decimal, SAFRSBase instances, ...) still go
+through SAFRSJSONEncoder.default, so the values are encoded like before
+(e.g. datetimes with a " " separator). When orjson can't encode a document
+(e.g. non-string keys or integers of more than 64 bits) it's encoded with
+the stdlib encoder. The included[] resources are rendered while the document
+is encoded (cfr. app.compound), so the compound document of the request is
+reset before it's encoded again. Without orjson nothing is replaced and the
+responses are encoded exactly like before.
+"""
+import json
+
+from safrs.base import Included
+from safrs.json_encoder import SAFRSJSONEncoder, SAFRSJSONProvider
+
+from app.compound import document
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None
+
+# types that orjson would encode differently than SAFRSJSONEncoder
+PASSTHROUGH = orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_PASSTHROUGH_DATACLASS | orjson.OPT_PASSTHROUGH_SUBCLASS if orjson else 0
+COMPACT_SEPARATORS = (",", ":")
+
+_encoder = SAFRSJSONEncoder()
+
+
+def available():
+    """
+    :return: True if the orjson encoding is available
+    """
+    return orjson is not None
+
+
+def dumps(obj, sort_keys=False, indent=False, default=_encoder.default):
+    """
+    :param indent: indent with 2 spaces, like json.dumps(indent=2)
+    :return: the utf-8 encoded JSON document of `obj`, compact unless indented
+    :raises TypeError: if orjson can't encode `obj`
+    """
+    option = PASSTHROUGH | (orjson.OPT_SORT_KEYS if sort_keys else 0) | (orjson.OPT_INDENT_2 if indent else 0)
+    return orjson.dumps(obj, default=default, option=option)
+
+
+def with_fallback(obj, encode, fallback):
+    """
+    :param encode: encodes `obj` with orjson
+    :param fallback: encodes `obj` with the stdlib encoder
+    :return: the result of `encode`, or of `fallback` when orjson can't encode `obj`
+    """
+    # the included[] of jsonapi_format_response is rendered while the document is encoded
+    builder = document() if isinstance(obj, dict) and obj.get("included") is Included else None
+    snapshot = builder.snapshot() if builder is not None else None
+    try:
+        return encode()
+    except TypeError:
+        if snapshot is not None:
+            builder.restore(snapshot)
+        return fallback()
+
+
+def _stdlib_compact(obj):
+    return json.dumps(obj, cls=SAFRSJSONEncoder, ensure_ascii=False, separators=COMPACT_SEPARATORS).encode("utf-8")
+
+
+def compact(obj):
+    """
+    :return: the compact utf-8 encoded JSON document of `obj`, with orjson when it's available
+    """
+    if available():
+        return with_fallback(obj, lambda: dumps(obj), lambda: _stdlib_compact(obj))
+    return _stdlib_compact(obj)
+
+
+def loads(data):
+    """
+    :return: the object of the JSON document `data`, decoded with orjson when it's available
+    """
+    return orjson.loads(data) if available() else json.loads(data)
+
+
+class JSONProvider(SAFRSJSONProvider):
+    """
+    Flask JSON provider that encodes with orjson, the stdlib encoder is used
+    for the arguments that orjson doesn't support (e.g. other indents)
+    """
+
+    def dumps(self, obj, **kwargs):
+        # flask passes indent=2 in debug mode and compact separators otherwise
+        indent = kwargs.get("indent")
+        layout = (indent, kwargs.get("separators", COMPACT_SEPARATORS if indent is None else None))
+        if not available() or set(kwargs) - {"indent", "separators"} or layout not in ((None, COMPACT_SEPARATORS), (2, None)):
+            return super().dumps(obj, **kwargs)
+        return with_fallback(
+            obj,
+            lambda: dumps(obj, sort_keys=self.sort_keys, indent=indent == 2, default=self.default).decode("utf-8"),
+            lambda: super(JSONProvider, self).dumps(obj, **kwargs),
+        )
+
+
+def install(app):
+    """
+    Encode the responses of the flask `app` with orjson when it's available
+    """
+    if available():
+        app.json = JSONProvider(app)
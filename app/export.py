@@ -0,0 +1,172 @@
+"""
+Export of complete collections as NDJSON or CSV
+
+Paging through a large collection with page[limit] takes a query per page and
+pages shift when rows are inserted or deleted in between. Every exposed model
+also gets an export route that returns the complete collection from a single
+query, so the export is a consistent snapshot:
+
+    GET /People/_export?format=ndjson|csv&filter[name]=...&sort=name&fields[Person]=name,email
+
+The filter[...], sort and fields[...] parameters are parsed like they are for
+the collection. The rows are fetched from a server-side cursor (`yield_per`)
+in chunks of streaming.CHUNK_SIZE and written as they're fetched, cfr.
+app.streaming, so the memory used doesn't depend on the size of the
+collection.
+
+Only the attributes that can be read according to the column permissions
+(`_s_check_perm`) are exported, e.g. the write-only Person.password isn't.
+
+- ndjson: a `{"type": ..., "id": ..., "attributes": {...}}` object per line
+- csv: a header row with "id" and the attribute names, then a row per resource
+- arrow, parquet: when pyarrow is installed, cfr. app.columnar
+
+The status of the response has been sent when a chunk fails, so an export
+that fails midway ends with an error record instead: a
+`{"errors": [{"status": "500", "title": "Export failed"}]}` line for ndjson and
+a `#error` row for csv. The arrow stream and the parquet file are left
+without their end marker and footer, which their readers reject.
+"""
+import csv
+import io
+import json
+
+import safrs
+from safrs.errors import ValidationError
+
+from app import columnar, counting, encoding
+from app.streaming import StreamedPage, chunk_scope
+
+NDJSON = "ndjson"
+CSV = "csv"
+MEDIA_TYPES = {NDJSON: "application/x-ndjson", CSV: "text/csv; charset=utf-8"}
+if columnar.available():
+    MEDIA_TYPES.update(columnar.MEDIA_TYPES)
+EXPORT_PATH = "_export"
+EXPORT_ERROR = {"status": "500", "title": "Export failed"}
+CSV_ERROR = "#error"
+
+
+def export_format(query_params):
+    """
+    :param query_params: the request query parameters
+    :return: the requested export format, ndjson by default
+    :raises ValidationError: if the format isn't supported
+    """
+    requested = query_params.get("format", NDJSON)
+    if requested not in MEDIA_TYPES:
+        raise ValidationError(f"Invalid export format '{requested}', expected one of {', '.join(MEDIA_TYPES)}")
+    return requested
+
+
+def export_headers(Model, export_format):
+    """
+    :return: the headers of the export response
+    """
+    return {"Content-Disposition": f'attachment; filename="{Model._s_collection_name}.{export_format}"'}
+
+
+def export_columns(Model, ctx):
+    """
+    :return: the names of the requested attributes that can be read
+    """
+    fields = ctx.sparse_fields_for_model(Model) or list(Model._s_jsonapi_attrs.keys())
+    return [name for name in fields if name in Model._s_jsonapi_attrs and Model._s_check_perm(name)]
+
+
+def _csv_value(value):
+    if isinstance(value, (dict, list)):
+        return json.dumps(value)
+    return value
+
+
+class LineWriter:
+    """
+    Writes the chunks of a NDJSON or CSV export
+    """
+
+    def __init__(self, Model, columns, export_format):
+        """
+        :param columns: names of the attributes to export, cfr. export_columns
+        """
+        self.Model = Model
+        self.columns = columns
+        self.export_format = export_format
+
+    def chunks(self, query):
+        """
+        :param query: filtered and sorted query (or a list of instances)
+        :return: generator of lists of instances
+        """
+        return StreamedPage(query, self.Model, counting.NONE, 0, None).chunks()
+
+    def header(self):
+        """
+        :return: the CSV header row
+        """
+        if self.export_format != CSV:
+            return b""
+        buffer = io.StringIO()
+        csv.writer(buffer).writerow(["id"] + self.columns)
+        return buffer.getvalue().encode("utf-8")
+
+    def write(self, instances):
+        """
+        :return: the encoded lines of `instances`
+        """
+        if self.export_format == CSV:
+            buffer = io.StringIO()
+            writer = csv.writer(buffer)
+            for instance in instances:
+                attributes = instance.to_dict()
+                writer.writerow([instance.jsonapi_id] + [_csv_value(attributes.get(name)) for name in self.columns])
+            return buffer.getvalue().encode("utf-8")
+        lines = []
+        for instance in instances:
+            attributes = instance.to_dict()
+            resource = {"type": self.Model._s_type, "id": instance.jsonapi_id, "attributes": {name: attributes.get(name) for name in self.columns}}
+            lines.append(encoding.compact(resource) + b"\n")
+        return b"".join(lines)
+
+    def close(self):
+        return b""
+
+    def error(self):
+        """
+        :return: the record that ends a failed export
+        """
+        if self.export_format == CSV:
+            buffer = io.StringIO()
+            csv.writer(buffer).writerow([CSV_ERROR, EXPORT_ERROR["title"]])
+            return buffer.getvalue().encode("utf-8")
+        return encoding.compact({"errors": [EXPORT_ERROR]}) + b"\n"
+
+
+def export_rows(query, Model, ctx, export_format):
+    """
+    Encode the resources of the filtered and sorted `query`, chunk by chunk
+
+    :param query: filtered and sorted query (or a list of instances)
+    :param ctx: safrs JsonApiContext of the request
+    :return: generator of bytes
+    """
+    writer_class = columnar.BatchWriter if export_format in columnar.MEDIA_TYPES else LineWriter
+    writer = writer_class(Model, export_columns(Model, ctx), export_format)
+    return _export_chunks(writer, query, Model, ctx)
+
+
+def _export_chunks(writer, query, Model, ctx):
+    try:
+        yield writer.header()
+        chunks = writer.chunks(query)
+        while True:
+            with chunk_scope(Model, ctx, {}):
+                chunk = next(chunks, None)
+                if chunk is None:
+                    break
+                encoded = writer.write(chunk)
+            yield encoded
+        yield writer.close()
+    except Exception as exc:
+        safrs.log.exception(f"Exporting the {Model._s_type} collection failed: {exc}")
+        yield writer.error()
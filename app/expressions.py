@@ -0,0 +1,68 @@
+"""
+SQL expressions for jsonapi_attr attributes
+
+safrs ignores `jsonapi_attr` attributes in sort= and filter[...] (or sorts and
+filters the complete collection in python), because the value is computed
+by a python getter. A jsonapi_attr is a hybrid_property though, so it can
+declare the equivalent SQL expression, like the hybrid `.expression` decorator:
+
+    @jsonapi_attr
+    def display_name(self):
+        return f"{self.name} <{self.email}>"
+
+    @sql_expression(display_name)
+    def display_name(cls):
+        return cls.name + " <" + cls.email + ">"
+
+The expression is compiled into the ORDER BY and WHERE clauses of the query,
+postgres can use an index on the same expression (or on a generated column).
+The expression must return the same values as the getter, attributes without
+an expression are still ignored.
+"""
+from safrs.jsonapi_attr import is_jsonapi_attr
+
+
+def sql_expression(attr):
+    """
+    Decorator declaring the SQL expression of the jsonapi_attr `attr`
+
+    This is the hybrid `attr.expression` decorator, but it keeps the swagger
+    attributes parsed from the getter docstring (e.g. `default`), these are
+    dropped when the hybrid is copied
+    """
+
+    def decorator(expr):
+        result = attr.expression(expr)
+        for key in vars(attr).keys() - vars(result).keys():
+            setattr(result, key, getattr(attr, key))
+        return result
+
+    return decorator
+
+
+def attr_expression(Model, attr_name):
+    """
+    :param Model: SAFRSBase subclass
+    :param attr_name: jsonapi attribute name
+    :return: the SQL expression declared for the jsonapi_attr, None if it doesn't declare one
+    """
+    attr = Model._s_jsonapi_attrs.get(attr_name)
+    if not is_jsonapi_attr(attr) or attr.expr is None:
+        return None
+    return getattr(Model, attr_name)
+
+
+def filter_expressions(query, Model, filters):
+    """
+    :param query: query returned by safrs' jsonapi_filter
+    :param filters: dict of attribute name -> csv value, from the filter[...] url parameters
+    :return: `query` filtered on the jsonapi_attrs that declare an expression
+    """
+    if not hasattr(query, "filter"):
+        return query
+    for attr_name, value in filters.items():
+        expression = attr_expression(Model, attr_name)
+        if expression is None:
+            continue
+        query = query.filter(expression.in_(value.split(",")))
+    return query
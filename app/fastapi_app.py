@@ -1,9 +1,17 @@
 import hashlib
+from typing import Any, Dict
 
-from fastapi import FastAPI
+from fastapi import APIRouter, Body, FastAPI, Request
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+from safrs.errors import NotFoundError, ValidationError
 from safrs.fastapi import SafrsFastAPI
+from safrs.fastapi.api import JSONAPI_MEDIA_TYPE, ObjectIdParam
+from safrs.fastapi.responses import JSONAPIResponse as SAFRSJSONAPIResponse
+from starlette.datastructures import Headers, MutableHeaders, QueryParams
+from werkzeug.http import quote_etag, unquote_etag
 
 from app.base_model import db
+from app.export import EXPORT_PATH, MEDIA_TYPES, export_format, export_headers, export_rows
 from app.models import (
     AuthUser,
     Book,
@@ -20,11 +28,525 @@ from app.models import (
     UserWithPerms,
 )
 from app.models_stateless import Test
+from app import compact, compression, conditional, counting, encoding, fragments, invalidation, negotiation, response_cache, statement_cache, table_versions
+from app.instances import resolved_scope
+from app.linkage import prefetch_linkage
+from app.loading import eager_load, include_paths, prefetch_dynamic, prefetch_scope
+from app.pagination import keyset_paginate, keyset_requested, relationship_query
+from app.serializers import compile_serializer
+from app.streaming import StreamedPage, stream_collection, streaming_requested
+
+PAGE_PARAMS = ("page[offset]", "page[limit]", "page[number]", "page[size]")
+
+
+class JSONAPIResponse(SAFRSJSONAPIResponse):
+    """
+    JSON:API response that's encoded with orjson, cfr. app.encoding
+    """
+
+    def render(self, content):
+        return encoding.with_fallback(content, lambda: encoding.dumps(content), lambda: super(JSONAPIResponse, self).render(content))
+
+
+class MsgpackResponse(Response):
+    """
+    JSON:API response that's encoded as msgpack, cfr. app.negotiation
+    """
+
+    media_type = negotiation.MEDIA_TYPE
+
+    def render(self, content):
+        return negotiation.packb(content)
+
+
+class MsgpackMiddleware:
+    """
+    ASGI middleware that records whether the client accepts msgpack and
+    passes msgpack payloads to the request handlers as JSON, cfr. app.negotiation
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        headers = Headers(scope=scope)
+        with negotiation.accepted_scope(headers.get("accept")):
+            if negotiation.is_msgpack(headers.get("content-type")):
+                try:
+                    body = encoding.compact(negotiation.unpackb(await _read_body(receive)))
+                except ValidationError as exc:
+                    error = {"status": "400", "title": exc.__class__.__name__, "detail": exc.message}
+                    response = JSONResponse({"errors": [error]}, status_code=400, media_type=JSONAPI_MEDIA_TYPE)
+                    return await response(scope, receive, send)
+                scope = dict(scope, headers=_json_headers(scope["headers"], len(body)))
+                receive = _replay(body)
+            await self.app(scope, receive, send)
+
+
+class ProfileMiddleware:
+    """
+    ASGI middleware that records the Accept header for the compact profile
+    and labels the compact responses with the profile, cfr. app.compact
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        accept = Headers(scope=scope).get("accept")
+        flag = QueryParams(scope["query_string"]).get(compact.QUERY_PARAM)
+        with compact.profile_scope(accept):
+            if not compact.profile_requested(flag, accept):
+                return await self.app(scope, receive, send)
+
+            async def send_profile(message):
+                if message["type"] == "http.response.start":
+                    headers = MutableHeaders(scope=message)
+                    if headers.get("content-type", "").split(";")[0].strip() == JSONAPI_MEDIA_TYPE:
+                        headers["content-type"] = compact.MEDIA_TYPE
+                        headers.add_vary_header("Accept")
+                await send(message)
+
+            await self.app(scope, receive, send_profile)
+
+
+async def _read_body(receive):
+    chunks = []
+    while True:
+        message = await receive()
+        chunks.append(message.get("body", b""))
+        if not message.get("more_body"):
+            return b"".join(chunks)
+
+
+def _json_headers(raw_headers, length):
+    replaced = {b"content-type": JSONAPI_MEDIA_TYPE.encode("latin-1"), b"content-length": str(length).encode("latin-1")}
+    return [(name, value) for name, value in raw_headers if name not in replaced] + list(replaced.items())
+
+
+def _replay(body):
+    sent = False
+
+    async def receive():
+        nonlocal sent
+        if sent:
+            return {"type": "http.disconnect"}
+        sent = True
+        return {"type": "http.request", "body": body, "more_body": False}
+
+    return receive
+
+
+class CompressionMiddleware:
+    """
+    ASGI middleware that compresses the responses and serves the compressed artifacts, cfr. app.compression
+    """
+
+    def __init__(self, app, artifacts):
+        self.app = app
+        self.artifacts = artifacts
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] == "HEAD":
+            return await self.app(scope, receive, send)
+        headers = Headers(scope=scope)
+        coding = compression.negotiate(headers.get("accept-encoding"))
+        if scope["method"] == "GET" and not scope["query_string"] and scope["path"] in self.artifacts:
+            content_type, body = self.artifacts.get(scope["path"], coding)
+            artifact_headers = {"Content-Type": content_type, "Vary": "Accept-Encoding"}
+            if coding is not None:
+                artifact_headers["Content-Encoding"] = coding
+            return await Response(body, headers=artifact_headers)(scope, receive, send)
+        await self.app(scope, receive, _CompressingSend(send, coding, headers.get("if-none-match")))
+
+
+class _CompressingSend:
+    """
+    ASGI send that compresses the response body, cfr. compression._compress_response
+    """
+
+    def __init__(self, send, coding, if_none_match):
+        self.send = send
+        self.coding = coding
+        self.if_none_match = if_none_match
+        self.start = None
+        self.compressor = None
+
+    async def __call__(self, message):
+        if message["type"] == "http.response.start":
+            # the headers are sent with the first body message, when the size is known
+            self.start = message
+            return
+        if message["type"] != "http.response.body":
+            return await self.send(message)
+        if self.start is not None:
+            start, self.start = self.start, None
+            return await self._send_first(start, message)
+        if self.compressor is None:
+            return await self.send(message)
+        body = message.get("body", b"")
+        body = self.compressor.compress(body) if body else b""
+        more_body = message.get("more_body", False)
+        if not more_body:
+            body += self.compressor.finish()
+        await self.send({"type": "http.response.body", "body": body, "more_body": more_body})
+
+    async def _send_first(self, start, message):
+        headers = MutableHeaders(raw=start["headers"])
+        status = start["status"]
+        body = message.get("body", b"")
+        more_body = message.get("more_body", False)
+        if status == 304:
+            if self.coding is not None and "etag" in headers:
+                headers["etag"] = compression.not_modified_etag(headers["etag"], self.if_none_match)
+        elif "content-encoding" not in headers and compression.compressible(headers.get("content-type")):
+            headers.add_vary_header("Accept-Encoding")
+            # streamed bodies are compressed regardless of their size
+            if self.coding is not None and status >= 200 and status not in (204, 206) and (more_body or len(body) >= compression.min_size()):
+                body = self._compress_first(headers, body, more_body)
+        await self.send(start)
+        await self.send({"type": "http.response.body", "body": body, "more_body": more_body})
+
+    def _compress_first(self, headers, body, more_body):
+        if more_body:
+            self.compressor = compression.stream_compressor(self.coding)
+            body = self.compressor.compress(body) if body else b""
+            if "content-length" in headers:
+                del headers["content-length"]
+        else:
+            body = compression.compress(body, self.coding)
+            headers["content-length"] = str(len(body))
+        headers["content-encoding"] = self.coding
+        if "etag" in headers:
+            headers["etag"] = compression.weak_etag(headers["etag"])
+        return body
+
+
+class JsonApiFastAPI(SafrsFastAPI):
+    """
+    SafrsFastAPI with the features of the flask endpoints in app.jsonapi:
+    - keyset (cursor) pagination with page[after]/page[before], cfr. app.pagination
+    - count strategies for collections (page[count]), cfr. app.counting
+    - eager loading of the include= relationships, cfr. app.loading
+    - to-many relationship GETs are filtered, sorted and paginated in SQL
+    - counts and linkage of to-many relationships that aren't included, cfr. app.linkage
+    - the items of relationship payloads are resolved in a single query, cfr. app.instances
+    - compiled statement cache hits are recorded per request shape, cfr. app.statement_cache
+    - responses are encoded with orjson when it's installed, cfr. app.encoding
+    - the serializers of the exposed models are compiled, cfr. app.serializers
+    - large collection pages are streamed, cfr. app.streaming
+    - msgpack documents are negotiated with Accept/Content-Type, cfr. app.negotiation
+    - compact documents without links, cfr. app.compact and ProfileMiddleware
+    - ETags and conditional GETs of instances and collections, cfr. app.conditional
+    - read-through cache of the instance and collection GETs, cfr. app.response_cache
+    - responses are compressed by CompressionMiddleware, cfr. app.compression
+    - NDJSON/CSV export of the complete collections on /<collection>/_export, cfr. app.export
+    """
+
+    def expose_object(self, Model, dependencies=None, method_decorators=None):
+        if getattr(Model, "_s_expose", True):
+            # the export route has to be added before the "/<collection>/{object_id}" route
+            self._expose_export(Model, dependencies)
+        super().expose_object(Model, dependencies=dependencies, method_decorators=method_decorators)
+        compile_serializer(Model)
+
+    def _expose_export(self, Model, dependencies=None):
+        router = APIRouter(prefix=self.prefix, tags=[str(Model._s_collection_name)])
+        router.add_api_route(
+            f"/{Model._s_collection_name}/{EXPORT_PATH}",
+            self._export(Model),
+            methods=["GET"],
+            dependencies=self.default_dependencies + self._normalize_dependencies(dependencies),
+            summary=f"Export {Model._s_collection_name} as NDJSON or CSV",
+        )
+        self.app.include_router(router)
+
+    def _export(self, Model):
+        def handler(request: Request):
+            try:
+                requested = export_format(request.query_params)
+                ctx = self._build_jsonapi_context(request)
+                query_or_items = self._apply_filter(Model, request, Model._s_query)
+                query_or_items = self._apply_sort_query_or_items(Model, query_or_items, request)
+                body = export_rows(query_or_items, Model, ctx, requested)
+                return StreamingResponse(body, media_type=MEDIA_TYPES[requested], headers=export_headers(Model, requested))
+            except Exception as exc:
+                self._handle_safrs_exception(exc)
+
+        return handler
+
+    def _jsonapi_response(self, content, status_code=200, headers=None):
+        if negotiation.msgpack_requested():
+            return MsgpackResponse(status_code=status_code, headers=headers, content=content)
+        if not encoding.available():
+            return super()._jsonapi_response(content, status_code=status_code, headers=headers)
+        return JSONAPIResponse(status_code=status_code, headers=headers, content=content)
+
+    @staticmethod
+    def _not_modified(request, etag):
+        """
+        :return: the 304 response when `etag` matches the If-None-Match of the `request`, else None
+        """
+        if etag is None or not conditional.matches(request.headers.get("if-none-match"), etag):
+            return None
+        return Response(status_code=304, headers={"ETag": quote_etag(etag)})
+
+    def _conditional_response(self, request, response, etag=None):
+        """
+        Set the ETag of `response`, cfr. conditional.conditional_response
+
+        :param etag: ETag computed from the row versions, the rendered document is hashed when it's None
+        """
+        if etag is None and response.status_code == 200 and not isinstance(response, StreamingResponse):
+            etag = conditional.document_etag(response.body)
+        if etag is None:
+            return response
+        not_modified = self._not_modified(request, etag)
+        if not_modified is not None:
+            return not_modified
+        response.headers["ETag"] = quote_etag(etag)
+        return response
+
+    @staticmethod
+    def _cache_key(Model, request):
+        return response_cache.request_key(Model, request.url.path, request.url.query, request.headers.get("authorization"))
+
+    def _cached_response(self, request, key):
+        """
+        :return: the cached response of `key`, answered conditionally, None if it isn't cached, cfr. app.response_cache
+        """
+        entry = response_cache.lookup(key)
+        if entry is None:
+            return None
+        headers, body = entry
+        etag = unquote_etag(headers["ETag"])[0] if "ETag" in headers else None
+        return self._not_modified(request, etag) or Response(body, headers=headers)
+
+    @staticmethod
+    def _store_response(key, Model, ctx, response):
+        if key is not None and response.status_code == 200 and not isinstance(response, StreamingResponse):
+            response_cache.store(key, Model, ctx, response.headers, response.body)
+        return response
+
+    def _get_instance(self, Model):
+        get_handler = super()._get_instance(Model)
+
+        def handler(object_id: ObjectIdParam, request: Request):
+            key = self._cache_key(Model, request)
+            cached = self._cached_response(request, key)
+            if cached is not None:
+                return cached
+            try:
+                ctx = self._build_jsonapi_context(request)
+                etag = conditional.instance_etag(Model, object_id, ctx, str(request.url))
+            except Exception as exc:
+                self._handle_safrs_exception(exc)
+            not_modified = self._not_modified(request, etag)
+            if not_modified is not None:
+                return not_modified
+            response = self._conditional_response(request, get_handler(object_id, request), etag)
+            return self._store_response(key, Model, ctx, response)
+
+        return handler
+
+    def _get_collection(self, Model):
+        def handler(request: Request):
+            key = self._cache_key(Model, request)
+            cached = self._cached_response(request, key)
+            if cached is not None:
+                return cached
+            try:
+                # Validate include paths early so invalid relationships fail with 400.
+                self._parse_include_paths(Model, request)
+                ctx = self._build_jsonapi_context(request)
+                with statement_cache.shape_scope(Model, ctx):
+                    strategy = counting.count_strategy(Model, ctx)
+                    filtered = self._apply_filter(Model, request, Model._s_query)
+                    etag = None
+                    if keyset_requested(request.query_params):
+                        if strategy == counting.WINDOW:
+                            # the window count would only cover the rows after the cursor
+                            strategy = counting.EXACT
+                        query_or_items = eager_load(filtered, Model, ctx)
+                        total_count = counting.count(query_or_items, Model, strategy)
+                        links, objs = keyset_paginate(query_or_items, Model, ctx, request.url.path)
+                    else:
+                        sorted_query = self._apply_sort_query_or_items(Model, filtered, request)
+                        query_or_items = eager_load(sorted_query, Model, ctx)
+                        page_offset, page_limit = self._pagination_args(request)
+                        # without page parameters SafrsFastAPI returns the complete collection
+                        paginated = any(param in request.query_params for param in PAGE_PARAMS)
+                        streamed = streaming_requested(page_limit if paginated else None)
+                        # the row versions are only queried ahead of the page to answer If-None-Match
+                        # (and for the headers of streamed pages), else they're loaded with the page
+                        etag = conditional.collection_etag(
+                            sorted_query,
+                            Model,
+                            ctx,
+                            strategy,
+                            page_offset if paginated else 0,
+                            page_limit if paginated else None,
+                            str(request.url),
+                            row_versions="if-none-match" in request.headers or streamed,
+                        )
+                        not_modified = self._not_modified(request, etag)
+                        if not_modified is not None:
+                            return not_modified
+                        if streamed:
+                            response = self._stream_collection(Model, request, ctx, query_or_items, strategy, paginated)
+                            return self._conditional_response(request, response, etag)
+                        page = query_or_items if etag is not None else conditional.with_versions(query_or_items, Model, ctx)
+                        objs, total_count, has_more = counting.fetch_page(
+                            page, Model, strategy, page_offset if paginated else 0, page_limit if paginated else None
+                        )
+                        if page is not query_or_items:
+                            objs, etag = conditional.page_etag(Model, ctx, str(request.url), objs, total_count, has_more)
+                        links = self._pagination_links(
+                            request,
+                            count=counting.links_count(page_offset, page_limit, total_count, has_more),
+                            page_offset=page_offset,
+                            limit=page_limit,
+                        )
+                        links = counting.drop_unknown_links(links, total_count)
+                    with prefetch_scope():
+                        prefetch_dynamic(objs, Model, include_paths(ctx), ctx)
+                        prefetch_linkage(objs, Model, ctx)
+                        response = self._jsonapi_data_response(
+                            data=objs,
+                            links=links,
+                            meta={"count_strategy": strategy},
+                            count=total_count,
+                            request=request,
+                        )
+                        response = self._conditional_response(request, response, etag)
+                        return self._store_response(key, Model, ctx, response)
+            except Exception as exc:
+                self._handle_safrs_exception(exc)
+
+        return handler
+
+    def _stream_collection(self, Model, request, ctx, query_or_items, strategy, paginated):
+        page_offset, page_limit = self._pagination_args(request)
+
+        def links_for(count, has_more):
+            links = self._pagination_links(
+                request,
+                count=counting.links_count(page_offset, page_limit, count, has_more),
+                page_offset=page_offset,
+                limit=page_limit,
+            )
+            return counting.drop_unknown_links(links, count)
+
+        page = StreamedPage(query_or_items, Model, strategy, page_offset if paginated else 0, page_limit if paginated else None)
+        body = stream_collection(page, Model, ctx, {"count_strategy": strategy}, links_for, encoding.compact)
+        return StreamingResponse(body, media_type=JSONAPI_MEDIA_TYPE)
+
+    def _get_relationship(self, Model, rel_name):
+        offset_handler = super()._get_relationship(Model, rel_name)
+
+        def handler(object_id: ObjectIdParam, request: Request):
+            rel = self._resolve_relationship_properties(Model).get(rel_name)
+            if rel is None or not self._is_to_many_relationship(rel):
+                return offset_handler(object_id, request)
+            try:
+                parent = Model.get_instance(object_id)
+                target_model = rel.mapper.class_
+                self._parse_include_paths(target_model, request)
+                ctx = self._build_jsonapi_context(request)
+                # filter, sort and paginate in the database instead of loading the complete relationship
+                query = self._apply_filter(target_model, request, target_model._s_query)
+                query = eager_load(relationship_query(parent, rel_name, query), target_model, ctx)
+                if keyset_requested(request.query_params):
+                    total_count = counting.count(query, target_model, counting.EXACT)
+                    links, items = keyset_paginate(query, target_model, ctx, request.url.path)
+                else:
+                    query = self._apply_sort_query_or_items(target_model, query, request)
+                    page_offset, page_limit = self._pagination_args(request)
+                    paginated = any(param in request.query_params for param in PAGE_PARAMS)
+                    items, total_count, _ = counting.fetch_page(
+                        query, target_model, counting.EXACT, page_offset if paginated else 0, page_limit if paginated else None
+                    )
+                    links = self._pagination_links(
+                        request,
+                        count=total_count,
+                        page_offset=page_offset,
+                        limit=page_limit,
+                        base_path=self._collection_path(target_model),
+                    )
+                with prefetch_scope():
+                    prefetch_dynamic(items, target_model, include_paths(ctx), ctx)
+                    prefetch_linkage(items, target_model, ctx)
+                    # meta.count and meta.total are the count of the relationship, like the pagination links
+                    return self._jsonapi_data_response(data=items, links=links, count=total_count, request=request)
+            except Exception as exc:
+                self._handle_safrs_exception(exc)
+
+        return handler
+
+    def _payload_scope(self, Model, rel_name, payload):
+        """
+        Resolve the items of a to-many relationship payload in a single query, cfr. app.instances
+        """
+        rel = self._resolve_relationship_properties(Model).get(rel_name)
+        data = payload.get("data") if rel is not None and isinstance(payload, dict) else None
+        return resolved_scope(rel.mapper.class_ if rel is not None else Model, data)
+
+    def _patch_relationship(self, Model, rel_name):
+        patch_handler = super()._patch_relationship(Model, rel_name)
+
+        def handler(
+            object_id: ObjectIdParam,
+            request: Request,
+            payload: Dict[str, Any] = Body(..., media_type=JSONAPI_MEDIA_TYPE),
+        ):
+            try:
+                with self._payload_scope(Model, rel_name, payload):
+                    return patch_handler(object_id, request, payload)
+            except NotFoundError as exc:
+                self._handle_safrs_exception(exc)
+
+        return handler
+
+    def _post_relationship(self, Model, rel_name):
+        post_handler = super()._post_relationship(Model, rel_name)
+
+        def handler(object_id: ObjectIdParam, payload: Dict[str, Any] = Body(..., media_type=JSONAPI_MEDIA_TYPE)):
+            try:
+                with self._payload_scope(Model, rel_name, payload):
+                    return post_handler(object_id, payload)
+            except NotFoundError as exc:
+                self._handle_safrs_exception(exc)
+
+        return handler
+
+    def _delete_relationship(self, Model, rel_name):
+        delete_handler = super()._delete_relationship(Model, rel_name)
+
+        def handler(object_id: ObjectIdParam, payload: Dict[str, Any] = Body(..., media_type=JSONAPI_MEDIA_TYPE)):
+            try:
+                with self._payload_scope(Model, rel_name, payload):
+                    return delete_handler(object_id, payload)
+            except NotFoundError as exc:
+                self._handle_safrs_exception(exc)
+
+        return handler
 
 
 def create_fastapi_api(seed_data: bool = True) -> FastAPI:
     app = FastAPI(openapi_url="/swagger.json", docs_url="/docs", redoc_url=None)
-    api = SafrsFastAPI(app)
+    api = JsonApiFastAPI(app)
+    statement_cache.install(db.engine)
+    response_cache.install()
+    fragments.install()
+    invalidation.install(db.engine)
+    table_versions.install(db.engine)
+    app.add_middleware(ProfileMiddleware)
+    if negotiation.available():
+        app.add_middleware(MsgpackMiddleware)
 
     for model in [Thing, ThingWType, SubThing, ThingWOCommit, ThingWCommit, Test, AuthUser]:
         api.expose_object(model)
@@ -55,4 +577,8 @@ def create_fastapi_api(seed_data: bool = True) -> FastAPI:
     for model in [Person, Book, Review, Publisher, PKItem, UserWithJsonapiAttr, UserWithPerms]:
         api.expose_object(model)
 
+    # the OpenAPI document is rendered and compressed once
+    artifacts = compression.Artifacts()
+    artifacts.add(app.openapi_url, JSONResponse(app.openapi()).body, "application/json")
+    app.add_middleware(CompressionMiddleware, artifacts=artifacts)
     return app
@@ -0,0 +1,192 @@
+"""
+Resource fragment cache
+
+The attributes of a resource only depend on its row, the same `Person` is
+encoded again in every page and every include= that reaches it. The encoded
+attributes of the compiled serializers (cfr. app.serializers) are kept in a
+cache backend (cfr. app.cache, configured with FRAGMENT_CACHE, empty by
+default) so the serializer only encodes the misses:
+
+- only the resources of models with a `_s_version_column` are cached: the
+  key is the type, the id and the row version of the resource (the value of
+  that column, loaded with the row), the sparse fieldset and the permission
+  context (the attributes that can be read). A write that bypasses the
+  session or a fragment that's stored after the write was evicted (e.g. a
+  request that read the row before another worker committed) is left under
+  the key of the previous version. The cached models of app.models map the
+  postgres xmin system column as their version (cfr. `row_version`), so it's
+  loaded with the instances and every write changes it
+- an entry is tagged with its row and its table, the rows that are inserted,
+  updated or deleted in a session are evicted when it's flushed and again
+  when its transaction ends (ORM bulk UPDATE/DELETE statements evict the
+  table), the other workers evict them when the transaction is committed,
+  cfr. app.invalidation
+- only fieldsets of columns are cached (jsonapi_attr properties may depend on
+  other rows), instances with pending changes aren't cached
+- entries expire after FRAGMENT_CACHE_TTL seconds, so the fragments of
+  previous versions don't stay in a backend without a byte budget (redis)
+
+The fragments are JSON encoded bytes, like the entries of the other caches.
+orjson (3.8) can't embed pre-encoded JSON in a document, so a hit is decoded
+into the resource again, which is still a lot cheaper than the attribute
+converters. The documents with native msgpack values (cfr. app.negotiation)
+aren't cached.
+"""
+from safrs.config import get_config
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session
+
+from app import encoding, invalidation
+from app.cache import create_backend
+
+INFO_KEY = "fragment_cache_tags"
+# used when FRAGMENT_CACHE_TTL isn't configured
+FRAGMENT_CACHE_TTL = 3600
+
+_backend = None
+# table name -> the resource types of its models
+_types = {}
+
+
+def configure(backend):
+    """
+    :param backend: the cache backend of the fragments, cfr. app.cache, None disables the cache
+    """
+    global _backend
+    _backend = backend
+
+
+def backend():
+    """
+    :return: the configured cache backend, None if the cache is disabled
+    """
+    return _backend
+
+
+def _ttl():
+    configured = get_config("FRAGMENT_CACHE_TTL")
+    return float(configured) if configured is not None else FRAGMENT_CACHE_TTL
+
+
+def row_tag(resource_type, jsonapi_id):
+    return f"{resource_type}:{jsonapi_id}"
+
+
+def key(Model, instance, shape):
+    """
+    :param shape: the fieldset and permission context, cfr. Serializer.fragment_shape
+    :return: the cache key of the attributes of `instance`, None if they can't be cached
+    """
+    version_column = getattr(Model, "_s_version_column", None)
+    if _backend is None or shape is None or not version_column:
+        return None
+    state = inspect(instance)
+    if state.key is None or state.modified:
+        return None
+    version = getattr(instance, version_column)
+    if version is None:
+        return None
+    version = str(version)
+    return f"fragment:{Model._s_type}:{shape}:{encoding.compact([instance.jsonapi_id, version]).decode('utf-8')}"
+
+
+def lookup(key):
+    """
+    :return: the cached attributes of `key`, None if they aren't cached
+    """
+    if key is None:
+        return None
+    value = _backend.get(key)
+    if value is None:
+        return None
+    try:
+        return encoding.loads(value)
+    except ValueError:
+        # e.g. integers orjson can't decode
+        return None
+
+
+def store(key, Model, instance, attributes):
+    """
+    Cache the encoded `attributes` of `instance`
+    """
+    if key is None:
+        return
+    try:
+        value = encoding.compact(attributes)
+    except (TypeError, ValueError):
+        return
+    _types.setdefault(Model.__table__.name, set()).add(Model._s_type)
+    _backend.set(key, value, (row_tag(Model._s_type, instance.jsonapi_id), Model._s_type), _ttl())
+
+
+def _written_tags(session):
+    return session.info.setdefault(INFO_KEY, set())
+
+
+def _evict(tags):
+    if tags and _backend is not None:
+        _backend.invalidate(tags)
+
+
+def _after_flush(session, flush_context):
+    tags = set()
+    for instance in (*session.new, *session.dirty, *session.deleted):
+        resource_type = getattr(type(instance), "_s_type", None)
+        if resource_type is not None:
+            tags.add(row_tag(resource_type, instance.jsonapi_id))
+    _written_tags(session).update(tags)
+    _evict(tags)
+
+
+def _do_orm_execute(orm_execute_state):
+    if not (orm_execute_state.is_update or orm_execute_state.is_delete) or orm_execute_state.bind_mapper is None:
+        return
+    resource_type = getattr(orm_execute_state.bind_mapper.class_, "_s_type", None)
+    if resource_type is not None:
+        _written_tags(orm_execute_state.session).add(resource_type)
+        _evict([resource_type])
+
+
+def _after_commit(session):
+    # the rows may have been cached again by other requests while the transaction was open
+    _evict(session.info.pop(INFO_KEY, None))
+
+
+def _after_transaction_end(session, transaction):
+    # the session may have read its own writes before it rolled back
+    if transaction.parent is None:
+        _evict(session.info.pop(INFO_KEY, None))
+
+
+def _invalidated(table, pks):
+    # the rows written by the other workers, cfr. app.invalidation
+    if _backend is None:
+        return
+    if table is None:
+        _backend.clear()
+        return
+    resource_types = _types.get(table, ())
+    if pks is None:
+        _evict(resource_types)
+    else:
+        _evict([row_tag(resource_type, pk) for resource_type in resource_types for pk in pks])
+
+
+SESSION_EVENTS = {
+    "after_flush": _after_flush,
+    "do_orm_execute": _do_orm_execute,
+    "after_commit": _after_commit,
+    "after_transaction_end": _after_transaction_end,
+}
+
+
+def install():
+    """
+    Create the configured backend and evict the fragments of the rows the sessions write
+    """
+    configure(create_backend(get_config("FRAGMENT_CACHE"), get_config("FRAGMENT_CACHE_MAX_BYTES")))
+    for name, listener in SESSION_EVENTS.items():
+        if not event.contains(Session, name, listener):
+            event.listen(Session, name, listener)
+    invalidation.subscribe(_invalidated)
@@ -0,0 +1,122 @@
+"""
+Batched resolution of the resource identifiers in relationship payloads
+
+safrs resolves every `{"type": .., "id": ..}` item of a to-many relationship
+PATCH, POST or DELETE payload with a separate `get_instance` query. Here all
+identifiers of the target type are resolved up front with a single query:
+
+    SELECT ... FROM "Book" WHERE "Book".id IN (...)
+
+(a row-value IN for composite primary keys, e.g. PKItem), every id that
+doesn't exist is reported in one error (a 404, like `get_instance`). The resolved instances are kept in a
+request scoped cache that's used by ApiMixin.get_instance.
+
+`jsonapi_id` builds the id of a resource from its primary key values, for
+the linkage and the exports that don't load the instances.
+"""
+from contextlib import contextmanager
+from contextvars import ContextVar
+from types import SimpleNamespace
+
+from safrs.errors import NotFoundError, ValidationError
+from sqlalchemy import tuple_
+
+_resolved = ContextVar("resolved_instances", default=None)
+
+
+def _pk_key(Model, jsonapi_id):
+    """
+    :return: the primary key tuple of the jsonapi id, None if it's invalid
+    """
+    try:
+        values = tuple(Model.id_type.get_pks(jsonapi_id).values())
+        python_types = [column.type.python_type for column in Model.id_type.columns]
+    except (ValidationError, NotImplementedError):
+        return None
+    # get_pks falls back to "" for values that can't be converted to the column type
+    if not all(isinstance(value, python_type) for value, python_type in zip(values, python_types)):
+        return None
+    return values
+
+
+def jsonapi_id(Model, pk_columns, values):
+    """
+    :return: the jsonapi id of the Model instance with primary key `values`,
+             without loading the instance
+    """
+    pk_values = {}
+    for column, value in zip(pk_columns, values):
+        pk_values[column.name] = value
+        pk_values[Model.__mapper__.get_property_by_column(column).key] = value
+    return str(Model.id_type.get_id(SimpleNamespace(**pk_values)))
+
+
+def resource_ids(Model, items):
+    """
+    :param items: resource identifier objects of a relationship payload
+    :return: the ids of the `Model` items, invalid items are left for safrs to report
+    """
+    return [item["id"] for item in items if isinstance(item, dict) and item.get("id") and item.get("type") == Model._s_type]
+
+
+def resolve_instances(Model, ids):
+    """
+    Fetch the instances with the jsonapi `ids` in a single query
+
+    :return: dict of primary key tuple -> instance, list of the ids that don't exist
+    """
+    keys = {}
+    for jsonapi_id in ids:
+        key = _pk_key(Model, jsonapi_id)
+        if key is not None:
+            keys.setdefault(key, jsonapi_id)
+    if not keys:
+        return {}, []
+
+    pk_names = list(Model.id_type.get_pks(next(iter(keys.values()))).keys())
+    pk_attrs = [getattr(Model, name) for name in pk_names]
+    if len(pk_attrs) == 1:
+        criterion = pk_attrs[0].in_([key[0] for key in keys])
+    else:
+        criterion = tuple_(*pk_attrs).in_(list(keys))
+    instances = {tuple(getattr(instance, name) for name in pk_names): instance for instance in Model._s_query.filter(criterion)}
+    missing = [jsonapi_id for key, jsonapi_id in keys.items() if key not in instances]
+    return instances, missing
+
+
+@contextmanager
+def resolved_scope(Model, items, error=NotFoundError):
+    """
+    Resolve the `Model` resource identifiers in `items`, `resolved` returns
+    the instances inside this scope
+
+    :param error: exception class raised for the ids that don't exist
+    :raises error: listing all ids that don't exist
+    """
+    instances, missing = resolve_instances(Model, resource_ids(Model, items)) if isinstance(items, list) else ({}, [])
+    if missing:
+        raise error(f'Invalid "{Model._s_type}" ids: {", ".join(str(jsonapi_id) for jsonapi_id in missing)}')
+    cache = _resolved.get() or {}
+    token = _resolved.set({**cache, Model: instances})
+    try:
+        yield
+    finally:
+        _resolved.reset(token)
+
+
+def resolved(Model, item):
+    """
+    :param item: jsonapi id or resource identifier object
+    :return: the instance resolved in `resolved_scope`, None if it wasn't resolved
+    """
+    cache = _resolved.get()
+    if not cache or Model not in cache:
+        return None
+    if isinstance(item, dict):
+        if item.get("type") != Model._s_type:
+            return None
+        item = item.get("id")
+    if item is None:
+        return None
+    key = _pk_key(Model, item)
+    return cache[Model].get(key) if key is not None else None
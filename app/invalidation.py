@@ -0,0 +1,215 @@
+"""
+Cross-worker cache invalidation with Postgres LISTEN/NOTIFY
+
+The caches evict the rows a session writes (cfr. app.fragments and
+app.response_cache), but gunicorn runs several workers and every worker has
+its own in-process caches. The written rows are also published on the
+INVALIDATION_CHANNEL:
+
+- the `after_flush` event of the sessions sends the (table, primary key) of
+  the inserted, updated and deleted rows with `pg_notify`, ORM bulk
+  UPDATE/DELETE statements send their table without primary keys
+- Postgres only delivers the notifications when the transaction commits,
+  notifications of rolled back transactions and savepoints are dropped
+- every worker runs a `Listener` thread with its own connection that LISTENs
+  on the channel and passes the notifications to the subscribed caches
+
+The payload is a JSON object, {"table": "Books", "pks": ["1", "2"]}, "pks"
+is null for a whole table. The primary keys are the jsonapi ids. Notifications
+are split to stay below the Postgres payload limit. The listener reconnects
+when its connection fails and then evicts everything, the notifications sent
+meanwhile are lost.
+
+Caches subscribe with `subscribe(callback)`, the callback is called with the
+table and the primary keys (None: all rows of the table), or with
+(None, None) to evict everything.
+"""
+import json
+import select
+import threading
+import time
+
+import safrs
+from safrs.config import get_config
+from sqlalchemy import event, func, inspect, select as sql_select
+from sqlalchemy.orm import Session
+
+from app import encoding
+
+# Postgres rejects payloads of 8000 bytes or more
+PAYLOAD_LIMIT = 7900
+POLL_TIMEOUT = 1.0
+RECONNECT_DELAY = 1.0
+
+_subscribers = []
+_channel = None
+_listener = None
+
+
+def subscribe(callback):
+    """
+    :param callback: called with (table, pks) for every invalidation, cfr. the module docstring
+    """
+    if callback not in _subscribers:
+        _subscribers.append(callback)
+
+
+def evict(table, pks=None):
+    """
+    Pass an invalidation to the subscribed caches of this worker
+    """
+    for callback in _subscribers:
+        try:
+            callback(table, pks)
+        except Exception as exc:
+            safrs.log.warning(f"Cache invalidation of {table} failed: {exc}")
+
+
+def primary_key(instance):
+    """
+    :return: the primary key of `instance` as it's published
+    """
+    jsonapi_id = getattr(instance, "jsonapi_id", None)
+    if jsonapi_id is not None:
+        return str(jsonapi_id)
+    return "_".join(str(value) for value in inspect(instance).identity or ())
+
+
+def payloads(writes):
+    """
+    :param writes: dict of table name -> set of primary keys, None for the whole table
+    :return: the notification payloads of `writes`
+    """
+    for table, pks in sorted(writes.items()):
+        if pks is None:
+            yield encoding.compact({"table": table, "pks": None}).decode("utf-8")
+            continue
+        chunk = []
+        size = 0
+        for pk in sorted(pks):
+            pk_size = len(encoding.compact(pk)) + 1
+            if chunk and size + pk_size > PAYLOAD_LIMIT - len(table) - 32:
+                yield encoding.compact({"table": table, "pks": chunk}).decode("utf-8")
+                chunk, size = [], 0
+            chunk.append(pk)
+            size += pk_size
+        if chunk:
+            yield encoding.compact({"table": table, "pks": chunk}).decode("utf-8")
+
+
+def _publish(session, writes):
+    if not _channel or not writes or session.get_bind().dialect.name != "postgresql":
+        return
+    connection = session.connection()
+    for payload in payloads(writes):
+        connection.execute(sql_select(func.pg_notify(_channel, payload)))
+
+
+def _after_flush(session, flush_context):
+    writes = {}
+    for instance in (*session.new, *session.dirty, *session.deleted):
+        table = getattr(type(instance), "__table__", None)
+        if table is not None:
+            writes.setdefault(table.name, set()).add(primary_key(instance))
+    _publish(session, writes)
+
+
+def _do_orm_execute(orm_execute_state):
+    if (orm_execute_state.is_update or orm_execute_state.is_delete) and orm_execute_state.bind_mapper is not None:
+        _publish(orm_execute_state.session, {orm_execute_state.bind_mapper.local_table.name: None})
+
+
+SESSION_EVENTS = {
+    "after_flush": _after_flush,
+    "do_orm_execute": _do_orm_execute,
+}
+
+
+def handle(payload):
+    """
+    Evict the rows of a notification payload
+    """
+    try:
+        message = json.loads(payload)
+        table, pks = message["table"], message["pks"]
+    except (ValueError, TypeError, KeyError):
+        safrs.log.warning(f"Invalid cache invalidation {payload!r}")
+        return
+    evict(table, pks)
+
+
+class Listener(threading.Thread):
+    """
+    Thread that LISTENs on the channel with its own (psycopg2) connection
+    """
+
+    def __init__(self, engine, channel):
+        super().__init__(name=f"invalidation-{channel}", daemon=True)
+        self.engine = engine
+        self.channel = channel
+        self.listening = threading.Event()
+        self._stopped = threading.Event()
+        self._connection = None
+
+    def _connect(self):
+        # the connection is detached from the pool, it's kept for the lifetime of the worker
+        connection = self.engine.raw_connection()
+        dbapi_connection = connection.driver_connection
+        connection.detach()
+        dbapi_connection.autocommit = True
+        quoted = self.engine.dialect.identifier_preparer.quote(self.channel)
+        with dbapi_connection.cursor() as cursor:
+            cursor.execute(f"LISTEN {quoted}")
+        self._connection = dbapi_connection
+
+    def _close(self):
+        if self._connection is not None:
+            try:
+                self._connection.close()
+            except Exception:
+                pass
+        self._connection = None
+
+    def _receive(self):
+        if select.select([self._connection], [], [], POLL_TIMEOUT) == ([], [], []):
+            return
+        self._connection.poll()
+        while self._connection.notifies:
+            handle(self._connection.notifies.pop(0).payload)
+
+    def run(self):
+        while not self._stopped.is_set():
+            try:
+                if self._connection is None:
+                    self._connect()
+                    if self.listening.is_set():
+                        # notifications may have been missed while reconnecting
+                        evict(None, None)
+                    self.listening.set()
+                self._receive()
+            except Exception as exc:
+                if self._stopped.is_set():
+                    break
+                safrs.log.warning(f"Cache invalidation listener failed: {exc}")
+                self._close()
+                time.sleep(RECONNECT_DELAY)
+        self._close()
+
+    def stop(self):
+        self._stopped.set()
+        self.join(POLL_TIMEOUT + 1)
+
+
+def install(engine):
+    """
+    Publish the written rows and start the listener of this worker
+    """
+    global _channel, _listener
+    _channel = get_config("INVALIDATION_CHANNEL")
+    for name, listener in SESSION_EVENTS.items():
+        if not event.contains(Session, name, listener):
+            event.listen(Session, name, listener)
+    if not _channel or engine.dialect.name != "postgresql" or (_listener is not None and _listener.is_alive()):
+        return
+    _listener = Listener(engine, _channel)
+    _listener.start()
@@ -0,0 +1,220 @@
+"""
+Flask endpoint classes used for the exposed models
+
+SAFRSBase._rest_api and SAFRSBase._relationship_api select the classes that are
+used to create the collection/instance and relationship endpoints, these
+subclasses add the features that aren't available in safrs itself:
+
+- keyset (cursor) pagination with page[after]/page[before], cfr. app.pagination
+- count strategies for collections (page[count]), cfr. app.counting
+- eager loading of the include= relationships, cfr. app.loading
+- to-many relationship GETs are filtered, sorted and paginated in SQL
+- sort= and filter[...] on jsonapi_attrs with a SQL expression, cfr. app.expressions
+- counts and linkage of to-many relationships that aren't included, cfr. app.linkage
+- the items of relationship payloads are resolved in a single query, cfr. app.instances
+- compiled statement cache hits are recorded per request shape, cfr. app.statement_cache
+- large collection pages are streamed, cfr. app.streaming
+- msgpack documents are negotiated with Accept/Content-Type, cfr. app.negotiation
+- compact documents without links, cfr. app.compact
+- ETags and conditional GETs of instances and collections, cfr. app.conditional
+- read-through cache of the instance and collection GETs, cfr. app.response_cache
+- NDJSON/CSV export of the complete collections on /<collection>/_export, cfr. app.export
+
+`JsonApi` compiles the serializer of every exposed model, cfr. app.serializers,
+and exposes its export route
+"""
+from flask import current_app, jsonify, request, stream_with_context
+from safrs import SAFRSAPI
+from safrs.jsonapi import Resource, SAFRSRestAPI, SAFRSRestRelationshipAPI, make_response
+from safrs.jsonapi_context import JsonApiContext, maybe_jsonapi_context
+from safrs.jsonapi_formatting import _pagination_args, _pagination_links, jsonapi_format_response
+from safrs.safrs_api import api_decorator
+from sqlalchemy.orm.interfaces import MANYTOONE
+
+from app import conditional, counting, response_cache
+from app.export import EXPORT_PATH, MEDIA_TYPES, export_format, export_headers, export_rows
+from app.instances import resolved_scope
+from app.linkage import prefetch_linkage
+from app.loading import eager_load, include_paths, prefetch_dynamic, prefetch_scope
+from app.pagination import keyset_paginate, keyset_requested, relationship_query, sort_query
+from app.serializers import compile_serializer
+from app.statement_cache import shape_scope
+from app.streaming import StreamedPage, stream_collection, streaming_requested
+
+
+def request_context():
+    """
+    :return: the safrs JsonApiContext of the current flask request
+    """
+    ctx = maybe_jsonapi_context()
+    if ctx is None:
+        ctx = JsonApiContext(query_params=request.args)
+    return ctx
+
+
+class RestAPI(SAFRSRestAPI):
+    def get(self, **kwargs):
+        ctx = request_context()
+        key = response_cache.request_key(self.SAFRSObject, request.path, request.query_string.decode("latin-1"), request.headers.get("Authorization"))
+        cached = response_cache.flask_response(key)
+        if cached is not None:
+            return cached
+        if self._s_object_id in kwargs:
+            etag = conditional.instance_etag(self.SAFRSObject, kwargs[self._s_object_id], ctx, request.url)
+            if etag is not None and conditional.matches(request.headers.get("If-None-Match"), etag):
+                return conditional.not_modified(etag)
+            response = conditional.conditional_response(super().get(**kwargs), etag)
+        else:
+            # retrieve a collection, filter, sort and paginate
+            with shape_scope(self.SAFRSObject, ctx):
+                response = self._get_collection(ctx)
+        return response_cache.store_flask_response(key, self.SAFRSObject, ctx, response)
+
+    # the docstring is used to generate the swagger spec
+    get.__doc__ = SAFRSRestAPI.get.__doc__
+
+    def _get_collection(self, ctx):
+        etag = None
+        strategy = counting.count_strategy(self.SAFRSObject, ctx)
+        query = self.SAFRSObject._s_get()
+        if keyset_requested(request.args):
+            if strategy == counting.WINDOW:
+                # the window count would only cover the rows after the cursor
+                strategy = counting.EXACT
+            instances = eager_load(query, self.SAFRSObject, ctx)
+            count = counting.count(instances, self.SAFRSObject, strategy)
+            links, data = keyset_paginate(instances, self.SAFRSObject, ctx, request.path)
+        else:
+            query = sort_query(query, self.SAFRSObject, request.args.get("sort"))
+            instances = eager_load(query, self.SAFRSObject, ctx)
+            page_offset, limit = _pagination_args()
+            if_none_match = request.headers.get("If-None-Match")
+            streamed = streaming_requested(limit)
+            # the row versions are only queried ahead of the page to answer If-None-Match
+            # (and for the headers of streamed pages), else they're loaded with the page
+            etag = conditional.collection_etag(
+                query, self.SAFRSObject, ctx, strategy, page_offset, limit, request.url, row_versions=bool(if_none_match) or streamed
+            )
+            if etag is not None and conditional.matches(if_none_match, etag):
+                return conditional.not_modified(etag)
+            if streamed:
+                return conditional.conditional_response(self._stream_collection(instances, strategy, page_offset, limit, ctx), etag)
+            page = instances if etag is not None else conditional.with_versions(instances, self.SAFRSObject, ctx)
+            data, count, has_more = counting.fetch_page(page, self.SAFRSObject, strategy, page_offset, limit)
+            if page is not instances:
+                data, etag = conditional.page_etag(self.SAFRSObject, ctx, request.url, data, count, has_more)
+            link_count = counting.links_count(page_offset, limit, count, has_more)
+            links = _pagination_links(page_offset, limit, link_count, ctx.collection_path(self.SAFRSObject))
+            links = counting.drop_unknown_links(links, count)
+
+        with prefetch_scope():
+            prefetch_dynamic(data, self.SAFRSObject, include_paths(ctx), ctx)
+            prefetch_linkage(data, self.SAFRSObject, ctx)
+            result = jsonapi_format_response(data, {"count_strategy": strategy}, links, None, count)
+            return conditional.conditional_response(jsonify(result), etag)
+
+    def _stream_collection(self, instances, strategy, page_offset, limit, ctx):
+        def links_for(count, has_more):
+            link_count = counting.links_count(page_offset, limit, count, has_more)
+            links = _pagination_links(page_offset, limit, link_count, collection_path)
+            return counting.drop_unknown_links(links, count)
+
+        def dumps(obj):
+            return current_app.json.dumps(obj, separators=(",", ":"))
+
+        collection_path = ctx.collection_path(self.SAFRSObject)
+        page = StreamedPage(instances, self.SAFRSObject, strategy, page_offset, limit)
+        body = stream_collection(page, self.SAFRSObject, ctx, {"count_strategy": strategy}, links_for, dumps)
+        return current_app.response_class(stream_with_context(body), mimetype=current_app.json.mimetype)
+
+
+class RestRelationshipAPI(SAFRSRestRelationshipAPI):
+    def get(self, **kwargs):
+        if kwargs.get(self.child_object_id) or self.SAFRSObject.relationship.direction == MANYTOONE:
+            return super().get(**kwargs)
+
+        # filter, sort and paginate the to-many relationship in the database
+        # instead of loading all related items
+        ctx = request_context()
+        parent, _ = self.parse_args(**kwargs)
+        instances = relationship_query(parent, self.rel_name, self.target.jsonapi_filter())
+        instances = eager_load(instances, self.target, ctx)
+        if keyset_requested(request.args):
+            count = counting.count(instances, self.target, counting.EXACT)
+            links, data = keyset_paginate(instances, self.target, ctx, request.path)
+        else:
+            instances = sort_query(instances, self.target, request.args.get("sort"))
+            page_offset, limit = _pagination_args()
+            data, count, _ = counting.fetch_page(instances, self.target, counting.EXACT, page_offset, limit)
+            links = _pagination_links(page_offset, limit, count, ctx.collection_path(self.target))
+        with prefetch_scope():
+            prefetch_dynamic(data, self.target, include_paths(ctx), ctx)
+            prefetch_linkage(data, self.target, ctx)
+            # the count of the relationship, like the pagination links
+            result = jsonapi_format_response(data, {}, links, None, count)
+            return make_response(jsonify(result))
+
+    get.__doc__ = SAFRSRestRelationshipAPI.get.__doc__
+
+    def _payload_scope(self):
+        """
+        Resolve the items of a to-many relationship payload in a single query
+        """
+        payload = request.get_jsonapi_payload()
+        data = payload.get("data") if isinstance(payload, dict) else None
+        return resolved_scope(self.target, data)
+
+    def patch(self, **kwargs):
+        with self._payload_scope():
+            return super().patch(**kwargs)
+
+    patch.__doc__ = SAFRSRestRelationshipAPI.patch.__doc__
+
+    def post(self, **kwargs):
+        with self._payload_scope():
+            return super().post(**kwargs)
+
+    post.__doc__ = SAFRSRestRelationshipAPI.post.__doc__
+
+    def delete(self, **kwargs):
+        with self._payload_scope():
+            return super().delete(**kwargs)
+
+    delete.__doc__ = SAFRSRestRelationshipAPI.delete.__doc__
+
+
+class ExportAPI(Resource):
+    """
+    NDJSON/CSV export of the filtered and sorted collection, cfr. app.export
+    """
+
+    SAFRSObject = None
+
+    def get(self, **kwargs):
+        requested = export_format(request.args)
+        instances = sort_query(self.SAFRSObject._s_get(), self.SAFRSObject, request.args.get("sort"))
+        body = export_rows(instances, self.SAFRSObject, request_context(), requested)
+        return current_app.response_class(
+            stream_with_context(body), content_type=MEDIA_TYPES[requested], headers=export_headers(self.SAFRSObject, requested)
+        )
+
+
+class JsonApi(SAFRSAPI):
+    """
+    SAFRSAPI that compiles the serializers of the exposed models and adds their export routes
+    """
+
+    def expose_object(self, safrs_object, url_prefix="", **properties):
+        result = super().expose_object(safrs_object, url_prefix, **properties)
+        compile_serializer(safrs_object)
+        self.expose_export(safrs_object, url_prefix)
+        return result
+
+    def expose_export(self, safrs_object, url_prefix=""):
+        """
+        Expose the export route of `safrs_object`, e.g. /People/_export
+        """
+        url = f"{url_prefix}/{safrs_object._s_collection_name}/{EXPORT_PATH}"
+        # no swagger documentation, the route doesn't return jsonapi documents
+        api_class = api_decorator(type(f"{safrs_object._s_type}_export", (ExportAPI,), {"SAFRSObject": safrs_object}), lambda method: method)
+        self.add_resource(api_class, url, endpoint=f"{safrs_object.get_endpoint(url_prefix)}_export", methods=["GET"])
@@ -0,0 +1,195 @@
+"""
+Relationship linkage without loading the related rows
+
+safrs only fills the to-many relationships of a resource when they're included,
+by loading the related collection of every instance. Models can list to-many
+relationships in `_s_relationship_counts` (relationship name -> number of ids to
+link), when these aren't included in a collection response the relationship
+object contains:
+
+- meta.count: the number of related items
+- data: the resource linkage of the first N related items (ordered by the
+  relationship order_by or the primary key)
+- links.next: the relationship page with the rest of the items
+
+The counts and ids are fetched for the complete page in a single grouped query
+per relationship, e.g.
+
+    SELECT publisher_id, count(*) FROM "Book" WHERE publisher_id IN (...) GROUP BY publisher_id
+
+or, when ids are linked, a `row_number() OVER (PARTITION BY publisher_id)` query
+that only returns the first N rows per parent.
+
+The prefetched linkage is stored in the prefetch scope of app.loading.
+
+The resource linkage of to-one (MANYTOONE) relationships that aren't included
+is built from the local foreign key columns, e.g. Book.author_id, so the target
+rows aren't loaded: the target is only loaded when it's included.
+"""
+from functools import lru_cache
+
+import safrs
+from sqlalchemy import func, inspect, select, tuple_
+from sqlalchemy.orm.base import NO_VALUE
+from sqlalchemy.orm.interfaces import MANYTOMANY, MANYTOONE, ONETOMANY
+
+from app import compact
+from app.instances import jsonapi_id
+from app.loading import include_paths, prefetch_cache
+
+
+def counted_relationships(Model, ctx):
+    """
+    :param ctx: safrs JsonApiContext of the current request
+    :return: dict of relationship name -> number of linked ids, for the to-many
+             relationships of Model that are counted and not included
+    """
+    counts = getattr(Model, "_s_relationship_counts", None) or {}
+    if not counts or compact.requested(ctx):
+        # compact documents don't contain the relationships that aren't included
+        return {}
+    included = {path[0] for path in include_paths(ctx) if path}
+    if safrs.SAFRS.INCLUDE_ALL in included:
+        return {}
+    relationships = Model.__mapper__.relationships
+    result = {}
+    for rel_name, id_count in counts.items():
+        relationship = relationships.get(rel_name)
+        if relationship is None or relationship.direction not in (ONETOMANY, MANYTOMANY) or rel_name in included:
+            continue
+        if not relationship.synchronize_pairs:
+            safrs.log.debug(f"Can't count {Model}.{rel_name} without foreign keys")
+            continue
+        result[rel_name] = id_count
+    return result
+
+
+def _related_linkage(instances, relationship, id_count):
+    """
+    :return: dict of parent key -> (count, [related jsonapi ids])
+    """
+    parent_cols = [local for local, _ in relationship.synchronize_pairs]
+    fk_cols = [remote for _, remote in relationship.synchronize_pairs]
+    parent_attrs = [relationship.parent.get_property_by_column(col).key for col in parent_cols]
+    keys = list({tuple(getattr(instance, attr) for attr in parent_attrs) for instance in instances})
+    if len(fk_cols) == 1:
+        criterion = fk_cols[0].in_([key[0] for key in keys])
+    else:
+        criterion = tuple_(*fk_cols).in_(keys)
+
+    session = safrs.DB.session
+    if not id_count:
+        if relationship.secondary is not None:
+            from_clause = relationship.secondary
+        else:
+            from_clause = relationship.mapper.local_table
+        stmt = select(*fk_cols, func.count()).select_from(from_clause).where(criterion).group_by(*fk_cols)
+        return {tuple(row[:-1]): (row[-1], []) for row in session.execute(stmt)}
+
+    Target = relationship.mapper.class_
+    pk_columns = list(relationship.mapper.primary_key)
+    order_by = list(relationship.order_by or []) or pk_columns
+    stmt = select(
+        *[col.label(f"fk_{i}") for i, col in enumerate(fk_cols)],
+        *[col.label(f"pk_{i}") for i, col in enumerate(pk_columns)],
+        func.row_number().over(partition_by=fk_cols, order_by=order_by).label("position"),
+        func.count().over(partition_by=fk_cols).label("total"),
+    ).select_from(relationship.mapper.local_table)
+    if relationship.secondary is not None:
+        stmt = stmt.join(relationship.secondary, relationship.secondaryjoin)
+    ranked = stmt.where(criterion).subquery()
+    rows = session.execute(select(ranked).where(ranked.c.position <= id_count).order_by(ranked.c.position))
+
+    linkage = {}
+    for row in rows:
+        key = tuple(row[: len(fk_cols)])
+        pk_values = row[len(fk_cols) : len(fk_cols) + len(pk_columns)]
+        _, ids = linkage.setdefault(key, (row.total, []))
+        ids.append(jsonapi_id(Target, pk_columns, pk_values))
+    return linkage
+
+
+def prefetch_linkage(instances, Model, ctx):
+    """
+    Fetch the counts and linked ids of the counted relationships for all `instances`,
+    this should be called inside `prefetch_scope()` after the page has been loaded
+    """
+    cache = prefetch_cache()
+    if cache is None or not instances:
+        return
+    for rel_name, id_count in counted_relationships(Model, ctx).items():
+        relationship = Model.__mapper__.relationships[rel_name]
+        linkage = _related_linkage(instances, relationship, id_count)
+        parent_attrs = [relationship.parent.get_property_by_column(local).key for local, _ in relationship.synchronize_pairs]
+        for instance in instances:
+            key = tuple(getattr(instance, attr) for attr in parent_attrs)
+            cache[(inspect(instance).identity_key, rel_name, "linkage")] = linkage.get(key, (0, []))
+
+
+def related_linkage(instance):
+    """
+    :return: dict of relationship name -> (count, ids) prefetched for `instance`
+    """
+    cache = prefetch_cache()
+    if not cache:
+        return {}
+    counts = getattr(type(instance), "_s_relationship_counts", None) or {}
+    identity_key = inspect(instance).identity_key
+    result = {}
+    for rel_name in counts:
+        linkage = cache.get((identity_key, rel_name, "linkage"))
+        if linkage is not None:
+            result[rel_name] = linkage
+    return result
+
+
+def relationship_object(rel_data, Target, count, ids, page_limit):
+    """
+    Replace the (empty) linkage safrs generated for a counted relationship
+
+    :param rel_data: relationship object generated by `SAFRSBase._s_get_related`
+    :return: the relationship object with the count, linkage and next link
+    """
+    rel_data["data"] = [{"id": jsonapi_id, "type": Target._s_type} for jsonapi_id in ids]
+    rel_data["meta"] = {**rel_data.get("meta", {}), "count": count}
+    if count > len(ids):
+        rel_url = rel_data["links"]["self"]
+        rel_data["links"]["next"] = f"{rel_url}?page[offset]={len(ids)}&page[limit]={page_limit}"
+    return rel_data
+
+
+@lru_cache(maxsize=None)
+def _foreign_key_attrs(relationship):
+    """
+    :return: the names of the local foreign key attributes of the to-one `relationship`,
+             in the order of the target primary key columns, None if the linkage
+             can't be built from them
+    """
+    if relationship.direction != MANYTOONE:
+        return None
+    remote_to_local = {remote: local for local, remote in relationship.local_remote_pairs}
+    pk_columns = list(relationship.mapper.primary_key)
+    if set(remote_to_local) != set(pk_columns):
+        return None
+    return tuple(relationship.parent.get_property_by_column(remote_to_local[col]).key for col in pk_columns)
+
+
+def to_one_linkage(instance, relationship):
+    """
+    :return: the resource identifier of the to-one `relationship` of `instance`
+             (None if it isn't set), NO_VALUE if it can't be built from the foreign keys
+    """
+    Target = relationship.mapper.class_
+    if not hasattr(Target, "_s_type"):
+        return NO_VALUE
+    loaded = inspect(instance).attrs[relationship.key].loaded_value
+    if loaded is not NO_VALUE:
+        # the relationship may have been assigned without flushing the foreign keys
+        return {"id": str(loaded.jsonapi_id), "type": Target._s_type} if loaded is not None else None
+    fk_attrs = _foreign_key_attrs(relationship)
+    if fk_attrs is None:
+        return NO_VALUE
+    values = [getattr(instance, attr) for attr in fk_attrs]
+    if any(value is None for value in values):
+        return None
+    return {"id": jsonapi_id(Target, list(relationship.mapper.primary_key), values), "type": Target._s_type}
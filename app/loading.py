@@ -0,0 +1,230 @@
+"""
+Eager loading of the relationships requested with include=
+
+safrs resolves included relationships per instance while serializing, which
+issues a lazy load per row per relationship hop. Here the include= paths are
+compiled to loader options for the primary query:
+
+- to-one relationships are joinedload-ed, to-many relationships selectinload-ed
+- lazy="dynamic" relationships (e.g. Publisher.books) can't be eager loaded, they
+  are fetched for the complete page in a single query after the page has been
+  loaded and kept in a request scoped cache that's used by
+  ApiMixin._s_related_collection_data
+
+The prefetched relationships are only available inside `prefetch_scope()`,
+which should enclose the serialization of the response.
+
+Sparse fieldsets (fields[Type]=...) are mapped onto `load_only` for the primary
+query and for the included types, so unrequested columns (e.g. Person.comment
+or Publisher.data) aren't fetched at all. The primary key and foreign key
+columns are always loaded because they're needed for the resource linkage.
+"""
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+import safrs
+from safrs.jsonapi_attr import is_jsonapi_attr
+from sqlalchemy import inspect, tuple_
+from sqlalchemy.orm import joinedload, load_only, selectinload
+from sqlalchemy.orm.interfaces import MANYTOONE, ONETOMANY
+
+# lazy strategies that can be overridden with loader options
+EAGER_LOADABLE = ("select", "joined", "subquery", "selectin", True)
+
+_prefetched = ContextVar("prefetched_relationships", default=None)
+
+
+def include_paths(ctx):
+    """
+    :param ctx: safrs JsonApiContext of the current request
+    :return: the include= paths as lists of relationship names
+    """
+    include_csv = ctx.get_include_csv(safrs.SAFRS.DEFAULT_INCLUDED)
+    return [[rel_name for rel_name in inc.split(".") if rel_name] for inc in include_csv.split(",") if inc]
+
+
+def _group_paths(Model, paths):
+    """
+    :return: dict of relationship name -> nested paths, for the relationships of Model
+    """
+    relationships = Model.__mapper__.relationships
+    grouped = {}
+    for path in paths:
+        if not path:
+            continue
+        if path[0] == safrs.SAFRS.INCLUDE_ALL:
+            for rel_name in Model._s_relationships.keys():
+                grouped.setdefault(rel_name, [])
+            continue
+        if path[0] not in relationships:
+            safrs.log.debug(f"Invalid relationship : {Model}.{path[0]}")
+            continue
+        nested = grouped.setdefault(path[0], [])
+        if path[1:]:
+            nested.append(path[1:])
+    return grouped
+
+
+def projected_columns(Model, ctx, extra=()):
+    """
+    :param ctx: safrs JsonApiContext of the current request
+    :param extra: names of additional columns to load (e.g. the sort keys)
+    :return: the column attributes to load for the sparse fieldset of Model,
+             None if all columns should be loaded
+    """
+    fields = ctx.sparse_fields_for_model(Model) if ctx is not None else None
+    if not fields:
+        return None
+    jsonapi_attrs = Model._s_jsonapi_attrs
+    if any(is_jsonapi_attr(jsonapi_attrs.get(name)) for name in fields):
+        # a jsonapi_attr may read any column
+        return None
+
+    mapper = Model.__mapper__
+    column_attrs = mapper.column_attrs
+    keep = {prop.key for prop in column_attrs if any(col.primary_key or col.foreign_keys for col in prop.columns)}
+    for relationship in mapper.relationships:
+        keep.update(mapper.get_property_by_column(col).key for col in relationship.local_columns if col in mapper.columns.values())
+    keep.update(name for name in list(fields) + list(extra) if name in column_attrs)
+    # the row version of the fragment keys, cfr. app.fragments
+    version_column = getattr(Model, "_s_version_column", None)
+    if version_column in column_attrs:
+        keep.add(version_column)
+    if len(keep) == len(column_attrs):
+        return None
+    return [getattr(Model, name) for name in sorted(keep)]
+
+
+def include_options(Model, paths, ctx=None):
+    """
+    :param Model: class of the instances returned by the query
+    :param paths: include paths, cfr. `include_paths`
+    :param ctx: safrs JsonApiContext, used to project the included types on their sparse fieldset
+    :return: loader options for the query
+    """
+    options = []
+    for rel_name, nested in _group_paths(Model, paths).items():
+        relationship = Model.__mapper__.relationships[rel_name]
+        if relationship.lazy not in EAGER_LOADABLE:
+            continue
+        attr = getattr(Model, rel_name)
+        loader = joinedload(attr) if relationship.direction == MANYTOONE else selectinload(attr)
+        Target = relationship.mapper.class_
+        columns = projected_columns(Target, ctx)
+        if columns:
+            loader = loader.load_only(*columns)
+        nested_options = include_options(Target, nested, ctx)
+        options.append(loader.options(*nested_options) if nested_options else loader)
+    return options
+
+
+def eager_load(query, Model, ctx):
+    """
+    :return: `query` with the loader options for the include= paths
+             and the sparse fieldsets of the request
+    """
+    if not hasattr(query, "options"):
+        return query
+    options = include_options(Model, include_paths(ctx), ctx)
+    sort_names = [name.strip().lstrip("-") for name in dict(ctx.query_multi_items()).get("sort", "").split(",")]
+    columns = projected_columns(Model, ctx, sort_names)
+    if columns:
+        options.append(load_only(*columns))
+    return query.options(*options) if options else query
+
+
+@contextmanager
+def prefetch_scope(cache=None):
+    """
+    Scope in which the prefetched dynamic relationships are available
+
+    :param cache: the cache of a previous scope, to keep its prefetched relationships available
+    """
+    token = _prefetched.set({} if cache is None else cache)
+    try:
+        yield
+    finally:
+        _prefetched.reset(token)
+
+
+def prefetch_cache():
+    """
+    :return: the cache of the current prefetch scope, None outside of `prefetch_scope()`
+    """
+    return _prefetched.get()
+
+
+def prefetched(instance, rel_name):
+    """
+    :return: the prefetched items of the dynamic relationship, None if it wasn't prefetched
+    """
+    cache = prefetch_cache()
+    if cache is None:
+        return None
+    return cache.get((inspect(instance).identity_key, rel_name))
+
+
+def _load_dynamic(instances, relationship, nested, ctx):
+    """
+    Load the dynamic relationship for all instances in a single query
+
+    :return: list of the loaded items, or None if the relationship can't be batch loaded
+    """
+    if relationship.direction != ONETOMANY or relationship.secondary is not None:
+        return None
+
+    Target = relationship.mapper.class_
+    pairs = relationship.local_remote_pairs
+    local_attrs = [relationship.parent.get_property_by_column(local).key for local, _ in pairs]
+    remote_attrs = [relationship.mapper.get_property_by_column(remote).key for _, remote in pairs]
+
+    def parent_key(instance):
+        return tuple(getattr(instance, attr) for attr in local_attrs)
+
+    keys = {parent_key(instance) for instance in instances}
+    remote_cols = [getattr(Target, attr) for attr in remote_attrs]
+    if len(remote_cols) == 1:
+        criterion = remote_cols[0].in_([key[0] for key in keys])
+    else:
+        criterion = tuple_(*remote_cols).in_(list(keys))
+
+    options = include_options(Target, nested, ctx)
+    columns = projected_columns(Target, ctx)
+    if columns:
+        options.append(load_only(*columns))
+    query = safrs.DB.session.query(Target).filter(criterion).options(*options)
+    if relationship.order_by:
+        query = query.order_by(*relationship.order_by)
+    items = query.all()
+
+    by_parent = {}
+    for item in items:
+        by_parent.setdefault(tuple(getattr(item, attr) for attr in remote_attrs), []).append(item)
+    cache = _prefetched.get()
+    for instance in instances:
+        cache[(inspect(instance).identity_key, relationship.key)] = by_parent.get(parent_key(instance), [])
+    return items
+
+
+def prefetch_dynamic(instances, Model, paths, ctx=None):
+    """
+    Prefetch the dynamic relationships in the include paths for all `instances`,
+    this should be called inside `prefetch_scope()` after the page has been loaded
+    """
+    if _prefetched.get() is None or not instances:
+        return
+    for rel_name, nested in _group_paths(Model, paths).items():
+        relationship = Model.__mapper__.relationships[rel_name]
+        if relationship.lazy == "dynamic":
+            related = _load_dynamic(instances, relationship, nested, ctx)
+        elif nested:
+            related = []
+            for instance in instances:
+                value = getattr(instance, rel_name)
+                if value is None:
+                    continue
+                related.extend(value if relationship.uselist else [value])
+        else:
+            continue
+        if related and nested:
+            prefetch_dynamic(related, relationship.mapper.class_, nested, ctx)
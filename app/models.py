@@ -1,7 +1,8 @@
 from safrs import jsonapi_rpc, SAFRSFormattedResponse, jsonapi_format_response, paginate
 from safrs.api_methods import startswith, duplicate
-from sqlalchemy import func
-from app.base_model import db, BaseModel
+from sqlalchemy import FetchedValue, cast, event, func, inspect, literal
+from app.base_model import db, ApiMixin, BaseModel
+from app.expressions import sql_expression
 from safrs import SAFRSBase, jsonapi_attr
 from safrs.safrs_types import SafeString
 from flask_httpauth import HTTPBasicAuth
@@ -16,6 +17,26 @@ class HiddenColumn(db.Column):
     permissions = "w"
 
 
+def row_version():
+    """
+        The postgres xmin system column, mapped as the row version of the model (cfr. `_s_version_column`):
+        it's not created, inserted or updated and safrs doesn't expose attributes starting with an underscore
+    """
+    return db.Column("xmin", db.String, system=True, server_default=FetchedValue(), server_onupdate=FetchedValue())
+
+
+@event.listens_for(BaseModel, "before_insert", propagate=True)
+def _insert_without_row_version(mapper, connection, target):
+    """
+        An instance that's copied from a row (e.g. `duplicate`) still holds the row version of that row,
+        system columns can't be inserted
+    """
+    state = inspect(target)
+    for column in mapper.columns:
+        if column.system:
+            state.dict.pop(mapper.get_property_by_column(column).key, None)
+
+
 class DocumentedColumn(db.Column):
     """
         The class attributes are used for the swagger
@@ -84,6 +105,11 @@ class Thing(BaseModel):
         """
         return 100
 
+    @sql_expression(some_attr)
+    def some_attr(cls):
+        # SQL equivalent of the getter, used for sort= and filter[some_attr]
+        return cast(literal(100), db.Integer)
+
 class SubThing(BaseModel):
     __tablename__ = "subthing"
     _s_auto_commit = True
@@ -122,6 +148,7 @@ class Book(BaseModel):
     """
     _s_allow_add_rels = True
     __tablename__ = "Books"
+    _s_cache_responses = True
     id = db.Column(db.String, primary_key=True)
     title = db.Column(db.String, default="")
     reader_id = db.Column(db.String, db.ForeignKey("People.id"))
@@ -132,6 +159,8 @@ class Book(BaseModel):
         "Review", backref="book", cascade="save-update, merge, delete, delete-orphan"
     )
     published = db.Column(db.Time)
+    _version = row_version()
+    _s_version_column = "_version"
 
 
 class Person(BaseModel):
@@ -140,6 +169,7 @@ class Person(BaseModel):
     """
 
     __tablename__ = "People"
+    _s_cache_responses = True
     id = db.Column(db.String, primary_key=True)
     name = db.Column(db.String, default="")
     email = db.Column(db.String, default="")
@@ -158,6 +188,8 @@ class Person(BaseModel):
     reviews = db.relationship("Review", backref="reader")
 
     password = HiddenColumn(db.Text, default="")
+    _version = row_version()
+    _s_version_column = "_version"
     #exclude_attrs = ["password"]
 
 
@@ -213,21 +245,26 @@ class Publisher(BaseModel):
     """
 
     __tablename__ = "Publishers"
+    _s_cache_responses = True
     allow_client_generated_ids = True
     id = db.Column(db.Integer, primary_key=True)  # Integer pk instead of str
     name = db.Column(db.String, default="")
     books = db.relationship("Book", back_populates="publisher", lazy="dynamic")
+    # a publisher may have thousands of books: only the count and the first ids are linked
+    _s_relationship_counts = {"books": 10}
     #books = db.relationship("Book", back_populates="publisher")
     duplicate = duplicate
     unexposed_books = db.relationship("UnexpBook", back_populates="publisher", lazy="dynamic")
     data = db.Column(db.JSON, default = {1:1})
+    _version = row_version()
+    _s_version_column = "_version"
 
     def __init__(self, *args, **kwargs):
         custom_field = kwargs.pop("custom_field", None)
         super().__init__(self, **kwargs)
 
     def to_dict(self):
-        result = SAFRSBase.to_dict(self)
+        result = super().to_dict()
         result["custom_field"] = "some customization"
         return result
 
@@ -285,7 +322,7 @@ def post_login_required(func):
     return func
 
 
-class AuthUser(SAFRSBase, db.Model):
+class AuthUser(ApiMixin, SAFRSBase, db.Model):
     """
         description: User description
     """
@@ -296,7 +333,7 @@ class AuthUser(SAFRSBase, db.Model):
     decorators = [post_login_required]
 
 
-class PKItem(SAFRSBase, db.Model):
+class PKItem(ApiMixin, SAFRSBase, db.Model):
     __tablename__ = "pk_items"
     id = db.Column(db.Integer, primary_key=True)
     pk_A = db.Column(db.String(32), primary_key=True)
@@ -306,7 +343,7 @@ class PKItem(SAFRSBase, db.Model):
     foo = db.Column(db.String(32))
     bar = db.Column(db.String(32))
 
-class UserWithJsonapiAttr(SAFRSBase, db.Model):
+class UserWithJsonapiAttr(ApiMixin, SAFRSBase, db.Model):
     """
         description: User description
     """
@@ -319,6 +356,10 @@ class UserWithJsonapiAttr(SAFRSBase, db.Model):
     @jsonapi_attr
     def some_attr(self):
         return 'some_value'
+
+    @sql_expression(some_attr)
+    def some_attr(cls):
+        return cast(literal("some_value"), db.String)
     
     @some_attr.setter
     def some_attr(self, val):
@@ -326,7 +367,7 @@ class UserWithJsonapiAttr(SAFRSBase, db.Model):
         self.name = val
 
 from sqlalchemy.ext.hybrid import hybrid_method
-class UserWithPerms(SAFRSBase, db.Model):
+class UserWithPerms(ApiMixin, SAFRSBase, db.Model):
     """
         description: User description
     """
@@ -341,3 +382,10 @@ class UserWithPerms(SAFRSBase, db.Model):
         if property_name == "email":
             return False
 
+
+# version counter per table, cfr. app.table_versions
+table_versions = db.Table(
+    "safrs_table_versions",
+    db.Column("table_name", db.String, primary_key=True),
+    db.Column("version", db.BigInteger, nullable=False, default=0),
+)
@@ -0,0 +1,229 @@
+"""
+MessagePack content negotiation for the JSON:API documents
+
+Internal clients can exchange the JSON:API documents as MessagePack instead
+of JSON text when msgpack is installed:
+
+- `Accept: application/vnd.api+msgpack` returns the documents as msgpack
+  (when it's preferred over application/vnd.api+json)
+- `Content-Type: application/vnd.api+msgpack` request payloads
+  (POST/PATCH/bulk) are decoded from msgpack
+
+The document structure is the same. The attributes aren't converted to JSON
+values when they're encoded as msgpack (cfr. app.serializers), datetime,
+date, time, UUID and Decimal values are encoded as msgpack extension types:
+
+    EXT_DATETIME  naive datetime, int64 microseconds since 1970-01-01
+    EXT_DATE      int32 proleptic gregorian ordinal
+    EXT_TIME      int64 microseconds since midnight
+    EXT_UUID      the 16 bytes of the UUID
+    EXT_DECIMAL   the decimal as an ascii string
+
+and timezone aware datetimes as the msgpack timestamp extension type (-1).
+
+Flask: `Request` decodes the msgpack payloads and `JSONProvider` encodes the
+responses of jsonify(). FastAPI: app.fastapi_app.MsgpackMiddleware decodes
+the msgpack payloads and records the accepted media type, JsonApiFastAPI
+renders its documents with app.fastapi_app.MsgpackResponse. Streamed
+collections (cfr. app.streaming) are only streamed as JSON.
+"""
+import datetime
+import decimal
+import struct
+import uuid
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from flask import has_request_context, request
+from safrs.errors import ValidationError
+from safrs.json_encoder import SAFRSJSONEncoder
+from safrs.request import SAFRSRequest
+from werkzeug.datastructures import MIMEAccept
+from werkzeug.http import parse_accept_header
+
+from app import encoding
+
+try:
+    import msgpack
+except ImportError:  # pragma: no cover
+    msgpack = None
+
+MEDIA_TYPE = "application/vnd.api+msgpack"
+JSONAPI_MEDIA_TYPE = "application/vnd.api+json"
+
+EXT_DATETIME = 1
+EXT_DATE = 2
+EXT_TIME = 3
+EXT_UUID = 4
+EXT_DECIMAL = 5
+
+EPOCH = datetime.datetime(1970, 1, 1)
+INT64 = struct.Struct(">q")
+INT32 = struct.Struct(">i")
+
+# whether msgpack is accepted by the client of the current FastAPI request
+_accepted = ContextVar("msgpack_accepted", default=None)
+# set while a msgpack document is encoded
+_native = ContextVar("msgpack_native", default=False)
+
+_encoder = SAFRSJSONEncoder()
+
+
+def available():
+    """
+    :return: True if msgpack is installed
+    """
+    return msgpack is not None
+
+
+def _default(obj):
+    if isinstance(obj, datetime.datetime):
+        if obj.tzinfo is not None:
+            return msgpack.Timestamp.from_datetime(obj)
+        delta = obj - EPOCH
+        return msgpack.ExtType(EXT_DATETIME, INT64.pack((delta.days * 86400 + delta.seconds) * 1000000 + delta.microseconds))
+    if isinstance(obj, datetime.date):
+        return msgpack.ExtType(EXT_DATE, INT32.pack(obj.toordinal()))
+    if isinstance(obj, datetime.time):
+        microseconds = ((obj.hour * 60 + obj.minute) * 60 + obj.second) * 1000000 + obj.microsecond
+        return msgpack.ExtType(EXT_TIME, INT64.pack(microseconds))
+    if isinstance(obj, uuid.UUID):
+        return msgpack.ExtType(EXT_UUID, obj.bytes)
+    if isinstance(obj, decimal.Decimal):
+        return msgpack.ExtType(EXT_DECIMAL, str(obj).encode("ascii"))
+    return _encoder.default(obj)
+
+
+def _ext_hook(code, data):
+    if code == EXT_DATETIME:
+        return EPOCH + datetime.timedelta(microseconds=INT64.unpack(data)[0])
+    if code == EXT_DATE:
+        return datetime.date.fromordinal(INT32.unpack(data)[0])
+    if code == EXT_TIME:
+        seconds, microsecond = divmod(INT64.unpack(data)[0], 1000000)
+        minutes, second = divmod(seconds, 60)
+        hour, minute = divmod(minutes, 60)
+        return datetime.time(hour, minute, second, microsecond)
+    if code == EXT_UUID:
+        return uuid.UUID(bytes=data)
+    if code == EXT_DECIMAL:
+        return decimal.Decimal(data.decode("ascii"))
+    return msgpack.ExtType(code, data)
+
+
+def packb(obj):
+    """
+    :return: the msgpack encoded `obj`
+    """
+    token = _native.set(True)
+    try:
+        return msgpack.packb(obj, default=_default, use_bin_type=True, datetime=False)
+    finally:
+        _native.reset(token)
+
+
+def unpackb(data):
+    """
+    :return: the decoded msgpack `data`
+    :raises ValidationError: if `data` isn't valid msgpack
+    """
+    try:
+        return msgpack.unpackb(data, ext_hook=_ext_hook, timestamp=3, strict_map_key=False)
+    except Exception as exc:
+        raise ValidationError(f"Invalid msgpack payload: {exc}")
+
+
+def native_values():
+    """
+    :return: True while a msgpack document is encoded, its attribute values don't have to be JSON values
+    """
+    return _native.get()
+
+
+def is_msgpack(content_type):
+    """
+    :return: True if `content_type` is the msgpack media type
+    """
+    return bool(content_type) and content_type.split(";")[0].strip() == MEDIA_TYPE
+
+
+def accepts_msgpack(accept):
+    """
+    :param accept: value of the Accept header
+    :return: True if the client prefers msgpack
+    """
+    if not accept or not available():
+        return False
+    return parse_accept_header(accept, MIMEAccept).best_match([JSONAPI_MEDIA_TYPE, MEDIA_TYPE]) == MEDIA_TYPE
+
+
+@contextmanager
+def accepted_scope(accept):
+    """
+    Scope of a request that isn't a flask request, cfr. app.fastapi_app.MsgpackMiddleware
+
+    :param accept: value of the Accept header
+    """
+    token = _accepted.set(accepts_msgpack(accept))
+    try:
+        yield
+    finally:
+        _accepted.reset(token)
+
+
+def msgpack_requested():
+    """
+    :return: True if the response to the current request should be encoded as msgpack
+    """
+    accepted = _accepted.get()
+    if accepted is not None:
+        return accepted
+    return has_request_context() and accepts_msgpack(request.headers.get("Accept"))
+
+
+class Request(SAFRSRequest):
+    """
+    Flask request that decodes msgpack payloads
+    """
+
+    jsonapi_content_types = SAFRSRequest.jsonapi_content_types + [MEDIA_TYPE]
+
+    def get_json(self, force=False, silent=False, cache=True):
+        if not is_msgpack(self.content_type):
+            return super().get_json(force=force, silent=silent, cache=cache)
+        try:
+            return unpackb(self.get_data(cache=cache))
+        except ValidationError:
+            if silent:
+                return None
+            raise
+
+
+class JSONProvider(encoding.JSONProvider):
+    """
+    Flask JSON provider that encodes the responses as msgpack when the client prefers it
+    """
+
+    def response(self, *args, **kwargs):
+        if not msgpack_requested():
+            return super().response(*args, **kwargs)
+        response = self._app.response_class(packb(self._prepare_response_obj(args, kwargs)), mimetype=MEDIA_TYPE)
+        response.msgpack = True
+        return response
+
+
+def _restore_media_type(response):
+    # safrs' make_response sets the jsonapi media type for all responses to jsonapi requests
+    if getattr(response, "msgpack", False):
+        response.mimetype = MEDIA_TYPE
+    return response
+
+
+def install(app):
+    """
+    Negotiate msgpack for the flask `app` when msgpack is available
+    """
+    if available():
+        app.request_class = Request
+        app.json = JSONProvider(app)
+        app.after_request(_restore_media_type)
@@ -0,0 +1,299 @@
+"""
+Keyset (cursor) pagination for collection and relationship GETs
+
+safrs paginates with page[offset]/page[limit], which makes the database scan
+and discard `offset` rows for every deep page. When a request contains
+page[after] or page[before] we switch to keyset pagination instead:
+
+- the sort keys are taken from the `sort=` csv, the primary key columns are
+  appended as a tie-breaker so the ordering is total (composite keys included)
+- the cursor is an opaque, url-safe token holding the sort-key tuple of the
+  last (page[after]) or first (page[before]) row of the previous page
+- the page is fetched with `WHERE (sort_cols) > (:cursor) ORDER BY ... LIMIT n`
+
+An empty page[after]= starts cursor mode on the first page, an empty
+page[before]= on the last page. NULLs sort as the greatest value (postgres'
+default for ASC and DESC), a cursor generated for one sort order is rejected
+when used with another.
+"""
+import base64
+import datetime
+import decimal
+import json
+import uuid
+from urllib.parse import quote
+
+import safrs
+from safrs.errors import ValidationError
+from safrs.jsonapi_formatting import jsonapi_sort
+from sqlalchemy import and_, false, or_, tuple_
+from sqlalchemy.orm import with_parent
+
+from app.expressions import attr_expression
+
+PAGE_AFTER = "page[after]"
+PAGE_BEFORE = "page[before]"
+# query parameters that are replaced when generating the cursor links
+CURSOR_LINK_IGNORE = {PAGE_AFTER, PAGE_BEFORE, "page[offset]", "page[number]"}
+
+
+class SortKey:
+    """
+    A single column of the keyset: the mapped attribute (or the SQL expression
+    of a jsonapi_attr, cfr. app.expressions) and its sort direction
+    """
+
+    def __init__(self, name, attr, descending=False):
+        self.name = name
+        self.attr = attr
+        self.descending = descending
+
+    @property
+    def nullable(self):
+        columns = getattr(getattr(self.attr, "property", None), "columns", None)
+        if columns is None:
+            # an expression may evaluate to NULL
+            return True
+        return any(col.nullable for col in columns)
+
+    @property
+    def python_type(self):
+        try:
+            return self.attr.type.python_type
+        except NotImplementedError:
+            return None
+
+    def order_by(self, reverse=False):
+        """
+        :param reverse: scan in the opposite direction (page[before])
+        :return: order_by clause, NULLs are always the greatest value
+        """
+        descending = self.descending != reverse
+        clause = self.attr.desc() if descending else self.attr.asc()
+        if not self.nullable:
+            return clause
+        return clause.nulls_first() if descending else clause.nulls_last()
+
+    def beyond(self, value, reverse=False):
+        """
+        :return: clause selecting the rows that come after `value` in the scan direction
+        """
+        descending = self.descending != reverse
+        if descending:
+            return self.attr.isnot(None) if value is None else self.attr < value
+        if value is None:
+            return false()
+        if self.nullable:
+            return or_(self.attr > value, self.attr.is_(None))
+        return self.attr > value
+
+    def equals(self, value):
+        return self.attr.is_(None) if value is None else self.attr == value
+
+
+def keyset_requested(query_params):
+    """
+    :param query_params: request.args or the starlette query params
+    :return: True if the client opted in to cursor pagination
+    """
+    return PAGE_AFTER in query_params or PAGE_BEFORE in query_params
+
+
+def sort_keys(Model, sort_csv):
+    """
+    Resolve the `sort=` csv to the keyset columns
+
+    Attributes that can't be sorted in SQL are skipped, like `jsonapi_sort` does.
+    The primary key columns are appended to make the ordering unique.
+
+    :param Model: SAFRSBase subclass
+    :param sort_csv: value of the sort= url parameter
+    :return: list of SortKey
+    """
+    column_attrs = Model.__mapper__.column_attrs
+    pk_names = [_attr_name(Model, col) for col in Model.__mapper__.primary_key]
+    keys = []
+    for sort_attr in (sort_csv or "id").split(","):
+        sort_attr = sort_attr.strip()
+        descending = sort_attr.startswith("-")
+        attr_name = sort_attr.lstrip("-")
+        if attr_name == "id" and "id" not in column_attrs:
+            names = pk_names
+        elif attr_name == "id" or attr_name in Model._s_jsonapi_attrs:
+            names = [attr_name]
+        else:
+            safrs.log.debug(f"{Model} has no attribute {attr_name} in {Model._s_jsonapi_attrs}")
+            continue
+        for name in names:
+            if name in column_attrs:
+                attr = getattr(Model, name)
+            else:
+                attr = attr_expression(Model, name)
+            if attr is None:
+                safrs.log.debug(f"Sorting not implemented for {Model}.{name}")
+                continue
+            if name not in [key.name for key in keys]:
+                keys.append(SortKey(name, attr, descending))
+    for name in pk_names:
+        if name not in [key.name for key in keys]:
+            keys.append(SortKey(name, getattr(Model, name)))
+    return keys
+
+
+def sort_query(query, Model, sort_csv):
+    """
+    Order `query` by the `sort=` csv, like safrs' `jsonapi_sort` but with
+    the primary key tie-breaker of `sort_keys` and the jsonapi_attr expressions
+
+    :return: the ordered query, lists are sorted by `jsonapi_sort`
+    """
+    if not hasattr(query, "order_by"):
+        return jsonapi_sort(query, Model)
+    return query.order_by(*[key.order_by() for key in sort_keys(Model, sort_csv)])
+
+
+def _attr_name(Model, column):
+    """
+    :return: the mapped attribute name of `column` (may differ from the column name)
+    """
+    return Model.__mapper__.get_property_by_column(column).key
+
+
+def sort_signature(Model, keys):
+    sort_spec = ",".join(("-" if key.descending else "") + key.name for key in keys)
+    return f"{Model._s_type}:{sort_spec}"
+
+
+def _encode_value(value):
+    if isinstance(value, (datetime.date, datetime.time)):
+        return value.isoformat()
+    if isinstance(value, (decimal.Decimal, uuid.UUID)):
+        return str(value)
+    return value
+
+
+def _decode_value(key, value):
+    if value is None:
+        return None
+    python_type = key.python_type
+    try:
+        if python_type in (datetime.datetime, datetime.date, datetime.time):
+            return python_type.fromisoformat(value)
+        if python_type in (decimal.Decimal, uuid.UUID):
+            return python_type(value)
+    except (TypeError, ValueError) as exc:
+        raise ValidationError(f"Invalid cursor value for {key.name}") from exc
+    return value
+
+
+def encode_cursor(Model, keys, instance):
+    """
+    :return: opaque cursor token for the sort-key tuple of `instance`
+    """
+    payload = {
+        "s": sort_signature(Model, keys),
+        "v": [_encode_value(getattr(instance, key.name)) for key in keys],
+    }
+    raw = json.dumps(payload, separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(Model, keys, token, param=PAGE_AFTER):
+    """
+    :return: the sort-key tuple encoded in `token`
+    :raises ValidationError: if the token is malformed or was generated for another sort order
+    """
+    try:
+        raw = base64.urlsafe_b64decode(token + "=" * (-len(token) % 4))
+        payload = json.loads(raw)
+        signature, values = payload["s"], payload["v"]
+    except (ValueError, TypeError, KeyError) as exc:
+        raise ValidationError(f"Invalid {param} cursor") from exc
+    if signature != sort_signature(Model, keys) or len(values) != len(keys):
+        raise ValidationError(f"The {param} cursor doesn't match the requested sort order")
+    return [_decode_value(key, value) for key, value in zip(keys, values)]
+
+
+def keyset_filter(keys, values, reverse=False):
+    """
+    :return: clause selecting the rows after the `values` tuple
+
+    A row-value comparison `(a, b) > (:a, :b)` is used when the columns
+    are non-nullable and sorted in the same direction, otherwise the comparison
+    is expanded to `a > :a OR (a = :a AND b > :b)`
+    """
+    if len({key.descending for key in keys}) == 1 and not any(key.nullable for key in keys):
+        columns = tuple_(*[key.attr for key in keys])
+        if keys[0].descending != reverse:
+            return columns < tuple_(*values)
+        return columns > tuple_(*values)
+
+    clauses = []
+    for i, key in enumerate(keys):
+        equal = [prev.equals(value) for prev, value in zip(keys[:i], values[:i])]
+        clauses.append(and_(*equal, key.beyond(values[i], reverse)))
+    return or_(*clauses)
+
+
+def _cursor_link(query_params, base_path, param, token, limit):
+    params = [(key, value) for key, value in query_params if key not in CURSOR_LINK_IGNORE and key != "page[limit]"]
+    params += [(param, token), ("page[limit]", str(limit))]
+    query = "&".join(f"{quote(key, safe='[]')}={quote(value, safe=',')}" for key, value in params)
+    return f"{base_path}?{query}"
+
+
+def keyset_paginate(query, Model, ctx, base_path):
+    """
+    Fetch a single page of `query` using keyset pagination
+
+    :param query: filtered sqla query, it shouldn't be paginated yet
+    :param Model: the SAFRSBase subclass returned by the query
+    :param ctx: safrs JsonApiContext of the current request
+    :param base_path: path used to generate the pagination links
+    :return: links, instances
+    """
+    if not hasattr(query, "order_by"):
+        raise ValidationError("Cursor pagination is not supported for this filter")
+
+    query_params = ctx.query_multi_items()
+    params = dict(query_params)
+    keys = sort_keys(Model, params.get("sort", ""))
+    limit = int(ctx.get_page_limit())
+    reverse = PAGE_BEFORE in params and PAGE_AFTER not in params
+    param = PAGE_BEFORE if reverse else PAGE_AFTER
+    token = params.get(param, "")
+
+    query = query.order_by(None).order_by(*[key.order_by(reverse) for key in keys])
+    if token:
+        values = decode_cursor(Model, keys, token, param)
+        query = query.filter(keyset_filter(keys, values, reverse))
+
+    instances = query.limit(limit + 1).all()
+    has_more = len(instances) > limit
+    instances = instances[:limit]
+    if reverse:
+        instances.reverse()
+
+    links = {
+        "self": _cursor_link(query_params, base_path, param, token, limit),
+        "first": _cursor_link(query_params, base_path, PAGE_AFTER, "", limit),
+    }
+    if instances and (has_more or reverse):
+        links["next"] = _cursor_link(query_params, base_path, PAGE_AFTER, encode_cursor(Model, keys, instances[-1]), limit)
+    if instances and (has_more if reverse else token):
+        links["prev"] = _cursor_link(query_params, base_path, PAGE_BEFORE, encode_cursor(Model, keys, instances[0]), limit)
+    return links, instances
+
+
+def relationship_query(parent, rel_name, query):
+    """
+    :param query: (filtered) query of the relationship target
+    :return: `query` restricted to the instances related to `parent` through `rel_name`,
+             so it can be sorted and paginated in SQL instead of in python
+    """
+    if not hasattr(query, "filter"):
+        # jsonapi_filter may return a list or a single instance
+        related = set(getattr(parent, rel_name))
+        items = query if isinstance(query, (list, tuple)) else [] if query is None else [query]
+        return [item for item in items if item in related]
+    return query.filter(with_parent(parent, getattr(type(parent), rel_name)))
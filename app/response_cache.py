@@ -0,0 +1,230 @@
+"""
+Read-through cache of the instance and collection GET responses
+
+Models opt in with `_s_cache_responses = True`, the backend is configured with
+RESPONSE_CACHE (cfr. config and app.cache: "memory" or a redis:// URL, empty
+disables the cache). The documents of the opted in models are rendered once
+and served from the cache until one of the tables they depend on is written:
+
+- the key is the hash of the request path, the sorted query parameters
+  (include, fields, sort, filter, page, ...), the principal (the
+  Authorization header), the negotiated media type (cfr. app.negotiation) and
+  the profile (cfr. app.compact)
+- the entry depends on the table of the model, the tables of every model
+  reachable through the include= paths and the tables of the counted
+  relationships (cfr. app.linkage)
+- the tables that are written in a session are collected in its `after_flush`
+  event (and for ORM bulk UPDATE/DELETE statements in `do_orm_execute`), the
+  entries that depend on them are invalidated in `after_commit`, a rollback
+  discards them. The other workers invalidate them when they're notified,
+  cfr. app.invalidation
+- a document that was rendered from rows read before a concurrent commit may
+  only be stored after that commit invalidated the cache. Every invalidation
+  is stamped with a clock value per table, the clock is read when a lookup
+  misses and `store` drops the document when one of its tables was
+  invalidated since
+
+The identity body is cached with its ETag (cfr. app.conditional), conditional
+GETs are answered from the cache and the responses are still compressed per
+request (cfr. app.compression). Streamed collections (cfr. app.streaming)
+aren't cached. Writes that don't go through the SQLAlchemy session are only
+picked up when the entry expires after RESPONSE_CACHE_TTL seconds.
+
+Flask: app.jsonapi.RestAPI.get. FastAPI: JsonApiFastAPI._get_instance and _get_collection.
+"""
+import hashlib
+import itertools
+import json
+from contextvars import ContextVar
+from urllib.parse import parse_qsl
+
+from flask import current_app, request
+from safrs.config import get_config
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from app import compact, encoding, invalidation, negotiation
+from app.cache import create_backend
+from app.table_versions import dependencies
+
+# headers of the cached responses
+CACHED_HEADERS = ("Content-Type", "ETag")
+# used when RESPONSE_CACHE_TTL isn't configured
+RESPONSE_CACHE_TTL = 300
+INFO_KEY = "response_cache_tables"
+
+_backend = None
+_clock = itertools.count(1)
+# table -> clock value of its last invalidation, None -> the last clear()
+_invalidated_at = {}
+# clock value of the lookup of the current request
+_read_at = ContextVar("response_cache_read_at", default=None)
+
+
+def configure(backend):
+    """
+    :param backend: the cache backend of the responses, cfr. app.cache, None disables the cache
+    """
+    global _backend
+    _backend = backend
+
+
+def backend():
+    """
+    :return: the configured cache backend, None if the cache is disabled
+    """
+    return _backend
+
+
+def _ttl():
+    configured = get_config("RESPONSE_CACHE_TTL")
+    return float(configured) if configured is not None else RESPONSE_CACHE_TTL
+
+
+def cached(Model):
+    """
+    :return: True if the responses of `Model` are cached
+    """
+    return _backend is not None and getattr(Model, "_s_cache_responses", False)
+
+
+def request_key(Model, path, query_string, authorization):
+    """
+    :param query_string: the (url encoded) query string of the request
+    :param authorization: value of the Authorization header
+    :return: the cache key of the request, None if the responses of `Model` aren't cached
+    """
+    if not cached(Model):
+        return None
+    shape = [path, sorted(parse_qsl(query_string, keep_blank_values=True)), authorization, negotiation.msgpack_requested(), compact.requested()]
+    return f"response:{Model._s_type}:{hashlib.blake2b(encoding.compact(shape), digest_size=16).hexdigest()}"
+
+
+def _pack(headers, body):
+    return encoding.compact(headers) + b"\n" + body
+
+
+def _unpack(value):
+    headers, body = value.split(b"\n", 1)
+    return json.loads(headers), body
+
+
+def lookup(key):
+    """
+    :return: the cached (headers, body) of `key`, None if it isn't cached
+    """
+    if key is None or _backend is None:
+        return None
+    value = _backend.get(key)
+    if value is None:
+        # the rows of the document are read after this
+        _read_at.set(next(_clock))
+        return None
+    return _unpack(value)
+
+
+def store(key, Model, ctx, headers, body):
+    """
+    Cache the `body` and `headers` (dict) of a 200 response, unless one of the
+    tables it depends on was invalidated after the lookup of `key`
+    """
+    if key is None or _backend is None:
+        return
+    tables = dependencies(Model, ctx)
+    if _invalidated_since(tables, _read_at.get()):
+        return
+    headers = {name: headers[name] for name in CACHED_HEADERS if headers.get(name)}
+    _backend.set(key, _pack(headers, body), tables, _ttl())
+
+
+def flask_response(key):
+    """
+    :return: the cached flask response of `key`, answered conditionally, None if it isn't cached
+    """
+    entry = lookup(key)
+    if entry is None:
+        return None
+    headers, body = entry
+    response = current_app.response_class(body, headers=headers)
+    # the media type is restored by app.negotiation
+    response.msgpack = negotiation.msgpack_requested()
+    return response.make_conditional(request)
+
+
+def store_flask_response(key, Model, ctx, response):
+    """
+    Cache a flask `response` when it's a complete 200 response
+    """
+    if key is not None and response.status_code == 200 and not response.is_streamed:
+        store(key, Model, ctx, response.headers, response.get_data())
+    return response
+
+
+def _invalidated_since(tables, read_at):
+    if read_at is None:
+        return True
+    return any(_invalidated_at.get(table, 0) > read_at for table in (*tables, None))
+
+
+def _invalidate(tables):
+    now = next(_clock)
+    for table in tables:
+        _invalidated_at[table] = now
+    if _backend is not None:
+        if None in tables:
+            _backend.clear()
+        else:
+            _backend.invalidate(tables)
+
+
+def _written_tables(session):
+    return session.info.setdefault(INFO_KEY, set())
+
+
+def _after_flush(session, flush_context):
+    tables = _written_tables(session)
+    for instance in (*session.new, *session.dirty, *session.deleted):
+        table = getattr(type(instance), "__table__", None)
+        if table is not None:
+            tables.add(table.name)
+
+
+def _do_orm_execute(orm_execute_state):
+    if (orm_execute_state.is_update or orm_execute_state.is_delete) and orm_execute_state.bind_mapper is not None:
+        _written_tables(orm_execute_state.session).add(orm_execute_state.bind_mapper.local_table.name)
+
+
+def _after_commit(session):
+    tables = session.info.pop(INFO_KEY, None)
+    if tables:
+        _invalidate(tables)
+
+
+def _after_soft_rollback(session, previous_transaction):
+    # the writes of the enclosing transaction may still be committed after a savepoint is rolled back
+    if previous_transaction.parent is None:
+        session.info.pop(INFO_KEY, None)
+
+
+def _invalidated(table, pks):
+    # the tables written by the other workers (None: all tables), cfr. app.invalidation
+    _invalidate([table])
+
+
+SESSION_EVENTS = {
+    "after_flush": _after_flush,
+    "do_orm_execute": _do_orm_execute,
+    "after_commit": _after_commit,
+    "after_soft_rollback": _after_soft_rollback,
+}
+
+
+def install():
+    """
+    Create the configured backend and invalidate its entries when the sessions commit
+    """
+    configure(create_backend(get_config("RESPONSE_CACHE"), get_config("RESPONSE_CACHE_MAX_BYTES")))
+    for name, listener in SESSION_EVENTS.items():
+        if not event.contains(Session, name, listener):
+            event.listen(Session, name, listener)
+    invalidation.subscribe(_invalidated)
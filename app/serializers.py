@@ -0,0 +1,318 @@
+"""
+Per-model serializers compiled when the model is exposed
+
+SAFRSBase._s_jsonapi_encode resolves everything again for every instance:
+the readable attributes and relationships (`_s_check_perm` per attribute), the
+attribute lookup (`hasattr`/`getattr` fallbacks), a json dumps/loads round
+trip per attribute value and a `url_for` call for the self link and for every
+relationship link.
+
+`compile_serializer` is called by `expose_object` of both backends (cfr.
+app.jsonapi.JsonApi and app.fastapi_app.JsonApiFastAPI) and resolves these
+once per model:
+
+- the readable attributes and the names used to get their values
+- a converter per attribute, selected by the python type of the column, that
+  encodes values like the SAFRSJSONEncoder round trip does
+- the readable relationships and their direction
+
+The URL template of the self links is resolved once per request and model.
+`ApiMixin.to_dict`, `_s_get_related` and `_s_jsonapi_encode` use the compiled
+serializer, so `to_dict` overrides (e.g. Publisher.to_dict) are still honoured.
+Models that implement their own `_s_check_perm` aren't compiled, their
+permissions may depend on the instance.
+
+The encoded resources and the included relationship items are recorded in the
+compound document of the request, cfr. app.compound. The encoded attributes
+of the models with a row version are reused across requests, cfr.
+app.fragments. Compact documents (cfr. app.compact) skip the links and the
+relationships that aren't included.
+"""
+import datetime
+import decimal
+import hashlib
+import json
+import re
+import uuid
+from types import SimpleNamespace
+from urllib.parse import quote, urljoin
+
+import safrs
+from flask import current_app, g, has_app_context, has_request_context, request
+from safrs import SAFRSBase
+from safrs.errors import GenericError
+from safrs.json_encoder import SAFRSJSONEncoder
+from safrs.jsonapi_context import maybe_jsonapi_context
+from sqlalchemy import Column
+from sqlalchemy.orm.interfaces import MANYTOMANY, MANYTOONE, ONETOMANY
+
+from app import compact, compound, encoding, fragments, negotiation
+from app.compound import Included
+
+# ids that are never quoted in a URL path, these can be substituted in the URL templates
+URL_SAFE_ID = re.compile(r"[A-Za-z0-9_.~-]+")
+ID_PLACEHOLDER = "safrs-id-placeholder"
+
+_serializers = {}
+
+
+def _roundtrip(value):
+    """
+    Encode `value` like SAFRSBase._s_jsonapi_attrs does
+    """
+    return json.loads(json.dumps(value, cls=current_app.json_encoder))
+
+
+def _native(value):
+    return value if type(value) in (str, int, float, bool) or value is None else _roundtrip(value)
+
+
+def _datetime(value):
+    return value.isoformat(" ") if type(value) is datetime.datetime else _native(value)
+
+
+def _isoformat(value):
+    return value.isoformat() if type(value) in (datetime.date, datetime.time) else _native(value)
+
+
+def _decimal(value):
+    return float(value) if type(value) is decimal.Decimal else _native(value)
+
+
+def _uuid(value):
+    return str(value) if type(value) is uuid.UUID else _native(value)
+
+
+CONVERTERS = {
+    str: _native,
+    int: _native,
+    float: _native,
+    bool: _native,
+    datetime.datetime: _datetime,
+    datetime.date: _isoformat,
+    datetime.time: _isoformat,
+    decimal.Decimal: _decimal,
+    uuid.UUID: _uuid,
+}
+
+
+def _converter(attr):
+    """
+    :param attr: value of Model._s_jsonapi_attrs, a column or a jsonapi_attr
+    :return: the function that encodes the values of `attr`
+    """
+    if not isinstance(attr, Column):
+        return _roundtrip
+    try:
+        python_type = attr.type.python_type
+    except NotImplementedError:
+        return _roundtrip
+    return CONVERTERS.get(python_type, _roundtrip)
+
+
+def _defines(Model, name):
+    return any(name in vars(klass) for klass in Model.__mro__)
+
+
+class Serializer:
+    """
+    jsonapi encoding of the instances of a model
+    """
+
+    def __init__(self, Model):
+        self.Model = Model
+        self.type = Model._s_type
+        self.default_fields = list(Model._s_jsonapi_attrs.keys())
+        # attribute name -> (name used to get the value, converter)
+        self.attributes = {}
+        for name, attr in Model._s_jsonapi_attrs.items():
+            if not Model._s_check_perm(name):
+                continue
+            getter_name = name if _defines(Model, name) else Model.colname_to_attrname(name)
+            self.attributes[name] = (getter_name, _converter(attr))
+        self._relationships = None
+        # fieldset -> fragment shape, cfr. fragment_shape
+        self._fragment_shapes = {}
+
+    @property
+    def relationships(self):
+        """
+        :return: list of the readable (name, direction) relationships, resolved on first use
+                 because a relationship is only readable when its target is exposed
+        """
+        if self._relationships is None:
+            self._relationships = [(name, rel.direction) for name, rel in self.Model._s_relationships.items()]
+        return self._relationships
+
+    def _request_cache(self, ctx):
+        """
+        :return: dict that's kept for the current request and model
+        """
+        cache = getattr(ctx, "_serializer_cache", None)
+        if cache is None:
+            cache = ctx._serializer_cache = {}
+        return cache.setdefault(self.Model, {})
+
+    def instance_path(self, instance, jsonapi_id, ctx):
+        """
+        :return: the self link of `instance`
+        """
+        if ctx is None:
+            return instance._s_url
+        if ctx.instance_path_builder is None:
+            return f"{ctx.collection_path(self.Model)}{quote(jsonapi_id, safe='')}/"
+        if not URL_SAFE_ID.fullmatch(jsonapi_id):
+            return ctx.instance_path(self.Model, instance)
+        cache = self._request_cache(ctx)
+        template = cache.get("instance_path")
+        if template is None:
+            template = cache["instance_path"] = ctx.instance_path_builder(self.Model, SimpleNamespace(jsonapi_id=ID_PLACEHOLDER))
+        return template.replace(ID_PLACEHOLDER, jsonapi_id)
+
+    def _fields(self, ctx):
+        """
+        :return: the sparse fieldset of the request, None if all attributes are requested
+        """
+        if ctx is None:
+            return request.fields.get(self.Model._s_class_name) if has_request_context() else None
+        cache = self._request_cache(ctx)
+        if "fields" not in cache:
+            cache["fields"] = ctx.sparse_fields_for_model(self.Model)
+        return cache["fields"]
+
+    def fragment_shape(self, fields):
+        """
+        :return: the part of the fragment keys that identifies the fieldset and the permission context,
+                 None if the fieldset can't be cached (cfr. app.fragments)
+        """
+        fields = tuple(fields)
+        shape = self._fragment_shapes.get(fields, False)
+        if shape is False:
+            attrs = self.Model._s_jsonapi_attrs
+            if all(isinstance(attrs.get(name), Column) for name in fields):
+                shape = hashlib.blake2b(encoding.compact([fields, list(self.attributes)]), digest_size=8).hexdigest()
+            else:
+                shape = None
+            self._fragment_shapes[fields] = shape
+        return shape
+
+    def attributes_dict(self, instance):
+        """
+        :return: the encoded jsonapi attributes of `instance`, cfr. SAFRSBase._s_jsonapi_attrs
+        """
+        fields = self._fields(maybe_jsonapi_context()) or self.default_fields
+        # msgpack encodes datetime, UUID and Decimal values itself, cfr. app.negotiation
+        encode = has_app_context() and getattr(current_app, "json_encoder", None) is not None and not negotiation.native_values()
+        if encode and current_app.json_encoder is not SAFRSJSONEncoder:
+            # the converters produce the values of the SAFRSJSONEncoder round trip only
+            return SAFRSBase.to_dict(instance)
+        fragment_key = fragments.key(self.Model, instance, self.fragment_shape(fields)) if encode else None
+        result = fragments.lookup(fragment_key)
+        if result is not None:
+            return result
+        result = {}
+        for name in fields:
+            getter_name, converter = self.attributes.get(name, (None, _native))
+            value = getattr(instance, getter_name) if getter_name is not None else ""
+            try:
+                result[name] = converter(value) if encode else value
+            except Exception as exc:
+                safrs.log.warning(f"Failed to fetch {instance}.{name}: {exc}")
+                fragment_key = None
+        fragments.store(fragment_key, self.Model, instance, result)
+        return result
+
+    def related(self, instance):
+        """
+        :return: dict of relationship name -> relationship object, cfr. SAFRSBase._s_get_related
+        """
+        included_list, included_rels, _ = instance._s_get_include_settings()
+        rel_names = {name for name, _ in self.relationships}
+        for rel_name in included_rels:
+            if rel_name != safrs.SAFRS.INCLUDE_ALL and rel_name not in rel_names:
+                raise GenericError(f"Invalid Relationship '{rel_name}'", status_code=400)
+
+        ctx = maybe_jsonapi_context()
+        # compact documents only contain the data of the included relationships, cfr. app.compact
+        compact_document = compact.requested(ctx)
+        if ctx is not None and not compact_document:
+            instance_path = self.instance_path(instance, instance.jsonapi_id, ctx).rstrip("/")
+        include_all = safrs.SAFRS.INCLUDE_ALL in included_list
+        relationships = {}
+        for rel_name, direction in self.relationships:
+            meta = {}
+            data = [] if direction in (ONETOMANY, MANYTOMANY) else None
+            if include_all or rel_name in included_rels:
+                next_included_list = instance._s_nested_included_list(included_list, rel_name)
+                if direction == MANYTOONE:
+                    rel_item = getattr(instance, rel_name)
+                    if rel_item:
+                        data = Included(rel_item, next_included_list)
+                else:
+                    data, meta = instance._s_related_collection_data(rel_name, next_included_list)
+            elif compact_document:
+                continue
+            if compact_document:
+                relationships[rel_name] = {"data": data}
+                continue
+            if ctx is not None:
+                rel_link = f"{instance_path}/{rel_name}"
+            else:
+                rel_link = urljoin(instance._s_url, rel_name)
+            relationships[rel_name] = instance._s_relationship_result(rel_link, data, meta)
+        return relationships
+
+    def encode(self, instance):
+        """
+        :return: the jsonapi resource object of `instance`, cfr. SAFRSBase._s_jsonapi_encode
+        """
+        ctx = maybe_jsonapi_context()
+        builder = compound.document(ctx)
+        jsonapi_id = instance.jsonapi_id
+        if compact.requested(ctx):
+            resource = dict(attributes=instance.to_dict(), id=jsonapi_id, type=self.type)
+            relationships = instance._s_get_related()
+            if relationships:
+                resource["relationships"] = relationships
+        else:
+            self_link = self.instance_path(instance, jsonapi_id, ctx)
+            attributes = instance.to_dict()
+            relationships = instance._s_get_related()
+            resource = dict(attributes=attributes, id=jsonapi_id, links={"self": self_link}, type=self.type, relationships=relationships)
+        if builder is not None:
+            builder.encoded(instance, resource)
+        elif has_request_context():
+            g.ja_data.add(instance)
+        return resource
+
+
+def compile_serializer(Model):
+    """
+    Compile the serializer of an exposed model
+    """
+    _serializers.pop(Model, None)
+    if not hasattr(Model, "__mapper__") or _defines_check_perm(Model):
+        return None
+    try:
+        _serializers[Model] = Serializer(Model)
+    except KeyError as exc:
+        # an attribute that can't be mapped to a column, leave it to safrs
+        safrs.log.debug(f"Not compiling the serializer of {Model}: {exc}")
+        return None
+    return _serializers[Model]
+
+
+def _defines_check_perm(Model):
+    for klass in Model.__mro__:
+        if klass is SAFRSBase:
+            return False
+        if "_s_check_perm" in vars(klass):
+            return True
+    return False
+
+
+def serializer(Model):
+    """
+    :return: the compiled serializer of `Model`, None if it wasn't compiled
+    """
+    return _serializers.get(Model)
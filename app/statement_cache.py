@@ -0,0 +1,162 @@
+"""
+Compiled statement cache statistics per request shape
+
+Collection requests build their query from scratch (filter, sort, pagination,
+include and load_only options), but only the values differ between requests
+with the same "shape": the model, the filter keys, the sort spec, the include
+tree, the sparse fieldsets and the page mode. SQLAlchemy caches the compiled
+form of every statement in an LRU keyed by the statement structure, with the
+values as bound parameters (IN lists are "expanding" parameters, so their
+length doesn't matter either). Repeated shapes skip SQL compilation as long
+as the cache is large enough to hold them, cfr. `query_cache_size` in
+SQLALCHEMY_ENGINE_OPTIONS.
+
+The hit rate of this cache is recorded per request shape and logged every
+`LOG_INTERVAL` statements, `stats()` returns the current counters. The shapes
+come from the query strings of the clients, so only the `MAX_SHAPES` most
+recently used shapes are kept, the counters of the evicted shapes are added
+to the `OVERFLOW` shape.
+"""
+import logging
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from sqlalchemy import event
+from sqlalchemy.engine.default import CACHE_HIT, CACHE_MISS
+
+from app.pagination import keyset_requested
+
+log = logging.getLogger(__name__)
+
+LOG_INTERVAL = 1000
+HITS = "hits"
+MISSES = "misses"
+UNCACHED = "uncached"
+MAX_SHAPES = 1000
+# the shape of the counters of the evicted shapes
+OVERFLOW = "overflow"
+
+_shape = ContextVar("request_shape", default=None)
+
+
+class StatementCacheStats:
+    """
+    Compiled cache hits, misses and uncached statements per request shape
+    """
+
+    def __init__(self, max_shapes=MAX_SHAPES):
+        self.max_shapes = max_shapes
+        self._lock = threading.Lock()
+        self._counters = OrderedDict()
+        self._statements = 0
+
+    def _shape_counters(self, shape):
+        counters = self._counters.get(shape)
+        if counters is not None:
+            self._counters.move_to_end(shape)
+            return counters
+        counters = self._counters[shape] = {HITS: 0, MISSES: 0, UNCACHED: 0}
+        if len(self._counters) > self.max_shapes + (OVERFLOW in self._counters):
+            # the least recently used shape other than the overflow shape
+            evicted_shape = next(key for key in self._counters if key != OVERFLOW)
+            evicted = self._counters.pop(evicted_shape)
+            overflow = self._counters.setdefault(OVERFLOW, {HITS: 0, MISSES: 0, UNCACHED: 0})
+            for outcome, count in evicted.items():
+                overflow[outcome] += count
+        return counters
+
+    def record(self, shape, outcome):
+        with self._lock:
+            counters = self._shape_counters(shape)
+            counters[outcome] += 1
+            self._statements += 1
+            log_now = self._statements % LOG_INTERVAL == 0
+        if log_now:
+            log.info(f"Compiled statement cache hit rate: {self.hit_rate():.1%} ({self._statements} statements)")
+
+    def hit_rate(self, shape=None):
+        """
+        :param shape: request shape, None for all shapes
+        :return: the fraction of the cacheable statements that was found in the compiled cache
+        """
+        with self._lock:
+            counters = [self._counters.get(shape, {})] if shape is not None else list(self._counters.values())
+            hits = sum(counter.get(HITS, 0) for counter in counters)
+            misses = sum(counter.get(MISSES, 0) for counter in counters)
+        return hits / (hits + misses) if hits + misses else 0.0
+
+    def snapshot(self):
+        """
+        :return: dict of request shape -> counters
+        """
+        with self._lock:
+            return {shape: dict(counters) for shape, counters in self._counters.items()}
+
+    def reset(self):
+        with self._lock:
+            self._counters.clear()
+            self._statements = 0
+
+
+_stats = StatementCacheStats()
+
+
+def stats():
+    return _stats
+
+
+def request_shape(Model, ctx):
+    """
+    :param ctx: safrs JsonApiContext of the current request
+    :return: hashable description of the query structure of a collection request
+    """
+    params = ctx.query_multi_items()
+    filter_keys = tuple(sorted({key for key, _ in params if key.startswith("filter")}))
+    fields = tuple(sorted((key, value) for key, value in params if key.startswith("fields[")))
+    param_dict = dict(params)
+    page_mode = "keyset" if keyset_requested(param_dict) else "offset"
+    return (
+        Model._s_type,
+        filter_keys,
+        param_dict.get("sort", ""),
+        param_dict.get("include", ""),
+        fields,
+        page_mode,
+        param_dict.get("page[count]", ""),
+    )
+
+
+@contextmanager
+def shape_scope(Model, ctx):
+    """
+    Attribute the statements executed in this scope to the shape of the request
+    """
+    token = _shape.set(request_shape(Model, ctx))
+    try:
+        yield
+    finally:
+        _shape.reset(token)
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    shape = _shape.get()
+    if shape is None or context is None:
+        return
+    if context.cache_hit is CACHE_HIT:
+        outcome = HITS
+    elif context.cache_hit is CACHE_MISS:
+        outcome = MISSES
+    else:
+        # e.g. text executed with exec_driver_sql (EXPLAIN)
+        outcome = UNCACHED
+    _stats.record(shape, outcome)
+
+
+def install(engine):
+    """
+    Record the compiled cache outcome of the statements executed by `engine`
+    """
+    if not event.contains(engine, "after_cursor_execute", _after_cursor_execute):
+        event.listen(engine, "after_cursor_execute", _after_cursor_execute)
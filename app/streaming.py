@@ -0,0 +1,206 @@
+"""
+Streaming collection responses
+
+jsonapi_format_response builds the complete document in memory before it's
+encoded, so the memory and the time to first byte of a collection response
+grow with page[limit]. Collection pages with a limit of at least
+STREAMING_PAGE_LIMIT (cfr. config, 0 disables streaming) are streamed
+instead:
+
+    {"data":[<resource>,<resource>,...],"included":[...],"jsonapi":{...},"links":{...},"meta":{...}}
+
+The page is fetched with `yield_per`, so rows are fetched and encoded in
+chunks of CHUNK_SIZE (with their included relationships prefetched per chunk,
+cfr. app.loading and app.linkage). The keys are written in sorted order
+like the (sorted) Flask responses. Since `meta` and `links` come last, the
+"none" and "window" count strategies are resolved while the rows are
+streamed.
+
+The jsonapi context, the prefetch scope and the statement cache shape scope
+(cfr. app.statement_cache) are entered for every chunk, so
+the generator can be iterated from other threads or contexts (the FastAPI
+StreamingResponse iterates sync generators in a threadpool).
+
+Errors that occur after the first chunk was sent can't change the response
+status anymore: they're logged and the document is left incomplete.
+
+msgpack documents (cfr. app.negotiation) aren't streamed.
+"""
+from contextlib import contextmanager
+from itertools import islice
+
+import safrs
+from safrs.config import get_config
+from safrs.jsonapi_context import reset_jsonapi_context, set_jsonapi_context
+from safrs.jsonapi_formatting import jsonapi_format_response
+from sqlalchemy import func
+
+from app import compound, counting, negotiation
+from app.linkage import prefetch_linkage
+from app.loading import include_paths, prefetch_dynamic, prefetch_scope
+from app.statement_cache import shape_scope
+
+CHUNK_SIZE = 100
+# used when the STREAMING_PAGE_LIMIT option isn't configured
+STREAMING_PAGE_LIMIT = 1000
+
+
+def streaming_requested(limit):
+    """
+    :param limit: page limit of the request, None for the complete collection
+    :return: True if the collection page should be streamed
+
+    The complete collection (SafrsFastAPI requests without page parameters)
+    isn't streamed: it's served from the response cache and validated with
+    the document ETag like the other unstreamed pages.
+    """
+    if negotiation.msgpack_requested():
+        return False
+    threshold = get_config("STREAMING_PAGE_LIMIT")
+    threshold = int(threshold) if threshold is not None else STREAMING_PAGE_LIMIT
+    if not threshold:
+        return False
+    return limit is not None and limit >= threshold
+
+
+class StreamedPage:
+    """
+    Page of a collection query that's fetched in chunks, cfr. counting.fetch_page
+
+    `count` and `has_more` are available after all chunks have been fetched
+    """
+
+    def __init__(self, query, Model, strategy, offset, limit, chunk_size=CHUNK_SIZE):
+        self.query = query
+        self.Model = Model
+        self.strategy = strategy
+        self.offset = offset
+        self.limit = limit
+        self.chunk_size = chunk_size
+        self.count = None
+        self.has_more = False
+
+    def _page(self, query, limit):
+        query = query.offset(self.offset)
+        return query.limit(limit) if limit is not None else query
+
+    def chunks(self):
+        """
+        :return: generator of lists of instances
+        """
+        if not hasattr(self.query, "offset"):
+            instances, self.count, self.has_more = counting.fetch_page(self.query, self.Model, self.strategy, self.offset, self.limit)
+            yield from _chunked(iter(instances), self.chunk_size)
+            return
+
+        fetched = 0
+        if self.strategy == counting.WINDOW:
+            rows = self._page(self.query.add_columns(func.count().over()), self.limit).yield_per(self.chunk_size)
+            for chunk in _chunked(iter(rows), self.chunk_size):
+                self.count = chunk[0][-1]
+                fetched += len(chunk)
+                yield [row[0] for row in chunk]
+            if not fetched:
+                # past the last page: there's no row to read the window count from
+                self.count = self.query.order_by(None).count() if self.offset else 0
+        elif self.strategy == counting.NONE:
+            limit = self.limit + 1 if self.limit is not None else None
+            rows = self._page(self.query, limit).yield_per(self.chunk_size)
+            for chunk in _chunked(iter(rows), self.chunk_size):
+                if self.limit is not None and fetched + len(chunk) > self.limit:
+                    self.has_more = True
+                    chunk = chunk[: self.limit - fetched]
+                fetched += len(chunk)
+                if chunk:
+                    yield chunk
+            return
+        else:
+            for chunk in _chunked(iter(self._page(self.query, self.limit).yield_per(self.chunk_size)), self.chunk_size):
+                fetched += len(chunk)
+                yield chunk
+            self.count = counting.count(self.query.order_by(None), self.Model, self.strategy)
+        self.has_more = self.offset + fetched < self.count
+
+
+def _chunked(iterator, size):
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+@contextmanager
+def chunk_scope(Model, ctx, cache):
+    """
+    Scope in which a chunk of `Model` instances is fetched and encoded
+    """
+    token = set_jsonapi_context(ctx)
+    try:
+        with shape_scope(Model, ctx), prefetch_scope(cache):
+            yield
+    finally:
+        reset_jsonapi_context(token)
+
+
+def _bytes(encoded):
+    return encoded.encode("utf-8") if isinstance(encoded, str) else encoded
+
+
+def stream_collection(page, Model, ctx, meta, links_for, dumps):
+    """
+    Encode the collection `page` as a jsonapi document, chunk by chunk
+
+    :param page: StreamedPage
+    :param ctx: safrs JsonApiContext of the request
+    :param meta: meta of the document, cfr. jsonapi_format_response
+    :param links_for: function(count, has_more) that returns the pagination links
+    :param dumps: JSON encoding function of the backend, returning str or bytes
+    :return: generator of bytes
+    """
+    paths = include_paths(ctx)
+    cache = {}
+    builder = compound.document(ctx)
+    try:
+        separator = b""
+        yield b'{"data":['
+        chunks = page.chunks()
+        while True:
+            with chunk_scope(Model, ctx, cache):
+                # the rows are fetched in the scope as well
+                chunk = next(chunks, None)
+                if chunk is None:
+                    break
+                prefetch_dynamic(chunk, Model, paths, ctx)
+                prefetch_linkage(chunk, Model, ctx)
+                encoded = [_bytes(dumps(instance)) for instance in chunk]
+                # only the keys of the streamed resources are needed to deduplicate the included resources
+                builder.release()
+            yield separator + b",".join(encoded)
+            separator = b","
+
+        separator = b""
+        yield b'],"included":['
+        while True:
+            with chunk_scope(Model, ctx, cache):
+                # encoding an included instance may include more instances
+                encoded = []
+                while builder.pending() and len(encoded) < page.chunk_size:
+                    encoded.append(_bytes(dumps(builder.pop()._s_jsonapi_encode())))
+                builder.release()
+            if not encoded:
+                break
+            yield separator + b",".join(encoded)
+            separator = b","
+
+        with chunk_scope(Model, ctx, cache):
+            links = links_for(page.count, page.has_more)
+            document = jsonapi_format_response([], meta, links, None, page.count)
+            tail = b"".join(
+                b',"' + name.encode("utf-8") + b'":' + _bytes(dumps(document[name]))
+                for name in ("jsonapi", "links", "meta")
+                if name in document
+            )
+        yield b"]" + tail + b"}"
+    except Exception as exc:
+        safrs.log.exception(f"Streaming the {Model._s_type} collection failed: {exc}")
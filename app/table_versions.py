@@ -0,0 +1,203 @@
+"""
+Per-table version counters
+
+`safrs_table_versions` holds a counter per table that's incremented whenever
+rows of the table are written, caches and ETags validate against the versions
+of the tables a document depends on with one primary key lookup, instead of
+computing the row versions of the document (cfr. app.conditional).
+
+TABLE_VERSIONS configures how the counters are bumped:
+
+- "hooks": the `after_flush` event of the sessions bumps the tables of the
+  inserted, updated and deleted instances, ORM bulk UPDATE/DELETE statements
+  bump their table in `do_orm_execute`. The writes that bypass the session
+  aren't counted, so the ETags (cfr. app.conditional) don't use these
+  versions
+- "triggers": statement level triggers on every table of the models bump the
+  counters, this includes the writes that bypass the SQLAlchemy session
+- empty (the default): the counters aren't used
+
+The counter is bumped in the writing transaction, so it becomes visible when
+the rows do. Concurrent transactions that write the same table wait on its
+counter row until the first one commits. The versions are read once per
+request (`versions` memoizes them on the JsonApiContext), a flush of the
+request's own session drops the memoized versions.
+
+Only Postgres is supported, the counters aren't used for sessions of other databases.
+"""
+import safrs
+from safrs.config import get_config
+from safrs.jsonapi_context import maybe_jsonapi_context
+from sqlalchemy import event, inspect, text
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.orm import Session
+
+# app.models is still being imported when app.conditional imports this module
+from app import models
+from app.linkage import counted_relationships
+from app.loading import include_paths
+
+HOOKS = "hooks"
+TRIGGERS = "triggers"
+CTX_KEY = "_table_versions"
+
+TRIGGER_FUNCTION = """
+CREATE OR REPLACE FUNCTION safrs_bump_table_version() RETURNS trigger AS $$
+BEGIN
+    INSERT INTO safrs_table_versions (table_name, version) VALUES (TG_TABLE_NAME, 1)
+    ON CONFLICT (table_name) DO UPDATE SET version = safrs_table_versions.version + 1;
+    RETURN NULL;
+END
+$$ LANGUAGE plpgsql
+"""
+
+_mode = None
+
+
+def complete():
+    """
+    :return: True if every write bumps the versions, including the writes that bypass the session
+    """
+    return _mode == TRIGGERS
+
+
+def _tables(relationship):
+    """
+    :return: the names of the tables of the target of `relationship`
+    """
+    tables = {relationship.mapper.local_table.name}
+    if relationship.secondary is not None:
+        tables.add(relationship.secondary.name)
+    return tables
+
+
+def dependencies(Model, ctx):
+    """
+    :param ctx: safrs JsonApiContext of the request
+    :return: the names of the tables the documents of `Model` depend on: the table of the model,
+             the tables of every model reachable through the include= paths and the tables of the
+             counted relationships (cfr. app.linkage)
+    """
+    tables = {Model.__table__.name}
+    for path in include_paths(ctx):
+        current = Model
+        for rel_name in path:
+            relationships = current.__mapper__.relationships
+            if rel_name == safrs.SAFRS.INCLUDE_ALL:
+                tables.update(*(_tables(relationship) for relationship in relationships))
+                break
+            relationship = relationships.get(rel_name)
+            if relationship is None:
+                break
+            tables.update(_tables(relationship))
+            current = relationship.mapper.class_
+    for rel_name in counted_relationships(Model, ctx):
+        tables.update(_tables(Model.__mapper__.relationships[rel_name]))
+    return tables
+
+
+def _maintained(session):
+    return bool(_mode) and session.get_bind().dialect.name == "postgresql"
+
+
+def versions(tables, session=None, ctx=None):
+    """
+    :param tables: table names
+    :param ctx: safrs JsonApiContext, the versions are memoized on the context of the current request
+    :return: dict of table name -> version, tables that were never written have version 0,
+             None if the table versions aren't maintained
+    """
+    session = session if session is not None else safrs.DB.session
+    if not _maintained(session):
+        return None
+    ctx = ctx if ctx is not None else maybe_jsonapi_context()
+    memo = getattr(ctx, CTX_KEY, None) if ctx is not None else None
+    if memo is None:
+        memo = {}
+        if ctx is not None:
+            setattr(ctx, CTX_KEY, memo)
+    missing = sorted(set(tables) - memo.keys())
+    if missing:
+        table = models.table_versions
+        rows = session.execute(table.select().with_only_columns(table.c.table_name, table.c.version).where(table.c.table_name.in_(missing)))
+        memo.update(dict.fromkeys(missing, 0))
+        memo.update(dict(rows.all()))
+    return {table: memo[table] for table in tables}
+
+
+def bump(connection, tables):
+    """
+    Increment the versions of `tables` in the transaction of `connection`
+    """
+    if not tables:
+        return
+    table = models.table_versions
+    statement = insert(table).values([{"table_name": name, "version": 1} for name in sorted(tables)])
+    statement = statement.on_conflict_do_update(index_elements=[table.c.table_name], set_={"version": table.c.version + 1})
+    connection.execute(statement)
+    ctx = maybe_jsonapi_context()
+    if ctx is not None and getattr(ctx, CTX_KEY, None):
+        setattr(ctx, CTX_KEY, None)
+
+
+def _after_flush(session, flush_context):
+    if _mode != HOOKS or not _maintained(session):
+        return
+    tables = set()
+    for instance in (*session.new, *session.dirty, *session.deleted):
+        table = getattr(type(instance), "__table__", None)
+        if table is not None:
+            tables.add(table.name)
+    bump(session.connection(), tables)
+
+
+def _do_orm_execute(orm_execute_state):
+    if not (orm_execute_state.is_update or orm_execute_state.is_delete) or orm_execute_state.bind_mapper is None:
+        return
+    if _mode != HOOKS or not _maintained(orm_execute_state.session):
+        return
+    bump(orm_execute_state.session.connection(), {orm_execute_state.bind_mapper.local_table.name})
+
+
+SESSION_EVENTS = {
+    "after_flush": _after_flush,
+    "do_orm_execute": _do_orm_execute,
+}
+
+
+def install_triggers(connection, metadata=None):
+    """
+    Create the trigger that bumps the version of every existing table of `metadata` (the tables of the models)
+    """
+    connection.execute(text(TRIGGER_FUNCTION))
+    preparer = connection.dialect.identifier_preparer
+    inspector = inspect(connection)
+    for table in (metadata or safrs.DB.metadata).sorted_tables:
+        if table is models.table_versions or not inspector.has_table(table.name, schema=table.schema):
+            continue
+        quoted = preparer.format_table(table)
+        connection.execute(text(f"DROP TRIGGER IF EXISTS safrs_table_version ON {quoted}"))
+        connection.execute(
+            text(
+                f"CREATE TRIGGER safrs_table_version AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON {quoted} "
+                "FOR EACH STATEMENT EXECUTE FUNCTION safrs_bump_table_version()"
+            )
+        )
+
+
+def install(engine):
+    """
+    Maintain the table versions in the configured TABLE_VERSIONS mode
+    """
+    global _mode
+    mode = get_config("TABLE_VERSIONS")
+    if mode not in (HOOKS, TRIGGERS, "", None):
+        raise ValueError(f"Invalid TABLE_VERSIONS {mode}")
+    _mode = mode if engine.dialect.name == "postgresql" else None
+    if _mode == TRIGGERS:
+        with engine.begin() as connection:
+            models.table_versions.create(connection, checkfirst=True)
+            install_triggers(connection)
+    for name, listener in SESSION_EVENTS.items():
+        if not event.contains(Session, name, listener):
+            event.listen(Session, name, listener)
@@ -39,3 +39,47 @@ LOGGING = {
         },
     }
 }
+
+# The relationships requested with include= are eager loaded by app.loading,
+# this disables the joinedload options safrs adds to the collection query
+OPTIMIZED_LOADING = False
+
+# Size of the SQLAlchemy compiled statement cache, every request shape (filter
+# keys, sort, include, fieldsets, page mode) adds a few statements to it,
+# cfr. app.statement_cache
+SQLALCHEMY_ENGINE_OPTIONS = {"query_cache_size": 1200}
+
+# Collection pages with a page[limit] of at least this many resources are
+# streamed instead of being built in memory, 0 disables streaming,
+# cfr. app.streaming
+STREAMING_PAGE_LIMIT = 1000
+
+# Responses of at least this many bytes are compressed with the content coding
+# negotiated with Accept-Encoding (gzip, br, zstd), cfr. app.compression
+COMPRESSION_MIN_SIZE = 1024
+
+# Backend of the GET response cache of the models with _s_cache_responses:
+# "memory" (in-process LRU), shm:///dev/shm/<file> (shared by the workers of
+# the host) or a redis://[:password@]host[:port][/db] URL, empty disables the
+# cache, cfr. app.response_cache and app.cache
+RESPONSE_CACHE = os.getenv("RESPONSE_CACHE", "")
+# Byte budget of the in-process and shared memory caches
+RESPONSE_CACHE_MAX_BYTES = 64 * 1024 * 1024
+# Entries expire after this many seconds, for writes that bypass the session
+RESPONSE_CACHE_TTL = 300
+
+# Backend of the cache of the encoded attributes of the models with a
+# _s_version_column, like RESPONSE_CACHE (use another shm file), empty
+# disables the cache, cfr. app.fragments
+FRAGMENT_CACHE = os.getenv("FRAGMENT_CACHE", "")
+FRAGMENT_CACHE_MAX_BYTES = 32 * 1024 * 1024
+FRAGMENT_CACHE_TTL = 3600
+
+# Postgres channel on which the written rows are published to the caches of
+# the other workers, empty disables the notifications, cfr. app.invalidation
+INVALIDATION_CHANNEL = os.getenv("INVALIDATION_CHANNEL", "safrs_invalidation")
+
+# How the version counters of the tables are bumped: "hooks" (session events),
+# "triggers" (database triggers, also catch the writes that bypass the
+# session) or empty to disable them, cfr. app.table_versions
+TABLE_VERSIONS = os.getenv("TABLE_VERSIONS", "")
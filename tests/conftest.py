@@ -3,6 +3,7 @@ from urllib.parse import parse_qsl
 import datetime
 import pytest
 
+from sqlalchemy import event
 from sqlalchemy.orm import scoped_session
 from sqlalchemy.orm import sessionmaker
 from app import create_app, create_api, create_fastapi_api
@@ -28,9 +29,13 @@ class SafrsClient(FlaskClient):
         custom_headers = Headers({
             'Content-Type': 'application/vnd.api+json; ext=bulk'
         })
-        headers = kwargs.pop('headers', Headers())
-        headers.extend(custom_headers)
+        headers = Headers(kwargs.pop('headers', None) or {})
+        if 'Content-Type' not in headers:
+            headers.extend(custom_headers)
         kwargs['headers'] = headers
+        # read and close streamed responses like a WSGI server does,
+        # an unclosed stream_with_context response keeps its request context pushed
+        kwargs.setdefault('buffered', True)
         return super().open(*args, **kwargs)
 
 
@@ -69,6 +74,8 @@ class FastAPICompatClient:
         return query_string
 
     def open(self, path, method="GET", query_string=None, headers=None, **kwargs):
+        if isinstance(kwargs.get("data"), bytes):
+            kwargs["content"] = kwargs.pop("data")
         response = self._client.request(
             method.upper(),
             path,
@@ -163,6 +170,22 @@ def db_session(connection,scope="session"):
         transaction.rollback()
 
 
+@pytest.fixture(scope="function")
+def select_statements(connection):
+    """Records the SELECT statements executed during the test"""
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        if statement.lstrip().upper().startswith("SELECT"):
+            statements.append(statement)
+
+    event.listen(db.engine, "before_cursor_execute", before_cursor_execute)
+    try:
+        yield statements
+    finally:
+        event.remove(db.engine, "before_cursor_execute", before_cursor_execute)
+
+
 @pytest.fixture(scope="session", autouse=True)
 def api(app, database):
     """Init SAFRS"""
@@ -244,6 +267,17 @@ def mock_publisher_lazy_with_3_books(db_session):
     yield publisher
 
 
+@pytest.fixture(scope="function")
+def shared_books(db_session):
+    """
+    4 books of the same publisher, read and written by the same person
+    """
+    publisher = PublisherFactory.create(name="shared_publisher")
+    reader = PersonFactory.create(name="shared_reader")
+    books = [BookFactory.create(title=f"shared_book{i}", publisher=publisher, reader=reader, author=reader) for i in range(4)]
+    return {"publisher_id": publisher.id, "reader_id": reader.id, "book_ids": [book.id for book in books]}
+
+
 @pytest.fixture(scope="function")
 def mock_person_with_3_books_read(db_session):
     person = PersonFactory.create(name="mock_pers_with_3_books_read")
@@ -0,0 +1,101 @@
+"""
+Local stand-in for a Redis server: speaks RESP2 and implements the commands
+used by app.cache.RedisCache, the keys don't expire.
+"""
+import fnmatch
+import socketserver
+import threading
+
+
+class RedisStub(socketserver.ThreadingTCPServer):
+    allow_reuse_address = True
+    daemon_threads = True
+
+    def __init__(self, password=None):
+        super().__init__(("127.0.0.1", 0), RedisHandler)
+        self.password = password
+        self.data = {}
+        self.commands = []
+        self.lock = threading.Lock()
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+
+    @property
+    def url(self):
+        auth = f":{self.password}@" if self.password else ""
+        return f"redis://{auth}127.0.0.1:{self.server_address[1]}/0"
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.shutdown()
+        self.server_close()
+
+
+class RedisHandler(socketserver.StreamRequestHandler):
+    def _read_command(self):
+        line = self.rfile.readline()
+        if not line:
+            return None
+        args = []
+        for _ in range(int(line[1:-2])):
+            length = int(self.rfile.readline()[1:-2])
+            args.append(self.rfile.read(length + 2)[:-2])
+        return args
+
+    def _write(self, value):
+        if value is None:
+            self.wfile.write(b"$-1\r\n")
+        elif isinstance(value, bool):
+            self.wfile.write(b"+OK\r\n")
+        elif isinstance(value, int):
+            self.wfile.write(b":%d\r\n" % value)
+        elif isinstance(value, Exception):
+            self.wfile.write(b"-ERR %s\r\n" % str(value).encode())
+        elif isinstance(value, (list, set)):
+            self.wfile.write(b"*%d\r\n" % len(value))
+            for item in value:
+                self._write(item)
+        else:
+            self.wfile.write(b"$%d\r\n%s\r\n" % (len(value), value))
+
+    def handle(self):
+        authenticated = not self.server.password
+        while True:
+            args = self._read_command()
+            if args is None:
+                return
+            name = args[0].decode().upper()
+            with self.server.lock:
+                self.server.commands.append(name)
+                if name == "AUTH":
+                    authenticated = args[1].decode() == self.server.password
+                    reply = True if authenticated else Exception("invalid password")
+                elif not authenticated:
+                    reply = Exception("NOAUTH Authentication required")
+                else:
+                    reply = self._execute(name, args[1:])
+            self._write(reply)
+
+    def _execute(self, name, args):
+        data = self.server.data
+        if name in ("PING", "SELECT", "PEXPIRE"):
+            return True
+        if name == "GET":
+            return data.get(args[0])
+        if name == "SET":
+            data[args[0]] = args[1]
+            return True
+        if name == "DEL":
+            return sum(data.pop(key, None) is not None for key in args)
+        if name == "SADD":
+            members = data.setdefault(args[0], set())
+            added = set(args[1:]) - members
+            members.update(added)
+            return len(added)
+        if name == "SMEMBERS":
+            return data.get(args[0], set())
+        if name == "KEYS":
+            return [key for key in data if fnmatch.fnmatchcase(key.decode(), args[0].decode())]
+        return Exception(f"unknown command '{name}'")
@@ -0,0 +1,88 @@
+import datetime
+import io
+import json
+
+import pytest
+
+from app import columnar
+from app.models import Review
+from tests.factories import BookFactory, PersonFactory, PublisherFactory
+
+pytestmark = pytest.mark.skipif(not columnar.available(), reason="pyarrow isn't installed")
+
+if columnar.available():
+    import pyarrow
+    import pyarrow.parquet
+
+
+@pytest.fixture
+def columnar_data(db_session):
+    reader = PersonFactory.create(name="columnar_reader", dob=datetime.date(2001, 2, 3), created=datetime.datetime(2021, 3, 4, 5, 6, 7))
+    reader.password = "secret"
+    publisher = PublisherFactory.create(name="columnar_publisher")
+    publisher.data = {"key": [1, 2]}
+    for i in range(3):
+        book = BookFactory.create(title=f"columnar_book{i}", reader=reader, publisher=publisher, published=datetime.time(i, 30))
+        db_session.add(Review(reader_id=reader.id, book_id=book.id, review=f"columnar_review{i}"))
+    # committed like the factories do, the requests roll back what's only flushed
+    db_session.commit()
+    return {"reader_id": reader.id, "email": reader.email, "comment": reader.comment, "publisher_id": publisher.id}
+
+
+def _read(res, export_format):
+    assert res.status_code == 200
+    assert res.headers["Content-Type"] == columnar.MEDIA_TYPES[export_format]
+    if export_format == columnar.PARQUET:
+        return pyarrow.parquet.read_table(io.BytesIO(res.data))
+    return pyarrow.ipc.open_stream(res.data).read_all()
+
+
+@pytest.mark.parametrize("export_format", [columnar.ARROW, columnar.PARQUET])
+def test_columns_are_typed(client, columnar_data, export_format):
+    res = client.get("/People/_export", query_string={"format": export_format, "filter[name]": "columnar_reader"})
+    table = _read(res, export_format)
+
+    assert table.schema.field("dob").type == pyarrow.date32()
+    assert table.schema.field("created").type == pyarrow.timestamp("us")
+    assert table.schema.field("name").type == pyarrow.string()
+    # the write-only password column isn't exported
+    assert "password" not in table.column_names
+    assert table.to_pylist() == [
+        {
+            "id": columnar_data["reader_id"],
+            "name": "columnar_reader",
+            "email": columnar_data["email"],
+            "comment": columnar_data["comment"],
+            "dob": datetime.date(2001, 2, 3),
+            "created": datetime.datetime(2021, 3, 4, 5, 6, 7),
+        }
+    ]
+
+
+def test_time_and_json_columns(client, columnar_data):
+    res = client.get("/Books/_export", query_string={"format": "arrow", "filter[publisher_id]": columnar_data["publisher_id"], "sort": "-title"})
+    table = _read(res, columnar.ARROW)
+    assert table.schema.field("published").type == pyarrow.time64("us")
+    assert table.column("title").to_pylist() == [f"columnar_book{i}" for i in reversed(range(3))]
+    assert table.column("published").to_pylist() == [datetime.time(i, 30) for i in reversed(range(3))]
+
+    res = client.get("/Publishers/_export", query_string={"format": "arrow", "filter[name]": "columnar_publisher"})
+    table = _read(res, columnar.ARROW)
+    assert table.column("id").to_pylist() == [str(columnar_data["publisher_id"])]
+    assert json.loads(table.column("data").to_pylist()[0]) == {"key": [1, 2]}
+
+
+def test_composite_primary_key_ids(client, columnar_data):
+    query = {"filter[reader_id]": columnar_data["reader_id"], "sort": "review"}
+    collection = client.get("/Reviews/", query_string=query).get_json()["data"]
+    table = _read(client.get("/Reviews/_export", query_string={"format": "parquet", **query}), columnar.PARQUET)
+
+    assert table.column("id").to_pylist() == [item["id"] for item in collection]
+    assert table.column("review").to_pylist() == [f"columnar_review{i}" for i in range(3)]
+
+
+def test_batches(client, columnar_data, monkeypatch):
+    monkeypatch.setattr(columnar, "BATCH_SIZE", 2)
+    res = client.get("/Reviews/_export", query_string={"format": "arrow", "filter[reader_id]": columnar_data["reader_id"]})
+    batches = list(pyarrow.ipc.open_stream(res.data))
+    assert [batch.num_rows for batch in batches] == [2, 1]
@@ -0,0 +1,61 @@
+import pytest
+
+from app import compact
+from tests.factories import BookFactory, PersonFactory, PublisherFactory
+
+COMPACT_HEADERS = {"Accept": compact.MEDIA_TYPE}
+
+
+@pytest.fixture
+def compact_book(db_session):
+    reader = PersonFactory.create(name="compact_reader")
+    publisher = PublisherFactory.create(name="compact_publisher")
+    book = BookFactory.create(title="compact_book", reader=reader, publisher=publisher)
+    return {"book_id": book.id, "reader_id": reader.id, "publisher_id": publisher.id}
+
+
+def test_accepts_profile():
+    assert compact.accepts_profile(compact.MEDIA_TYPE)
+    assert compact.accepts_profile(f'text/html, application/vnd.api+json; profile="https://example.com/other {compact.PROFILE}"')
+    assert not compact.accepts_profile("application/vnd.api+json")
+    assert not compact.accepts_profile(None)
+
+
+def test_compact_instance(client, compact_book):
+    path = f"/Books/{compact_book['book_id']}"
+    res = client.get(path, query_string={"include": "reader"}, headers=COMPACT_HEADERS)
+    assert res.status_code == 200
+    assert res.headers["Content-Type"] == compact.MEDIA_TYPE
+    assert "Accept" in res.headers["Vary"]
+    document = res.get_json()
+
+    full = client.get(path, query_string={"include": "reader"}).get_json()
+    assert document["data"] == {
+        "type": "Book",
+        "id": compact_book["book_id"],
+        "attributes": full["data"]["attributes"],
+        "relationships": {"reader": {"data": {"id": compact_book["reader_id"], "type": "Person"}}},
+    }
+    assert document["included"] == [
+        {"type": "Person", "id": compact_book["reader_id"], "attributes": full["included"][0]["attributes"]}
+    ]
+
+
+def test_compact_query_flag(client, compact_book):
+    query = {"filter[name]": "compact_publisher", "page[limit]": 10, compact.QUERY_PARAM: "1"}
+    res = client.get("/Publishers/", query_string=query)
+    assert res.status_code == 200
+    document = res.get_json()
+    # the counted books relationship isn't included
+    assert document["data"] == [{"type": "Publisher", "id": str(compact_book["publisher_id"]), "attributes": document["data"][0]["attributes"]}]
+    assert document["links"]["self"].startswith("/Publishers/")
+
+    full = client.get("/Publishers/", query_string={**query, compact.QUERY_PARAM: "0"})
+    assert full.headers["Content-Type"] == compact.JSONAPI_MEDIA_TYPE
+    assert "links" in full.get_json()["data"][0]
+
+
+def test_compact_etag(client, compact_book):
+    path = f"/Books/{compact_book['book_id']}"
+    etag = client.get(path).headers["ETag"]
+    assert client.get(path, headers=COMPACT_HEADERS).headers["ETag"] != etag
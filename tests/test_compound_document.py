@@ -0,0 +1,77 @@
+from collections import Counter
+
+import pytest
+
+from app import serializers
+from app.models import Review
+
+
+@pytest.fixture
+def shared_reader(db_session, shared_books):
+    db_session.add(Review(reader_id=shared_books["reader_id"], book_id=shared_books["book_ids"][0], review="compound_review"))
+    db_session.commit()
+    return shared_books
+
+
+@pytest.fixture
+def encoded(monkeypatch):
+    counts = Counter()
+    encode = serializers.Serializer.encode
+
+    def counting_encode(self, instance):
+        counts[(instance._s_type, str(instance.jsonapi_id))] += 1
+        return encode(self, instance)
+
+    monkeypatch.setattr(serializers.Serializer, "encode", counting_encode)
+    return counts
+
+
+def _keys(resources):
+    return [(resource["type"], resource["id"]) for resource in resources]
+
+
+def test_resources_are_encoded_once(client, shared_reader, encoded):
+    path = f"/Publishers/{shared_reader['publisher_id']}"
+    res = client.get(path, query_string={"include": "books.reader.books_read,books.author"})
+    assert res.status_code == 200
+    included = res.get_json()["included"]
+
+    keys = _keys(included)
+    assert len(keys) == len(set(keys)) == 5
+    # the reader is reached through 8 edges and every book through 2
+    assert set(encoded.values()) == {1}
+
+
+def test_paths_of_all_edges_are_merged(client, shared_reader):
+    book_id = shared_reader["book_ids"][0]
+    # the reader and the author are the same person, only the author edge includes the reviews
+    for include in ("reader,author.reviews", "author.reviews,reader"):
+        res = client.get(f"/Books/{book_id}", query_string={"include": include})
+        assert res.status_code == 200
+        included = res.get_json()["included"]
+        people = [resource for resource in included if resource["type"] == "Person"]
+        assert len(people) == 1
+        assert people[0]["relationships"]["reviews"]["data"] == [{"id": f"{shared_reader['reader_id']}_{book_id}", "type": "Review"}]
+        assert [resource["type"] for resource in included].count("Review") == 1
+
+
+def test_included_order_is_deterministic(client, shared_reader):
+    path = f"/Publishers/{shared_reader['publisher_id']}"
+    query = {"include": "books.reader"}
+    first = client.get(path, query_string=query).get_json()["included"]
+    second = client.get(path, query_string=query).get_json()["included"]
+    assert _keys(first) == _keys(second)
+    # ordered by the first edge to every resource: the books, then the reader
+    assert [resource_type for resource_type, _ in _keys(first)] == ["Book"] * 4 + ["Person"]
+
+
+def test_primary_data_reached_through_include(client, shared_reader):
+    query = {"filter[publisher_id]": shared_reader["publisher_id"], "include": "publisher.books.reader", "page[limit]": 10}
+    res = client.get("/Books/", query_string=query)
+    assert res.status_code == 200
+    document = res.get_json()
+    data_keys = set(_keys(document["data"]))
+    included_keys = _keys(document["included"])
+    assert not data_keys & set(included_keys)
+    # the books are primary data, their reader is still included
+    assert ("Person", shared_reader["reader_id"]) in included_keys
@@ -0,0 +1,118 @@
+import gzip
+import json
+import zlib
+
+import pytest
+from flask.testing import FlaskClient
+
+from app import compression
+from tests.factories import BookFactory, PersonFactory
+
+if compression.brotli is not None:
+    import brotli
+if compression.zstandard is not None:
+    import zstandard
+
+# the FastAPI test client (httpx) accepts all codings by default
+IDENTITY = {"Accept-Encoding": "identity"}
+
+
+def _decompress(data, coding):
+    if coding == compression.ZSTD:
+        return zstandard.ZstdDecompressor().decompressobj().decompress(data)
+    if coding == compression.BR:
+        return brotli.decompress(data)
+    return gzip.decompress(data)
+
+
+def _body(client, res):
+    # httpx, the FastAPI test client, decodes the content codings itself
+    if isinstance(client, FlaskClient) and "Content-Encoding" in res.headers:
+        return _decompress(res.data, res.headers["Content-Encoding"])
+    return res.data
+
+
+@pytest.fixture
+def compressed_people(db_session):
+    for i in range(30):
+        PersonFactory.create(name=f"compressed_person{i}", email=f"compressed{i}@mail", comment="comment " * 20)
+
+
+@pytest.mark.parametrize("coding", compression.codings())
+def test_codings_round_trip(coding):
+    data = b'{"data":[' + b",".join(b'{"type":"Person","id":"%d"}' % i for i in range(1000)) + b"]}"
+    assert _decompress(compression.compress(data, coding), coding) == data
+
+
+def test_chunks_are_flushed():
+    chunks = [b"chunk %d " % i * 50 for i in range(5)]
+    decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+    compressed = compression.compress_chunks(iter(chunks), compression.GZIP)
+    for chunk in chunks:
+        # every chunk can be decoded as soon as it's received
+        assert decompressor.decompress(next(compressed)) == chunk
+    decompressor.decompress(next(compressed))
+    assert decompressor.eof
+
+
+def test_negotiate():
+    assert compression.negotiate("gzip") == compression.GZIP
+    assert compression.negotiate("br;q=0.5, gzip") == compression.GZIP
+    assert compression.negotiate("*") == compression.codings()[0]
+    assert compression.negotiate("identity") is None
+    assert compression.negotiate("gzip;q=0") is None
+    assert compression.negotiate(None) is None
+
+
+def test_large_documents_are_compressed(client, compressed_people):
+    query = {"filter[email]": ",".join(f"compressed{i}@mail" for i in range(30)), "page[limit]": 30}
+    identity = client.get("/People/", query_string=query, headers=IDENTITY)
+    assert "Content-Encoding" not in identity.headers
+    assert "Accept-Encoding" in identity.headers["Vary"]
+
+    res = client.get("/People/", query_string=query, headers={"Accept-Encoding": "gzip"})
+    assert res.status_code == 200
+    assert res.headers["Content-Encoding"] == compression.GZIP
+    assert json.loads(_body(client, res)) == identity.get_json()
+
+
+def test_small_documents_are_not_compressed(client, db_session):
+    book_id = BookFactory.create(title="small_book").id
+    res = client.get(f"/Books/{book_id}", headers={"Accept-Encoding": "gzip"})
+    assert res.status_code == 200
+    assert "Content-Encoding" not in res.headers
+
+
+def test_compressed_etag_is_weak(client, db_session, monkeypatch):
+    monkeypatch.setattr(compression, "min_size", lambda: 0)
+    book_id = BookFactory.create(title="compressed_book").id
+    etag = client.get(f"/Books/{book_id}", headers=IDENTITY).headers["ETag"]
+
+    res = client.get(f"/Books/{book_id}", headers={"Accept-Encoding": "gzip"})
+    assert res.headers["Content-Encoding"] == compression.GZIP
+    assert res.headers["ETag"] == f"W/{etag}"
+
+    res = client.get(f"/Books/{book_id}", headers={"Accept-Encoding": "gzip", "If-None-Match": f"W/{etag}"})
+    assert res.status_code == 304
+    assert res.headers["ETag"] == f"W/{etag}"
+
+
+def test_streamed_export_is_compressed(client, compressed_people):
+    query = {"filter[email]": ",".join(f"compressed{i}@mail" for i in range(30)), "sort": "name"}
+    identity = client.get("/People/_export", query_string=query, headers=IDENTITY)
+    res = client.get("/People/_export", query_string=query, headers={"Accept-Encoding": compression.codings()[0]})
+    assert res.status_code == 200
+    assert res.headers["Content-Encoding"] == compression.codings()[0]
+    assert "Content-Length" not in res.headers
+    assert _body(client, res) == identity.data
+
+
+@pytest.mark.parametrize("coding", compression.codings())
+def test_swagger_is_precompressed(client, coding):
+    identity = client.get("/swagger.json", headers=IDENTITY)
+    assert identity.status_code == 200
+    res = client.get("/swagger.json", headers={"Accept-Encoding": coding})
+    assert res.status_code == 200
+    assert res.headers["Content-Encoding"] == coding
+    assert _body(client, res) == identity.data
+    assert json.loads(identity.data)["paths"]
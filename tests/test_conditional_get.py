@@ -0,0 +1,97 @@
+from app.models import Book
+from tests.factories import BookFactory
+
+
+def _get(client, path, etag=None, **query):
+    headers = {"If-None-Match": etag} if etag else None
+    return client.get(path, query_string=query, headers=headers)
+
+
+def _rename(db_session, book_id, title):
+    db_session.query(Book).filter(Book.id == book_id).update({"title": title})
+    db_session.commit()
+
+
+def test_instance_not_modified(client, db_session, shared_books, select_statements):
+    path = f"/Books/{shared_books['book_ids'][0]}"
+    res = _get(client, path)
+    assert res.status_code == 200
+    etag = res.headers["ETag"]
+
+    select_statements.clear()
+    res = _get(client, path, etag)
+    assert res.status_code == 304
+    assert res.headers["ETag"] == etag
+    assert res.data == b""
+    # only the row version was selected
+    assert len(select_statements) == 1
+
+    # weak comparison and lists of ETags
+    assert _get(client, path, f'"other", W/{etag}').status_code == 304
+
+    _rename(db_session, shared_books["book_ids"][0], "etag_renamed")
+    res = _get(client, path, etag)
+    assert res.status_code == 200
+    assert res.headers["ETag"] != etag
+    assert res.get_json()["data"]["attributes"]["title"] == "etag_renamed"
+
+
+def test_parameters_are_part_of_the_etag(client, shared_books):
+    path = f"/Books/{shared_books['book_ids'][0]}"
+    etags = {
+        _get(client, path).headers["ETag"],
+        _get(client, path, **{"fields[Book]": "title"}).headers["ETag"],
+        _get(client, path, include="publisher").headers["ETag"],
+    }
+    assert len(etags) == 3
+
+
+def test_included_document_etag(client, db_session, shared_books):
+    # included documents are hashed after they're rendered
+    path = f"/Books/{shared_books['book_ids'][0]}"
+    res = _get(client, path, include="publisher")
+    etag = res.headers["ETag"]
+    assert _get(client, path, etag, include="publisher").status_code == 304
+
+
+def test_collection_not_modified(client, db_session, shared_books):
+    query = {"filter[publisher_id]": shared_books["publisher_id"], "sort": "title", "page[limit]": 2}
+    res = _get(client, "/Books/", **query)
+    assert res.status_code == 200
+    etag = res.headers["ETag"]
+    assert _get(client, "/Books/", etag, **query).status_code == 304
+
+    # a row after the page changes the count
+    BookFactory.create(title="shared_book9", publisher_id=shared_books["publisher_id"])
+    res = _get(client, "/Books/", etag, **query)
+    assert res.status_code == 200
+    etag = res.headers["ETag"]
+    assert res.get_json()["meta"]["count"] == 5
+
+    _rename(db_session, shared_books["book_ids"][1], "shared_book1_renamed")
+    assert _get(client, "/Books/", etag, **query).status_code == 200
+
+
+def test_counted_relationships_document_etag(client, db_session, shared_books):
+    query = {"filter[name]": "shared_publisher", "page[limit]": 10}
+    etag = _get(client, "/Publishers/", **query).headers["ETag"]
+    assert _get(client, "/Publishers/", etag, **query).status_code == 304
+
+    # the relationship count changes, the publisher row doesn't
+    BookFactory.create(title="shared_book9", publisher_id=shared_books["publisher_id"])
+    res = _get(client, "/Publishers/", etag, **query)
+    assert res.status_code == 200
+    assert res.get_json()["data"][0]["relationships"]["books"]["meta"]["count"] == 5
+
+
+def test_collection_versions_are_loaded_with_the_page(client, shared_books, select_statements):
+    query = {"filter[publisher_id]": shared_books["publisher_id"], "sort": "title", "page[limit]": 2}
+    res = _get(client, "/Books/", **query)
+    etag = res.headers["ETag"]
+    # a single count and page query, the page query also selects the row versions
+    assert len([statement for statement in select_statements if "count(" in statement]) == 1
+    pages = [statement for statement in select_statements if "LIMIT" in statement and "count(" not in statement]
+    assert len(pages) == 1 and "xmin" in pages[0]
+
+    # the row versions are queried ahead of the page to answer If-None-Match
+    assert _get(client, "/Books/", etag, **query).status_code == 304
@@ -0,0 +1,69 @@
+from app import models
+from tests.factories import PersonFactory
+
+
+def _create_people(n=5):
+    for i in range(n):
+        PersonFactory.create(name="counted_person")
+
+
+def test_get_people_default_count_is_exact(client, db_session):
+    _create_people()
+    total = db_session.query(models.Person).count()
+
+    res = client.get("/People/", query_string={"page[limit]": 2})
+    assert res.status_code == 200
+    meta = res.get_json()["meta"]
+    assert meta["count_strategy"] == "exact"
+    assert meta["count"] == total
+
+
+def test_get_people_window_count(client, db_session):
+    _create_people()
+
+    res = client.get("/People/", query_string={"filter[name]": "counted_person", "page[limit]": 2, "page[count]": "window"})
+    assert res.status_code == 200
+    result = res.get_json()
+    assert result["meta"]["count_strategy"] == "window"
+    assert result["meta"]["count"] == 5
+    assert len(result["data"]) == 2
+    assert "last" in result["links"]
+
+    res = client.get(
+        "/People/",
+        query_string={"filter[name]": "counted_person", "page[offset]": 10, "page[limit]": 2, "page[count]": "window"},
+    )
+    assert res.get_json()["data"] == []
+    assert res.get_json()["meta"]["count"] == 5
+
+
+def test_get_people_estimated_count(client, db_session):
+    _create_people()
+
+    res = client.get("/People/", query_string={"filter[name]": "counted_person", "page[count]": "estimated"})
+    assert res.status_code == 200
+    meta = res.get_json()["meta"]
+    assert meta["count_strategy"] == "estimated"
+    assert isinstance(meta["count"], int)
+
+
+def test_get_people_no_count(client, db_session):
+    _create_people()
+
+    query = {"filter[name]": "counted_person", "page[limit]": 2, "page[count]": "none"}
+    res = client.get("/People/", query_string=query)
+    assert res.status_code == 200
+    result = res.get_json()
+    assert result["meta"]["count_strategy"] == "none"
+    assert result["meta"]["count"] is None
+    assert "last" not in result["links"]
+    assert "next" in result["links"]
+
+    res = client.get("/People/", query_string={**query, "page[offset]": 4})
+    assert len(res.get_json()["data"]) == 1
+    assert "next" not in res.get_json()["links"]
+
+
+def test_get_people_invalid_count_strategy(client):
+    res = client.get("/People/", query_string={"page[count]": "guess"})
+    assert res.status_code == 400
@@ -0,0 +1,69 @@
+import datetime
+import decimal
+import json
+import uuid
+
+import pytest
+from safrs.json_encoder import SAFRSJSONEncoder
+
+from app import encoding, serializers
+from app.models import Publisher
+from tests.factories import BookFactory, PublisherFactory, ThingFactory
+
+pytestmark = pytest.mark.skipif(not encoding.available(), reason="orjson isn't installed")
+
+
+def test_dumps_matches_the_safrs_encoder():
+    document = {
+        "b": [datetime.datetime(2021, 3, 4, 5, 6, 7, 8), datetime.date(2021, 3, 4), datetime.time(5, 6, 7)],
+        "a": {"decimal": decimal.Decimal("1.5"), "uuid": uuid.UUID(int=1), "text": "ünïcode", "set": {1}},
+        "c": [None, True, 1, 1.25],
+    }
+    expected = json.dumps(document, cls=SAFRSJSONEncoder, sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+    assert encoding.dumps(document, sort_keys=True) == expected.encode("utf-8")
+
+
+def test_dumps_rejects_what_orjson_cant_encode():
+    with pytest.raises(TypeError):
+        encoding.dumps({1: "non-string key"})
+    with pytest.raises(TypeError):
+        encoding.dumps({"big": 2**70})
+
+
+def test_collection_is_encoded_like_safrs(client, db_session):
+    created = datetime.datetime(2021, 3, 4, 5, 6, 7)
+    ThingFactory.create(name="encoded_thing", created=created)
+
+    res = client.get("/thing/", query_string={"filter[name]": "encoded_thing"})
+    assert res.status_code == 200
+    assert res.get_json()["data"][0]["attributes"]["created"] == "2021-03-04 05:06:07"
+
+
+def test_flask_provider_falls_back_for_unsupported_documents(app):
+    provider = encoding.JSONProvider(app)
+    assert provider.dumps({"big": 2**70}) == '{"big": 1180591620717411303424}'
+    assert json.loads(provider.dumps({"b": 1, "a": [2]})) == {"a": [2], "b": 1}
+    assert provider.dumps({"a": 1}, indent=4) == '{\n    "a": 1\n}'
+
+
+def test_flask_provider_indents_like_the_stdlib_encoder(app):
+    document = {"b": [1, {"c": datetime.date(2021, 3, 4)}], "a": {}, "d": []}
+    expected = json.dumps(document, cls=SAFRSJSONEncoder, sort_keys=True, indent=2)
+    assert encoding.JSONProvider(app).dumps(document, indent=2) == expected
+
+
+def test_included_resources_survive_the_fallback(client, db_session, monkeypatch):
+    book = BookFactory.create(title="fallback_book", publisher=PublisherFactory.create(name="fallback_publisher"))
+    attributes_dict = serializers.Serializer.attributes_dict
+
+    def with_big_integer(self, instance):
+        attributes = attributes_dict(self, instance)
+        # orjson only encodes integers of up to 64 bits
+        return {**attributes, "big": 2**70} if isinstance(instance, Publisher) else attributes
+
+    monkeypatch.setattr(serializers.Serializer, "attributes_dict", with_big_integer)
+    res = client.get(f"/Books/{book.id}", query_string={"include": "publisher"})
+    assert res.status_code == 200
+    included = res.get_json()["included"]
+    assert [resource["attributes"]["name"] for resource in included] == ["fallback_publisher"]
+    assert included[0]["attributes"]["big"] == 2**70
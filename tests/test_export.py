@@ -0,0 +1,72 @@
+import csv
+import io
+import json
+
+import pytest
+
+from app.export import CSV_ERROR, EXPORT_ERROR, LineWriter
+from tests.factories import PersonFactory
+
+
+@pytest.fixture
+def exported_people(db_session):
+    for i in range(5):
+        person = PersonFactory.create(name=f"exported_person{i}", email=f"exported{i}@mail")
+        person.password = "secret"
+    db_session.flush()
+
+
+def _export(client, **query):
+    query = {"filter[email]": ",".join(f"exported{i}@mail" for i in range(5)), **query}
+    return client.get("/People/_export", query_string=query)
+
+
+def test_ndjson_export(client, exported_people):
+    res = _export(client, sort="-name")
+    assert res.status_code == 200
+    assert res.headers["Content-Type"].startswith("application/x-ndjson")
+
+    lines = [json.loads(line) for line in res.data.decode("utf-8").splitlines()]
+    assert [line["attributes"]["name"] for line in lines] == [f"exported_person{i}" for i in reversed(range(5))]
+    assert {line["type"] for line in lines} == {"Person"}
+    # the write-only password column isn't exported
+    assert all("password" not in line["attributes"] for line in lines)
+
+
+def test_csv_export(client, exported_people):
+    res = _export(client, format="csv", sort="name", **{"fields[Person]": "name,email,password"})
+    assert res.status_code == 200
+    assert res.headers["Content-Type"].startswith("text/csv")
+    assert 'filename="People.csv"' in res.headers["Content-Disposition"]
+
+    rows = list(csv.reader(io.StringIO(res.data.decode("utf-8"))))
+    assert rows[0] == ["id", "name", "email"]
+    assert [row[1:] for row in rows[1:]] == [[f"exported_person{i}", f"exported{i}@mail"] for i in range(5)]
+
+
+def test_export_matches_the_collection(client, exported_people):
+    collection = client.get("/People/", query_string={"filter[email]": ",".join(f"exported{i}@mail" for i in range(5)), "sort": "name"})
+    lines = [json.loads(line) for line in _export(client, sort="name").data.decode("utf-8").splitlines()]
+    expected = [{"type": item["type"], "id": item["id"], "attributes": item["attributes"]} for item in collection.get_json()["data"]]
+    assert lines == expected
+
+
+def test_invalid_export_format(client, exported_people):
+    res = _export(client, format="xml")
+    assert res.status_code == 400
+
+
+@pytest.mark.parametrize("export_format", ["ndjson", "csv"])
+def test_failed_export_ends_with_an_error(client, exported_people, monkeypatch, export_format):
+    def write(self, instances):
+        raise RuntimeError("connection lost")
+
+    monkeypatch.setattr(LineWriter, "write", write)
+    res = _export(client, format=export_format)
+    # the status was sent before the rows
+    assert res.status_code == 200
+    last = res.data.decode("utf-8").splitlines()[-1]
+    if export_format == "csv":
+        assert next(csv.reader([last]))[0] == CSV_ERROR
+    else:
+        assert json.loads(last) == {"errors": [EXPORT_ERROR]}
@@ -0,0 +1,136 @@
+import pytest
+from sqlalchemy import text
+
+from app import fragments
+from app.cache import MemoryCache
+from app.models import Book, Person, Thing, UserWithJsonapiAttr
+from app.serializers import serializer
+from tests.factories import ThingFactory
+
+
+@pytest.fixture
+def fragment_cache(client):
+    previous = fragments.backend()
+    cache = MemoryCache()
+    fragments.configure(cache)
+    yield cache
+    fragments.configure(previous)
+
+
+@pytest.fixture
+def stored(monkeypatch):
+    keys = []
+    store = fragments.store
+
+    def recording_store(key, Model, instance, attributes):
+        if key is not None:
+            keys.append(key)
+        return store(key, Model, instance, attributes)
+
+    monkeypatch.setattr(fragments, "store", recording_store)
+    return keys
+
+
+def _page(client, shared_books, **query):
+    query = {"filter[publisher_id]": shared_books["publisher_id"], "sort": "title", **query}
+    res = client.get("/Books/", query_string=query)
+    assert res.status_code == 200
+    return res.get_json()
+
+
+def test_fragments_are_reused(client, fragment_cache, shared_books, stored):
+    first = _page(client, shared_books, **{"page[limit]": 3})
+    # 3 books
+    assert len(stored) == 3
+
+    stored.clear()
+    second = _page(client, shared_books, **{"page[offset]": 1, "page[limit]": 3, "include": "reader"})
+    # the last book and the reader are encoded, the others are spliced in
+    assert len(stored) == 2
+    assert second["data"][:2] == [
+        {**resource, "relationships": second["data"][i]["relationships"]} for i, resource in enumerate(first["data"][1:])
+    ]
+
+
+def test_fieldset_is_part_of_the_key(client, fragment_cache, shared_books):
+    _page(client, shared_books)
+    sparse = _page(client, shared_books, **{"fields[Book]": "title"})
+    assert [resource["attributes"] for resource in sparse["data"]] == [{"title": f"shared_book{i}"} for i in range(4)]
+
+
+def test_writes_evict(client, db_session, fragment_cache, shared_books):
+    book_id = shared_books["book_ids"][0]
+    _page(client, shared_books)
+
+    book = db_session.get(Book, book_id)
+    book.title = "shared_renamed"
+    db_session.commit()
+    assert _page(client, shared_books)["data"][-1]["attributes"]["title"] == "shared_renamed"
+
+    db_session.query(Person).filter(Person.id == shared_books["reader_id"]).update({"name": "fragment_bulk"})
+    db_session.commit()
+    included = _page(client, shared_books, include="reader")["included"]
+    assert included[0]["attributes"]["name"] == "fragment_bulk"
+
+
+def test_writes_that_bypass_the_session(client, db_session, fragment_cache, shared_books):
+    _page(client, shared_books, include="reader")
+    db_session.execute(text('UPDATE "People" SET name = :name WHERE id = :id'), {"name": "fragment_raw", "id": shared_books["reader_id"]})
+    db_session.commit()
+    # the row version changed, nothing was evicted
+    included = _page(client, shared_books, include="reader")["included"]
+    assert included[0]["attributes"]["name"] == "fragment_raw"
+
+
+def test_fragments_of_previous_versions_arent_served(client, db_session, fragment_cache, shared_books):
+    book = db_session.get(Book, shared_books["book_ids"][0])
+    compiled = serializer(Book)
+    stale_key = fragments.key(Book, book, compiled.fragment_shape(compiled.default_fields))
+    attributes = book.to_dict()
+    book.title = "shared_renamed"
+    db_session.commit()
+    # a request that read the row before the commit stores its fragment after the eviction
+    fragments.store(stale_key, Book, book, attributes)
+    assert _page(client, shared_books)["data"][-1]["attributes"]["title"] == "shared_renamed"
+
+
+def test_updates_change_the_row_version(client, db_session, fragment_cache, shared_books):
+    book_id = shared_books["book_ids"][0]
+    for published in ("10:00:00", "11:00:00"):
+        _page(client, shared_books)
+        # the title doesn't change
+        db_session.execute(text('UPDATE "Books" SET published = :published WHERE id = :id'), {"published": published, "id": book_id})
+        db_session.commit()
+        assert _page(client, shared_books)["data"][0]["attributes"]["published"] == published
+
+
+def test_models_without_a_row_version_arent_cached(client, fragment_cache, stored):
+    thing = ThingFactory.create(name="fragment_thing")
+    assert client.get(f"/{Thing._s_collection_name}/{thing.id}").status_code == 200
+    assert not getattr(Thing, "_s_version_column", None)
+    assert not stored
+
+
+def test_rollback_evicts(client, db_session, fragment_cache, shared_books):
+    book = db_session.get(Book, shared_books["book_ids"][0])
+    book.title = "fragment_uncommitted"
+    db_session.flush()
+    # the session reads its own write
+    assert book.to_dict()["title"] == "fragment_uncommitted"
+    db_session.rollback()
+    assert _page(client, shared_books)["data"][0]["attributes"]["title"] == "shared_book0"
+
+
+def test_pending_changes_are_not_cached(client, db_session, fragment_cache, shared_books, stored):
+    book = db_session.get(Book, shared_books["book_ids"][0])
+    book.to_dict()
+    book.title = "fragment_pending"
+    assert book.to_dict()["title"] == "fragment_pending"
+    assert len(stored) == 1
+
+
+def test_attributes_that_arent_columns_are_not_cached(app):
+    compiled = serializer(UserWithJsonapiAttr)
+    assert compiled.fragment_shape(["name", "some_attr"]) is None
+    assert compiled.fragment_shape(["name"]) is not None
+    assert compiled.fragment_shape(["name"]) != compiled.fragment_shape(["name", "email"])
@@ -0,0 +1,42 @@
+from tests.factories import BookFactory, PersonFactory, PublisherFactory
+
+
+def _queries_for(client, select_statements, path, query_string):
+    select_statements.clear()
+    res = client.get(path, query_string=query_string)
+    assert res.status_code == 200
+    return len(select_statements), res.get_json()
+
+
+def test_get_people_include_two_hops_doesnt_query_per_row(client, select_statements):
+    for i in range(6):
+        reader = PersonFactory.create(name="eager_reader")
+        BookFactory.create(reader=reader, author=PersonFactory.create(name="eager_author"))
+
+    query = {"filter[name]": "eager_reader", "include": "books_read.author"}
+    few, result = _queries_for(client, select_statements, "/People/", {**query, "page[limit]": 2})
+    many, result = _queries_for(client, select_statements, "/People/", {**query, "page[limit]": 6})
+
+    assert few == many
+    assert len(result["data"]) == 6
+    included_types = {(inc["type"], inc["attributes"]["name"]) for inc in result["included"] if inc["type"] == "Person"}
+    assert included_types == {("Person", "eager_author")}
+
+
+def test_get_publishers_include_dynamic_relationship(client, select_statements):
+    publishers = [PublisherFactory.create(name="eager_publisher") for i in range(4)]
+    for publisher in publishers:
+        for i in range(2):
+            BookFactory.create(publisher=publisher, reader=PersonFactory.create(name="eager_reader"))
+    expected = {publisher.id: sorted(book.id for book in publisher.books) for publisher in publishers}
+
+    query = {"filter[name]": "eager_publisher", "include": "books.reader", "sort": "id"}
+    few, result = _queries_for(client, select_statements, "/Publishers/", {**query, "page[limit]": 1})
+    many, result = _queries_for(client, select_statements, "/Publishers/", {**query, "page[limit]": 4})
+
+    assert few == many
+    for publisher in result["data"]:
+        books = publisher["relationships"]["books"]
+        assert sorted(book["id"] for book in books["data"]) == expected[int(publisher["id"])]
+        assert books["meta"]["count"] == 2
+    assert len([inc for inc in result["included"] if inc["type"] == "Person"]) == 8
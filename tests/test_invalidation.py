@@ -0,0 +1,93 @@
+import json
+import queue
+
+import pytest
+from sqlalchemy import event
+
+from app import fragments, invalidation
+from app.cache import MemoryCache
+from app.models import Book, db
+from tests.factories import BookFactory
+from tests.helpers.db import connect_db
+
+CHANNEL = "safrs_invalidation_test"
+
+
+@pytest.fixture
+def received():
+    messages = queue.Queue()
+
+    def callback(table, pks):
+        messages.put((table, pks))
+
+    invalidation.subscribe(callback)
+    yield messages
+    invalidation._subscribers.remove(callback)
+
+
+@pytest.fixture
+def notifications(db_session):
+    payloads = []
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        if "pg_notify" in statement:
+            channel, payload = parameters.values()
+            assert channel == invalidation._channel
+            payloads.append(json.loads(payload))
+
+    event.listen(db.engine, "before_cursor_execute", before_cursor_execute)
+    yield payloads
+    event.remove(db.engine, "before_cursor_execute", before_cursor_execute)
+
+
+def test_payloads_are_split():
+    pks = {f"{i:05}" for i in range(2000)}
+    payloads = list(invalidation.payloads({"Books": pks, "People": None}))
+    assert len(payloads) > 2
+    assert all(len(payload) < invalidation.PAYLOAD_LIMIT for payload in payloads)
+    messages = [json.loads(payload) for payload in payloads]
+    assert messages[-1] == {"table": "People", "pks": None}
+    assert sorted(pk for message in messages[:-1] for pk in message["pks"]) == sorted(pks)
+
+
+def test_flushed_rows_are_published(db_session, notifications):
+    book = BookFactory.create(title="notified_book")
+    assert {"table": "Books", "pks": [book.id]} in notifications
+
+    db_session.query(Book).filter(Book.id == book.id).update({"title": "notified_bulk"})
+    assert notifications[-1] == {"table": "Books", "pks": None}
+
+
+def test_listener_evicts(app, received):
+    listener = invalidation.Listener(db.engine, CHANNEL)
+    listener.start()
+    try:
+        assert listener.listening.wait(10)
+        connection = connect_db()
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT pg_notify(%s, %s)", (CHANNEL, json.dumps({"table": "Books", "pks": ["1"]})))
+                cursor.execute("SELECT pg_notify(%s, %s)", (CHANNEL, "invalid"))
+                cursor.execute("SELECT pg_notify(%s, %s)", (CHANNEL, json.dumps({"table": "People", "pks": None})))
+        finally:
+            connection.close()
+        assert received.get(timeout=10) == ("Books", ["1"])
+        assert received.get(timeout=10) == ("People", None)
+    finally:
+        listener.stop()
+
+
+def test_fragments_of_notified_rows_are_evicted(client, db_session):
+    previous = fragments.backend()
+    fragments.configure(MemoryCache())
+    try:
+        books = [BookFactory.create(title=f"evicted_book{i}") for i in range(2)]
+        for book in books:
+            book.to_dict()
+        assert len(fragments.backend()) == 2
+        invalidation.evict("Books", [books[0].id])
+        assert len(fragments.backend()) == 1
+        invalidation.evict("Books", None)
+        assert len(fragments.backend()) == 0
+    finally:
+        fragments.configure(previous)
@@ -0,0 +1,42 @@
+from app import models
+from tests.factories import ThingFactory
+
+
+def test_filter_jsonapi_attr_expression_in_sql(client, db_session, select_statements):
+    for i in range(3):
+        ThingFactory.create(name="expression_thing")
+
+    select_statements.clear()
+    res = client.get("/thing/", query_string={"filter[name]": "expression_thing", "filter[some_attr]": "100"})
+    assert res.status_code == 200
+    assert len(res.get_json()["data"]) == 3
+    assert any("CAST" in statement and "WHERE" in statement for statement in select_statements)
+
+    res = client.get("/thing/", query_string={"filter[name]": "expression_thing", "filter[some_attr]": "200"})
+    assert res.status_code == 200
+    assert res.get_json()["data"] == []
+
+
+def test_sort_jsonapi_attr_expression_in_sql(client, db_session, select_statements):
+    for i in range(3):
+        ThingFactory.create(name="expression_thing", description=f"description {2 - i}")
+    expected = [
+        thing.id
+        for thing in db_session.query(models.Thing).filter_by(name="expression_thing").order_by(models.Thing.description)
+    ]
+
+    select_statements.clear()
+    query = {"filter[name]": "expression_thing", "sort": "-some_attr,description"}
+    res = client.get("/thing/", query_string=query)
+    assert res.status_code == 200
+    assert [thing["id"] for thing in res.get_json()["data"]] == expected
+    assert any("ORDER BY CAST" in statement for statement in select_statements)
+
+    seen = []
+    res = client.get("/thing/", query_string={**query, "page[after]": "", "page[limit]": 2})
+    seen += [thing["id"] for thing in res.get_json()["data"]]
+    cursor_link = res.get_json()["links"]["next"]
+    res = client.get(cursor_link)
+    assert res.status_code == 200
+    seen += [thing["id"] for thing in res.get_json()["data"]]
+    assert seen == expected
@@ -0,0 +1,96 @@
+from urllib.parse import parse_qsl, urlsplit
+
+from app import models
+from tests.factories import BookFactory, PersonFactory
+
+
+def _follow(client, link):
+    url = urlsplit(link)
+    return client.get(url.path, query_string=parse_qsl(url.query, keep_blank_values=True))
+
+
+def _ids(res):
+    return [item["id"] for item in res.get_json()["data"]]
+
+
+def test_get_people_keyset_walks_all_pages(client, db_session):
+    for i in range(5):
+        PersonFactory.create(name="keyset_person")
+
+    expected = [p.id for p in db_session.query(models.Person).filter_by(name="keyset_person").order_by(models.Person.id)]
+    res = client.get("/People/", query_string={"filter[name]": "keyset_person", "page[after]": "", "page[limit]": 2})
+    assert res.status_code == 200
+    assert "prev" not in res.get_json()["links"]
+
+    seen = _ids(res)
+    while "next" in res.get_json()["links"]:
+        res = _follow(client, res.get_json()["links"]["next"])
+        assert res.status_code == 200
+        seen += _ids(res)
+
+    assert seen == expected
+
+
+def test_get_people_keyset_before_returns_previous_page(client, db_session):
+    for i in range(5):
+        PersonFactory.create(name="keyset_person", email=f"{i % 2}@mail")
+
+    expected = [
+        p.id
+        for p in db_session.query(models.Person)
+        .filter_by(name="keyset_person")
+        .order_by(models.Person.email.desc(), models.Person.id)
+    ]
+    query = {"filter[name]": "keyset_person", "sort": "-email", "page[limit]": 2}
+    first = client.get("/People/", query_string={**query, "page[after]": ""})
+    second = _follow(client, first.get_json()["links"]["next"])
+    assert _ids(first) + _ids(second) == expected[:4]
+
+    prev = _follow(client, second.get_json()["links"]["prev"])
+    assert prev.status_code == 200
+    assert _ids(prev) == _ids(first)
+
+
+def test_get_people_keyset_rejects_cursor_for_other_sort(client, db_session):
+    for i in range(3):
+        PersonFactory.create(name="keyset_person")
+
+    res = client.get("/People/", query_string={"filter[name]": "keyset_person", "page[after]": "", "page[limit]": 1})
+    cursor = dict(parse_qsl(urlsplit(res.get_json()["links"]["next"]).query))["page[after]"]
+
+    res = client.get("/People/", query_string={"sort": "name", "page[after]": cursor})
+    assert res.status_code == 400
+
+    res = client.get("/People/", query_string={"page[after]": "not-a-cursor"})
+    assert res.status_code == 400
+
+
+def test_get_pkitems_keyset_composite_key(client, db_session):
+    res = client.get("/pk_items/", query_string={"page[after]": "", "page[limit]": 7})
+    assert res.status_code == 200
+    seen = _ids(res)
+    while "next" in res.get_json()["links"]:
+        res = _follow(client, res.get_json()["links"]["next"])
+        seen += _ids(res)
+
+    assert len(seen) == len(set(seen)) == db_session.query(models.PKItem).count()
+
+
+def test_get_person_books_read_keyset(client, mock_person_with_3_books_read):
+    expected = sorted(book.id for book in mock_person_with_3_books_read.books_read)
+    path = f"/People/{mock_person_with_3_books_read.id}/books_read"
+    res = client.get(path, query_string={"page[after]": "", "page[limit]": 2})
+    assert res.status_code == 200
+    next_link = res.get_json()["links"]["next"]
+    assert urlsplit(next_link).path.rstrip("/") == path
+
+    seen = _ids(res) + _ids(_follow(client, next_link))
+    assert seen == expected
+
+
+def test_get_publisher_books_keyset(client, mock_publisher_with_3_books):
+    BookFactory.create()
+    expected = sorted(book.id for book in mock_publisher_with_3_books.books)
+    res = client.get(f"/Publishers/{mock_publisher_with_3_books.id}/books", query_string={"page[after]": ""})
+    assert res.status_code == 200
+    assert _ids(res) == expected
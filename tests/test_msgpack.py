@@ -0,0 +1,73 @@
+import datetime
+import decimal
+import uuid
+
+import pytest
+
+from app import models, negotiation
+from tests.factories import ThingFactory
+
+pytestmark = pytest.mark.skipif(not negotiation.available(), reason="msgpack isn't installed")
+
+MSGPACK_HEADERS = {"Accept": negotiation.MEDIA_TYPE}
+
+
+@pytest.fixture
+def msgpack_request(app, monkeypatch):
+    # the SafrsFastAPI rpc context (cfr. test_fastapi_adapter) resets the request class of the current flask app
+    monkeypatch.setattr(app, "request_class", negotiation.Request)
+
+
+def test_extension_types_round_trip():
+    document = {
+        "naive": datetime.datetime(2021, 3, 4, 5, 6, 7, 8),
+        "aware": datetime.datetime(2021, 3, 4, 5, 6, 7, 8, tzinfo=datetime.timezone.utc),
+        "before_epoch": datetime.datetime(1901, 2, 3, 4, 5, 6),
+        "date": datetime.date(2021, 3, 4),
+        "time": datetime.time(5, 6, 7, 8),
+        "uuid": uuid.UUID(int=1),
+        "decimal": decimal.Decimal("-1.50"),
+        "list": [None, True, 1, 1.25, "ünïcode", b"bytes"],
+    }
+    assert negotiation.unpackb(negotiation.packb(document)) == document
+
+
+def test_accept_negotiation():
+    assert negotiation.accepts_msgpack(negotiation.MEDIA_TYPE)
+    assert not negotiation.accepts_msgpack("application/vnd.api+json")
+    assert not negotiation.accepts_msgpack(f"{negotiation.MEDIA_TYPE};q=0.5, application/vnd.api+json")
+    assert not negotiation.accepts_msgpack(None)
+
+
+def test_get_msgpack_document(client, db_session):
+    created = datetime.datetime(2021, 3, 4, 5, 6, 7)
+    thing_id = ThingFactory.create(name="msgpack_thing", created=created).id
+
+    res = client.get(f"/thing/{thing_id}", headers=MSGPACK_HEADERS)
+    assert res.status_code == 200
+    assert res.headers["Content-Type"] == negotiation.MEDIA_TYPE
+    document = negotiation.unpackb(res.data)
+    assert document["data"]["attributes"]["created"] == created
+
+    expected = client.get(f"/thing/{thing_id}").get_json()
+    expected["data"]["attributes"]["created"] = created
+    assert document == expected
+
+
+def test_post_msgpack_payload(client, db_session, msgpack_request):
+    created = datetime.datetime(2021, 3, 4, 5, 6, 7)
+    data = {"attributes": {"name": "msgpack_created", "created": created}, "type": "Thing"}
+    headers = {"Content-Type": negotiation.MEDIA_TYPE, **MSGPACK_HEADERS}
+
+    res = client.post("/thing/", data=negotiation.packb({"data": data}), headers=headers)
+    assert res.status_code == 201
+    assert res.headers["Content-Type"] == negotiation.MEDIA_TYPE
+    assert negotiation.unpackb(res.data)["data"]["attributes"]["created"] == created
+
+    thing = db_session.query(models.Thing).filter(models.Thing.name == "msgpack_created").one()
+    assert thing.created == created
+
+
+def test_invalid_msgpack_payload(client, db_session, msgpack_request):
+    res = client.post("/thing/", data=b"\xc1", headers={"Content-Type": negotiation.MEDIA_TYPE})
+    assert res.status_code == 400
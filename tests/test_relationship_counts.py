@@ -0,0 +1,48 @@
+from tests.factories import BookFactory, PublisherFactory
+
+
+def _create_publishers(book_counts):
+    publishers = []
+    for book_count in book_counts:
+        publisher = PublisherFactory.create(name="counted_publisher")
+        for i in range(book_count):
+            BookFactory.create(publisher=publisher)
+        publishers.append(publisher)
+    return {publisher.id: [str(book_id) for book_id in sorted(book.id for book in publisher.books)] for publisher in publishers}
+
+
+def test_get_publishers_counts_books_without_loading_them(client, select_statements):
+    expected = _create_publishers([12, 2, 0])
+
+    query = {"filter[name]": "counted_publisher", "sort": "id"}
+    select_statements.clear()
+    res = client.get("/Publishers/", query_string={**query, "page[limit]": 1})
+    assert res.status_code == 200
+    few = len(select_statements)
+
+    select_statements.clear()
+    res = client.get("/Publishers/", query_string={**query, "page[limit]": 3})
+    assert res.status_code == 200
+    assert len(select_statements) == few
+
+    for publisher in res.get_json()["data"]:
+        books = publisher["relationships"]["books"]
+        book_ids = expected[int(publisher["id"])]
+        assert books["meta"]["count"] == len(book_ids)
+        assert [book["id"] for book in books["data"]] == book_ids[:10]
+        assert {book["type"] for book in books["data"]} <= {"Book"}
+        if len(book_ids) > 10:
+            assert "page[offset]=10" in books["links"]["next"]
+        else:
+            assert "next" not in books["links"]
+
+
+def test_get_publishers_include_books_isnt_counted(client):
+    expected = _create_publishers([12])
+
+    res = client.get("/Publishers/", query_string={"filter[name]": "counted_publisher", "include": "books"})
+    assert res.status_code == 200
+    publisher = res.get_json()["data"][0]
+    books = publisher["relationships"]["books"]
+    assert sorted(book["id"] for book in books["data"]) == expected[int(publisher["id"])]
+    assert "next" not in books["links"]
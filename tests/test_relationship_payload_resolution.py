@@ -0,0 +1,50 @@
+from types import SimpleNamespace
+
+from app import models
+from app.instances import resolve_instances
+from tests.factories import BookFactory, PersonFactory
+
+
+def _book_lookups(select_statements):
+    return [statement for statement in select_statements if 'FROM "Books"' in statement and '"Books".id IN' in statement]
+
+
+def test_patch_books_read_resolves_items_in_one_query(client, db_session, select_statements):
+    reader = PersonFactory.create(name="resolving_reader")
+    books = [BookFactory.create() for i in range(6)]
+    payload = {"data": [{"id": book.id, "type": book._s_type} for book in books]}
+    path = f"/People/{reader.id}/books_read"
+
+    select_statements.clear()
+    res = client.patch(path, json=payload)
+    assert res.status_code == 200
+    assert len(_book_lookups(select_statements)) == 1
+    assert not [statement for statement in select_statements if '"Books".id = ' in statement]
+
+    res = client.get(path)
+    assert sorted(book["id"] for book in res.get_json()["data"]) == sorted(str(item["id"]) for item in payload["data"])
+
+
+def test_post_books_read_reports_all_missing_ids(client, db_session):
+    reader = PersonFactory.create(name="resolving_reader")
+    book = BookFactory.create()
+    payload = {"data": [{"id": book.id, "type": "Book"}, {"id": 987654, "type": "Book"}, {"id": 987655, "type": "Book"}]}
+
+    res = client.post(f"/People/{reader.id}/books_read", json=payload)
+    assert res.status_code == 404
+    errors = res.get_json()["errors"]
+    assert len(errors) == 1
+    assert "987654" in errors[0]["detail"] and "987655" in errors[0]["detail"]
+
+
+def test_resolve_composite_keys_in_one_query(db_session, select_statements):
+    items = [models.PKItem(id=i, pk_A=f"resolveA{i}", pk_B=f"resolveB{i}", foo="resolve") for i in range(3)]
+    db_session.add_all(items)
+    db_session.flush()
+    missing_id = models.PKItem.id_type.get_id(SimpleNamespace(id=99, pk_A="resolveA", pk_B="resolveB"))
+
+    select_statements.clear()
+    instances, missing = resolve_instances(models.PKItem, [item.jsonapi_id for item in items] + [missing_id])
+    assert len(select_statements) == 1
+    assert sorted(instances.values(), key=lambda item: item.id) == items
+    assert missing == [missing_id]
@@ -0,0 +1,50 @@
+from tests.factories import BookFactory, PersonFactory, PublisherFactory
+
+
+def test_get_publisher_books_sorted_and_paginated_in_sql(client, select_statements):
+    publisher = PublisherFactory.create(name="sql_publisher")
+    for i in range(5):
+        BookFactory.create(publisher=publisher, title=f"sql_book_{i}")
+    BookFactory.create(publisher=PublisherFactory.create(name="other_publisher"), title="sql_book_9")
+    path = f"/Publishers/{publisher.id}/books"
+
+    select_statements.clear()
+    res = client.get(path, query_string={"sort": "-title", "page[offset]": 1, "page[limit]": 2})
+    assert res.status_code == 200
+    result = res.get_json()
+    assert [book["attributes"]["title"] for book in result["data"]] == ["sql_book_3", "sql_book_2"]
+    assert "page[offset]=3" in result["links"]["next"]
+    assert "last" in result["links"]
+    # the count of the relationship, not of the page
+    assert result["meta"]["count"] == 5
+    assert any("LIMIT" in statement and "ORDER BY" in statement for statement in select_statements)
+
+
+def test_get_person_books_read_sorted_and_paginated_in_sql(client, select_statements):
+    reader = PersonFactory.create(name="sql_reader")
+    for i in range(4):
+        BookFactory.create(reader=reader, title=f"sql_read_{i}")
+    BookFactory.create(reader=PersonFactory.create(name="other_reader"), title="sql_read_9")
+    path = f"/People/{reader.id}/books_read"
+
+    select_statements.clear()
+    res = client.get(path, query_string={"sort": "title", "page[limit]": 3})
+    assert res.status_code == 200
+    result = res.get_json()
+    assert [book["attributes"]["title"] for book in result["data"]] == ["sql_read_0", "sql_read_1", "sql_read_2"]
+    assert any("LIMIT" in statement and "ORDER BY" in statement for statement in select_statements)
+
+    res = client.get(path, query_string={"filter[title]": "sql_read_9"})
+    assert res.status_code == 200
+    assert res.get_json()["data"] == []
+
+
+def test_keyset_relationship_page_count(client):
+    publisher = PublisherFactory.create(name="keyset_publisher")
+    for i in range(3):
+        BookFactory.create(publisher=publisher, title=f"keyset_book_{i}")
+    res = client.get(f"/Publishers/{publisher.id}/books", query_string={"sort": "title", "page[after]": "", "page[limit]": 2})
+    assert res.status_code == 200
+    result = res.get_json()
+    assert len(result["data"]) == 2
+    assert result["meta"]["count"] == 3
@@ -0,0 +1,155 @@
+import time
+
+import pytest
+
+from app import invalidation, response_cache
+from app.cache import MemoryCache, create_backend
+from app.models import Book, Person
+from tests.factories import BookFactory
+from tests.helpers.redis_stub import RedisStub
+
+
+@pytest.fixture
+def memory_cache(client):
+    cache = MemoryCache()
+    response_cache.configure(cache)
+    yield cache
+    response_cache.configure(None)
+
+
+def _update(db_session, Model, instance_id, **values):
+    db_session.query(Model).filter(Model.id == instance_id).update(values)
+    db_session.commit()
+
+
+def test_cached_response(client, db_session, memory_cache, shared_books, select_statements):
+    path = f"/Books/{shared_books['book_ids'][0]}"
+    res = client.get(path)
+    assert res.status_code == 200
+    assert len(memory_cache) == 1
+
+    select_statements.clear()
+    cached = client.get(path)
+    assert cached.status_code == 200
+    assert not select_statements
+    assert cached.data == res.data
+    assert cached.headers["Content-Type"] == res.headers["Content-Type"]
+    assert cached.headers["ETag"] == res.headers["ETag"]
+    assert client.get(path, headers={"If-None-Match": res.headers["ETag"]}).status_code == 304
+
+    _update(db_session, Book, shared_books["book_ids"][0], title="cached_renamed")
+    assert len(memory_cache) == 0
+    assert client.get(path).get_json()["data"]["attributes"]["title"] == "cached_renamed"
+
+
+def test_request_shape_is_part_of_the_key(client, memory_cache, shared_books):
+    path = f"/Books/{shared_books['book_ids'][0]}"
+    client.get(path)
+    client.get(path, query_string={"fields[Book]": "title"})
+    client.get(path, query_string={"include": "reader"})
+    client.get(path, headers={"Authorization": "Bearer other"})
+    assert len(memory_cache) == 4
+
+
+def test_included_models_invalidate(client, db_session, memory_cache, shared_books):
+    query = {"filter[publisher_id]": shared_books["publisher_id"], "include": "reader", "page[limit]": 10}
+    assert client.get("/Books/", query_string=query).status_code == 200
+    client.get("/Books/", query_string={**query, "include": "publisher"})
+    assert len(memory_cache) == 2
+
+    _update(db_session, Person, shared_books["reader_id"], name="cached_renamed")
+    # the documents that include the publisher don't depend on the people
+    assert len(memory_cache) == 1
+    included = client.get("/Books/", query_string=query).get_json()["included"]
+    assert included[0]["attributes"]["name"] == "cached_renamed"
+
+
+def test_flushed_instances_invalidate(client, db_session, memory_cache, shared_books):
+    query = {"filter[publisher_id]": shared_books["publisher_id"], "page[limit]": 10}
+    assert len(client.get("/Books/", query_string=query).get_json()["data"]) == 4
+    BookFactory.create(title="shared_book4", publisher_id=shared_books["publisher_id"])
+    assert len(client.get("/Books/", query_string=query).get_json()["data"]) == 5
+
+
+def test_rollback_keeps_entries(client, db_session, memory_cache, shared_books):
+    client.get(f"/Books/{shared_books['book_ids'][0]}")
+    db_session.query(Book).filter(Book.id == shared_books["book_ids"][0]).update({"title": "rolled_back"})
+    db_session.rollback()
+    db_session.commit()
+    assert len(memory_cache) == 1
+
+
+def test_invalidated_while_rendering(client, memory_cache, shared_books, monkeypatch):
+    dependencies = response_cache.dependencies
+
+    def concurrent_commit(Model, ctx):
+        # another worker commits a write of the books after the rows were read
+        invalidation.evict("Books", None)
+        return dependencies(Model, ctx)
+
+    monkeypatch.setattr(response_cache, "dependencies", concurrent_commit)
+    path = f"/Books/{shared_books['book_ids'][0]}"
+    assert client.get(path).status_code == 200
+    assert len(memory_cache) == 0
+
+    monkeypatch.setattr(response_cache, "dependencies", dependencies)
+    client.get(path)
+    assert len(memory_cache) == 1
+
+
+def test_memory_cache_byte_budget():
+    cache = MemoryCache(max_bytes=100)
+    cache.set("a", b"x" * 40, ["Books"])
+    cache.set("b", b"x" * 40, ["People"])
+    cache.get("a")
+    cache.set("c", b"x" * 40, ["Books"])
+    # the least recently used entry was evicted
+    assert cache.get("b") is None
+    assert cache.get("a") == cache.get("c") == b"x" * 40
+    assert cache.size == 82
+    # entries larger than the budget aren't cached
+    cache.set("d", b"x" * 100)
+    assert cache.get("d") is None
+
+    cache.invalidate(["Books"])
+    assert len(cache) == 0
+    assert cache.size == 0
+
+
+def test_memory_cache_ttl():
+    cache = MemoryCache()
+    cache.set("a", b"first", ttl=0.05)
+    cache.set("b", b"second")
+    time.sleep(0.1)
+    assert cache.get("a") is None
+    assert cache.get("b") == b"second"
+    assert cache.size == len("b") + len(b"second")
+
+
+def test_redis_cache():
+    with RedisStub(password="secret") as server:
+        cache = create_backend(server.url)
+        cache.set("a", b"first\r\nvalue", ["Books", "People"], ttl=60)
+        cache.set("b", b"second", ["People"])
+        cache.set("c", b"third", ["Publishers"])
+        assert cache.get("a") == b"first\r\nvalue"
+        assert cache.get("missing") is None
+
+        cache.invalidate(["Books"])
+        assert cache.get("a") is None
+        assert cache.get("b") == b"second"
+
+        cache.clear()
+        assert cache.get("c") is None
+        assert server.commands[0] == "AUTH"
+
+    # the cache behaves like an empty cache when the server is gone
+    assert cache.get("b") is None
+    cache.set("b", b"second")
+
+
+def test_create_backend():
+    assert create_backend("") is None
+    assert create_backend("memory", "1024").max_bytes == 1024
+    with pytest.raises(ValueError):
+        create_backend("memcached://localhost")
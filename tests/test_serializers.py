@@ -0,0 +1,62 @@
+import datetime
+
+import pytest
+
+from app import models, serializers
+from tests.factories import BookFactory, PersonFactory, PublisherFactory, ThingFactory
+
+
+@pytest.fixture
+def serialized_data(db_session):
+    author = PersonFactory.create(name="serialized_author")
+    publisher = PublisherFactory.create(name="serialized_publisher")
+    for i in range(3):
+        BookFactory.create(title=f"serialized_book{i}", author=author, reader=author, publisher=publisher)
+    ThingFactory.create(name="serialized_thing", created=datetime.datetime(2021, 3, 4, 5, 6, 7, 8))
+    db_session.flush()
+
+
+REQUESTS = [
+    ("/People/", {"filter[name]": "serialized_author", "include": "books_written.publisher"}),
+    ("/Books/", {"sort": "title", "fields[Book]": "title,author"}),
+    ("/Books/", {"include": "author,publisher", "fields[Person]": "name"}),
+    ("/Publishers/", {"filter[name]": "serialized_publisher"}),
+    ("/thing/", {"filter[name]": "serialized_thing"}),
+    ("/UsersWithJsonapiAttr/", {}),
+    ("/thing_with_type/", {}),
+]
+
+
+def _document(res):
+    document = res.get_json()
+    # the included resources are collected in a set
+    document["included"] = sorted(document.get("included", []), key=lambda item: (item["type"], item["id"]))
+    return document
+
+
+@pytest.mark.parametrize("path,query", REQUESTS)
+def test_compiled_serializers_encode_like_safrs(client, serialized_data, monkeypatch, path, query):
+    compiled = client.get(path, query_string=query)
+    assert compiled.status_code == 200
+
+    monkeypatch.setattr(serializers, "_serializers", {})
+    expected = client.get(path, query_string=query)
+    assert expected.status_code == 200
+    assert _document(compiled) == _document(expected)
+
+
+def test_exposed_models_are_compiled(client):
+    for Model in [models.Book, models.Person, models.Publisher, models.Thing, models.SubThing]:
+        assert serializers.serializer(Model) is not None
+    # permissions that may depend on the instance are left to safrs
+    assert serializers.serializer(models.UserWithPerms) is None
+
+
+def test_to_dict_override_is_honoured(client, serialized_data):
+    res = client.get("/Publishers/", query_string={"filter[name]": "serialized_publisher"})
+    assert res.get_json()["data"][0]["attributes"]["custom_field"] == "some customization"
+
+
+def test_invalid_include_is_rejected(client, serialized_data):
+    res = client.get("/Books/", query_string={"include": "no_such_relationship"})
+    assert res.status_code == 400
@@ -0,0 +1,83 @@
+import multiprocessing
+
+import pytest
+
+from app.cache import SharedMemoryCache, create_backend
+
+
+@pytest.fixture
+def cache_path(tmp_path):
+    return str(tmp_path / "safrs-cache")
+
+
+def _set_in_child(path, key, value):
+    SharedMemoryCache(path, 64 * 1024).set(key, value, ["Books"])
+
+
+def test_shared_memory_cache(cache_path):
+    cache = SharedMemoryCache(cache_path, 64 * 1024)
+    cache.set("a", b"first", ["Books", "People"])
+    cache.set("b", b"second", ["People"])
+    cache.set("c", b"", ["Publishers"])
+    cache.set("a", b"replaced", ["Books"])
+    assert cache.get("a") == b"replaced"
+    assert cache.get("c") == b""
+    assert cache.get("missing") is None
+    assert len(cache) == 3
+
+    cache.invalidate(["People"])
+    assert cache.get("b") is None
+    assert cache.get("a") == b"replaced"
+
+    cache.set("expired", b"value", ttl=-1)
+    assert cache.get("expired") is None
+
+    cache.clear()
+    assert len(cache) == 0
+    assert cache.get("a") is None
+
+
+def test_entries_are_shared_between_processes(cache_path):
+    cache = SharedMemoryCache(cache_path, 64 * 1024)
+    process = multiprocessing.get_context("fork").Process(target=_set_in_child, args=(cache_path, "child", b"from the child"))
+    process.start()
+    process.join(10)
+    assert process.exitcode == 0
+    assert cache.get("child") == b"from the child"
+
+    # a process that was forked after the cache was opened
+    process = multiprocessing.get_context("fork").Process(target=cache.invalidate, args=(["Books"],))
+    process.start()
+    process.join(10)
+    assert cache.get("child") is None
+
+
+def test_least_recently_used_entries_are_evicted(cache_path):
+    cache = SharedMemoryCache(cache_path, 64 * 1024)
+    value = b"x" * 1000
+    cache.set("hot", value, ["Books"])
+    for i in range(200):
+        cache.set(f"key{i}", value, [f"tag{i}"])
+        assert cache.get("hot") == value
+    assert cache.get("key199") == value
+    assert cache.get("key0") is None
+    assert len(cache) < 64
+    # entries larger than half of the data area aren't cached
+    cache.set("large", b"x" * 64 * 1024)
+    assert cache.get("large") is None
+
+
+def test_tombstones_are_reused(cache_path):
+    cache = SharedMemoryCache(cache_path, 64 * 1024)
+    for i in range(1000):
+        cache.set(f"key{i % 7}", str(i).encode(), [f"tag{i % 7}"])
+        cache.invalidate([f"tag{(i + 3) % 7}"])
+    assert [cache.get(f"key{i}") for i in range(7)] == [None, None, b"996", b"997", b"998", b"999", None]
+    assert len(cache) == 4
+
+
+def test_create_shared_memory_backend(cache_path):
+    cache = create_backend(f"shm://{cache_path}", 128 * 1024)
+    assert isinstance(cache, SharedMemoryCache)
+    cache.set("a", b"value")
+    assert create_backend(f"shm://{cache_path}").get("a") == b"value"
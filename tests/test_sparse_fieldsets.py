@@ -0,0 +1,44 @@
+from tests.factories import BookFactory, PersonFactory, PublisherFactory
+
+
+def test_get_people_sparse_fieldset_skips_unrequested_columns(client, select_statements):
+    PersonFactory.create(name="sparse_person", comment="a long comment")
+
+    res = client.get("/People/", query_string={"filter[name]": "sparse_person", "fields[Person]": "name"})
+    assert res.status_code == 200
+    person = res.get_json()["data"][0]
+    assert person["attributes"] == {"name": "sparse_person"}
+
+    people_query = [stmt for stmt in select_statements if 'FROM "People"' in stmt and "count(*)" not in stmt][-1]
+    assert '"People".name' in people_query
+    assert '"People".comment' not in people_query
+    assert '"People".password' not in people_query
+
+
+def test_get_books_sparse_fieldset_keeps_linkage_columns(client, select_statements):
+    publisher = PublisherFactory.create(name="sparse_publisher", data={"large": "document"})
+    reader = PersonFactory.create(name="sparse_reader")
+    BookFactory.create(title="sparse_book", publisher=publisher, reader=reader)
+    publisher_id = str(publisher.id)
+
+    res = client.get(
+        "/Books/",
+        query_string={
+            "filter[title]": "sparse_book",
+            "include": "publisher,reader",
+            "fields[Book]": "title",
+            "fields[Publisher]": "name",
+        },
+    )
+    assert res.status_code == 200
+    result = res.get_json()
+    assert result["data"][0]["attributes"] == {"title": "sparse_book"}
+    assert result["data"][0]["relationships"]["publisher"]["data"]["id"] == publisher_id
+    included = {inc["type"]: inc for inc in result["included"]}
+    assert included["Publisher"]["attributes"]["name"] == "sparse_publisher"
+    assert included["Person"]["attributes"]["name"] == "sparse_reader"
+
+    books_query = [stmt for stmt in select_statements if 'FROM "Books"' in stmt and "count(*)" not in stmt][-1]
+    assert '"Books".publisher_id' in books_query
+    assert '"Books".published' not in books_query
+    assert '"Publishers_1".data' not in books_query
@@ -0,0 +1,49 @@
+from app import statement_cache
+from tests.factories import PersonFactory
+
+
+def _shapes(type_name):
+    return {shape: counters for shape, counters in statement_cache.stats().snapshot().items() if shape[0] == type_name}
+
+
+def test_same_shape_requests_hit_the_compiled_cache(client, db_session):
+    for i in range(3):
+        PersonFactory.create(name=f"cached_person{i}")
+    statement_cache.stats().reset()
+
+    for i in range(3):
+        query = {"filter[name]": f"cached_person{i}", "sort": "-id", "page[limit]": 2, "fields[Person]": "name"}
+        res = client.get("/People/", query_string=query)
+        assert res.status_code == 200
+        assert res.get_json()["data"][0]["attributes"]["name"] == f"cached_person{i}"
+
+    shapes = _shapes("Person")
+    assert len(shapes) == 1
+    shape, counters = shapes.popitem()
+    assert shape[1:3] == (("filter[name]",), "-id")
+    assert counters["hits"] >= 2 * counters["misses"]
+    assert statement_cache.stats().hit_rate(shape) >= 2 / 3
+
+
+def test_request_shapes_are_counted_separately(client, db_session):
+    statement_cache.stats().reset()
+
+    assert client.get("/People/", query_string={"sort": "name"}).status_code == 200
+    assert client.get("/People/", query_string={"sort": "email"}).status_code == 200
+    assert client.get("/People/", query_string={"sort": "email", "include": "books_read"}).status_code == 200
+
+    assert len(_shapes("Person")) == 3
+
+
+def test_shapes_are_bounded():
+    stats = statement_cache.StatementCacheStats(max_shapes=2)
+    stats.record(("Person", "a"), statement_cache.HITS)
+    stats.record(("Person", "b"), statement_cache.MISSES)
+    stats.record(("Person", "a"), statement_cache.HITS)
+    stats.record(("Person", "c"), statement_cache.HITS)
+    stats.record(("Person", "d"), statement_cache.UNCACHED)
+
+    snapshot = stats.snapshot()
+    assert set(snapshot) == {("Person", "c"), ("Person", "d"), statement_cache.OVERFLOW}
+    assert snapshot[statement_cache.OVERFLOW] == {"hits": 2, "misses": 1, "uncached": 0}
+    assert stats.hit_rate() == 3 / 4
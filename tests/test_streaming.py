@@ -0,0 +1,71 @@
+import pytest
+
+from app import response_cache, streaming
+from app.cache import MemoryCache
+from tests.factories import BookFactory, PersonFactory, PublisherFactory
+
+STREAMED_LIMIT = 1000
+
+
+@pytest.fixture
+def streamed_publisher_id(db_session):
+    author = PersonFactory.create(name="streamed_author")
+    publisher = PublisherFactory.create(name="streamed_publisher")
+    for i in range(2 * streaming.CHUNK_SIZE + 5):
+        BookFactory.create(title=f"streamed_book{i:03}", author=author, publisher=publisher)
+    db_session.flush()
+    return publisher.id
+
+
+def _get(client, publisher_id, limit, **query):
+    query = {"filter[publisher_id]": publisher_id, "sort": "title", "page[limit]": limit, **query}
+    res = client.get("/Books/", query_string=query)
+    assert res.status_code == 200
+    return res.get_json()
+
+
+def test_streamed_page_matches_the_built_page(client, streamed_publisher_id):
+    streamed = _get(client, streamed_publisher_id, STREAMED_LIMIT, include="author,publisher")
+    built = _get(client, streamed_publisher_id, STREAMED_LIMIT - 1, include="author,publisher")
+
+    assert [item["attributes"]["title"] for item in streamed["data"]] == [f"streamed_book{i:03}" for i in range(2 * streaming.CHUNK_SIZE + 5)]
+    assert streamed["data"] == built["data"]
+    assert sorted(streamed["included"], key=lambda item: item["type"]) == sorted(built["included"], key=lambda item: item["type"])
+    assert streamed["meta"]["count"] == built["meta"]["count"] == 2 * streaming.CHUNK_SIZE + 5
+    assert streamed["jsonapi"] == built["jsonapi"]
+
+
+@pytest.mark.parametrize("strategy", ["exact", "window", "none"])
+def test_streamed_page_counts(client, streamed_publisher_id, strategy):
+    document = _get(client, streamed_publisher_id, STREAMED_LIMIT, **{"page[count]": strategy, "page[offset]": 200})
+
+    assert len(document["data"]) == 5
+    assert document["meta"]["count_strategy"] == strategy
+    assert document["meta"]["count"] == (None if strategy == "none" else 2 * streaming.CHUNK_SIZE + 5)
+    assert "next" not in document["links"]
+
+
+def test_streamed_page_past_the_last_row(client, streamed_publisher_id):
+    document = _get(client, streamed_publisher_id, STREAMED_LIMIT, **{"page[count]": "window", "page[offset]": 300})
+    assert document["data"] == []
+    assert document["included"] == []
+    assert document["meta"]["count"] == 2 * streaming.CHUNK_SIZE + 5
+
+
+def test_streaming_requested(app):
+    assert not streaming.streaming_requested(None)
+    assert streaming.streaming_requested(STREAMED_LIMIT)
+    assert not streaming.streaming_requested(STREAMED_LIMIT - 1)
+
+
+def test_unpaginated_collection_is_cached(client, streamed_publisher_id):
+    cache = MemoryCache()
+    response_cache.configure(cache)
+    try:
+        res = client.get("/Books/", query_string={"filter[publisher_id]": streamed_publisher_id})
+        assert res.status_code == 200
+        assert "ETag" in res.headers
+        # unstreamed documents are stored in the response cache
+        assert len(cache) == 1
+    finally:
+        response_cache.configure(None)
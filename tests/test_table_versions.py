@@ -0,0 +1,87 @@
+from types import SimpleNamespace
+
+import pytest
+from sqlalchemy import text
+
+from app import table_versions
+from app.models import Book, Publisher
+from tests.factories import BookFactory
+
+
+@pytest.fixture
+def hooks(monkeypatch):
+    monkeypatch.setattr(table_versions, "_mode", table_versions.HOOKS)
+
+
+@pytest.fixture
+def triggers(db_session, monkeypatch):
+    monkeypatch.setattr(table_versions, "_mode", table_versions.TRIGGERS)
+    # created in the transaction of the test
+    table_versions.install_triggers(db_session.connection())
+
+
+def _versions(db_session, *tables):
+    return table_versions.versions(tables, db_session, SimpleNamespace())
+
+
+def test_writes_bump_the_versions(db_session, hooks, shared_books):
+    before = _versions(db_session, "Books", "People")
+    BookFactory.create(title="versioned_book3")
+    assert _versions(db_session, "Books", "People") == {"Books": before["Books"] + 1, "People": before["People"]}
+
+    db_session.query(Book).filter(Book.id == shared_books["book_ids"][0]).update({"title": "versioned_bulk"})
+    assert _versions(db_session, "Books")["Books"] == before["Books"] + 2
+    assert _versions(db_session, "never_written") == {"never_written": 0}
+
+
+def test_versions_are_memoized(db_session, hooks, shared_books, select_statements):
+    ctx = SimpleNamespace()
+    versions = table_versions.versions(["Books", "Publishers"], db_session, ctx)
+    assert table_versions.versions(["Publishers"], db_session, ctx) == {"Publishers": versions["Publishers"]}
+    assert len(select_statements) == 1
+
+
+def test_included_document_not_modified(client, db_session, triggers, shared_books, select_statements):
+    path = f"/Books/{shared_books['book_ids'][0]}"
+    query = {"include": "publisher"}
+    etag = client.get(path, query_string=query).headers["ETag"]
+
+    select_statements.clear()
+    res = client.get(path, query_string=query, headers={"If-None-Match": etag})
+    assert res.status_code == 304
+    # only the versions of the Books and Publishers tables were selected
+    assert len(select_statements) == 1
+
+    db_session.query(Publisher).filter(Publisher.id == shared_books["publisher_id"]).update({"name": "versioned_renamed"})
+    db_session.commit()
+    res = client.get(path, query_string=query, headers={"If-None-Match": etag})
+    assert res.status_code == 200
+    assert res.get_json()["included"][0]["attributes"]["name"] == "versioned_renamed"
+
+
+def test_collection_not_modified(client, triggers, shared_books, select_statements):
+    query = {"filter[publisher_id]": shared_books["publisher_id"], "page[limit]": 2}
+    etag = client.get("/Books/", query_string=query).headers["ETag"]
+
+    select_statements.clear()
+    assert client.get("/Books/", query_string=query, headers={"If-None-Match": etag}).status_code == 304
+    assert len(select_statements) == 1
+
+
+def test_triggers(db_session, triggers, shared_books):
+    before = _versions(db_session, "Books")["Books"]
+    # a write that bypasses the session
+    db_session.connection().execute(text('UPDATE "Books" SET title = title'))
+    assert _versions(db_session, "Books")["Books"] == before + 1
+
+
+def test_hooks_dont_validate_etags(client, db_session, hooks, shared_books):
+    path = f"/Books/{shared_books['book_ids'][0]}"
+    query = {"include": "publisher"}
+    etag = client.get(path, query_string=query).headers["ETag"]
+    # the hooks don't see the writes that bypass the session
+    db_session.execute(text('UPDATE "Publishers" SET name = :name WHERE id = :id'), {"name": "versioned_raw", "id": shared_books["publisher_id"]})
+    db_session.commit()
+    res = client.get(path, query_string=query, headers={"If-None-Match": etag})
+    assert res.status_code == 200
+    assert res.get_json()["included"][0]["attributes"]["name"] == "versioned_raw"
@@ -0,0 +1,40 @@
+from tests.factories import BookFactory, PersonFactory, PublisherFactory, SubThingFactory
+
+
+def _target_queries(select_statements, table):
+    return [statement for statement in select_statements if f"FROM {table}" in statement or f"JOIN {table}" in statement]
+
+
+def test_book_to_one_linkage_from_foreign_keys(client, db_session, select_statements):
+    author = PersonFactory.create(name="linked_author")
+    publisher = PublisherFactory.create(name="linked_publisher")
+    book = BookFactory.create(title="linked_book", author=author, publisher=publisher)
+    book_id, author_id, publisher_id = book.id, author.id, publisher.id
+    db_session.expire_all()
+
+    select_statements.clear()
+    res = client.get("/Books/", query_string={"filter[title]": "linked_book"})
+    assert res.status_code == 200
+    relationships = res.get_json()["data"][0]["relationships"]
+    assert relationships["author"]["data"] == {"id": str(author_id), "type": "Person"}
+    assert relationships["publisher"]["data"] == {"id": str(publisher_id), "type": "Publisher"}
+    assert relationships["reader"]["data"] is None
+    assert not _target_queries(select_statements, '"People"')
+    assert not _target_queries(select_statements, '"Publishers"')
+
+    res = client.get(f"/Books/{book_id}/", query_string={"include": "author"})
+    assert res.status_code == 200
+    assert res.get_json()["data"]["relationships"]["author"]["data"] == {"id": str(author_id), "type": "Person"}
+    assert [item["id"] for item in res.get_json()["included"]] == [str(author_id)]
+
+
+def test_subthing_to_one_linkage_from_foreign_key(client, db_session, select_statements):
+    subthing = SubThingFactory.create(name="linked_subthing")
+    thing_id = subthing.thing.id
+    db_session.expire_all()
+
+    select_statements.clear()
+    res = client.get("/subthing/", query_string={"filter[name]": "linked_subthing"})
+    assert res.status_code == 200
+    assert res.get_json()["data"][0]["relationships"]["thing"]["data"] == {"id": str(thing_id), "type": "Thing"}
+    assert not _target_queries(select_statements, "thing")